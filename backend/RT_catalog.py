@@ -0,0 +1,218 @@
+# This file holds the catalog of the volumes assembled in ../data, and their retention
+# Every ingested volume is recorded in a SQLite table indexed by (radar, scan time), so the latest scan and time
+# range lookups of the product endpoints are index seeks instead of a glob and a strptime of every file name.
+# The same table drives the retention policy, which deletes volumes by age and by total disk budget
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from glob import glob
+
+from RT_data_processing import radar_file_time
+from RT_product_cache import product_cache, schedule_precompute
+from RT_gridding import grid_tables
+from RT_geometry import gate_geometry
+
+DATA_DIR = "../data"
+CATALOG_DB = os.environ.get("CATALOG_DB", "../data/catalog.sqlite3")
+RETENTION_MAX_AGE = float(os.environ.get("RETENTION_MAX_AGE_HOURS", 24)) * 3600  # Seconds of scan time kept
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", 50 * 1024**3))  # ~50 GB of volumes
+VOLUME_NAME = re.compile(r"^([A-Z0-9]{4})_\d{8}-\d{6}\.bin$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    path TEXT PRIMARY KEY,
+    radar_id TEXT NOT NULL,
+    scan_time REAL NOT NULL,
+    size INTEGER NOT NULL,
+    vcp INTEGER,
+    fields TEXT,
+    elevations TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_by_radar ON scans (radar_id, scan_time);
+CREATE INDEX IF NOT EXISTS scans_by_time ON scans (scan_time);
+"""
+
+def _timestamp(moment):
+    """Unix seconds of a datetime, naive ones being UTC like the scan times."""
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+def _scan_time(file_path):
+    return _timestamp(radar_file_time(file_path))
+
+class ScanCatalog:
+    """
+    Index of the assembled volumes of every radar.
+
+    Rows hold the site, scan time, size, and once the volume summary is known (see get_volume_meta in
+    RT_product_cache), its VCP, fields and elevations. Every thread gets its own connection.
+    """
+
+    def __init__(self, db_path=CATALOG_DB, data_dir=DATA_DIR):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self._local = threading.local()
+        self._retention_lock = threading.Lock()
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    def add(self, file_path, meta=None):
+        """Records (or refreshes) a volume, with its {fields, sweeps, vcp} summary if known."""
+        match = VOLUME_NAME.match(os.path.basename(file_path))
+        if match is None:
+            raise ValueError(f"Not an assembled volume name: {file_path}")
+        meta = meta or {}
+        self._db().execute(
+            "INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (file_path, match.group(1), _scan_time(file_path), os.path.getsize(file_path), meta.get("vcp"),
+             json.dumps(meta["fields"]) if "fields" in meta else None,
+             json.dumps(sorted(float(elevation) for elevation in meta["sweeps"])) if "sweeps" in meta else None),
+        )
+
+    def remove(self, file_path):
+        self._db().execute("DELETE FROM scans WHERE path = ?", (file_path,))
+
+    def _existing(self, rows):
+        """Drops rows whose file was deleted behind the catalog's back."""
+        present = []
+        for row in rows:
+            if os.path.exists(row[0]):
+                present.append(row)
+            else:
+                self.remove(row[0])
+        return present
+
+    def latest(self, radar_id):
+        """Returns the path of the latest volume of a radar, or None."""
+        rows = self.recent(radar_id, 1)
+        return rows[-1] if rows else None
+
+    def recent(self, radar_id, count):
+        """Returns the paths of the latest count volumes of a radar, oldest first."""
+        rows = self._db().execute(
+            "SELECT path FROM scans WHERE radar_id = ? ORDER BY scan_time DESC LIMIT ?", (radar_id, count)
+        ).fetchall()
+        present = self._existing(rows)
+        if len(present) < len(rows):
+            return self.recent(radar_id, count)
+        return [row[0] for row in reversed(present)]
+
+    def between(self, radar_id, start=None, end=None):
+        """
+        Lists the volumes of a radar scanned within [start, end] (datetimes, UTC; open ended if None).
+
+        Returns:
+            list: {file (name in the data directory), scan_time (ISO 8601), size, vcp, fields, elevations} dicts,
+            oldest first.
+        """
+        start = _timestamp(start) if start else float("-inf")
+        end = _timestamp(end) if end else float("inf")
+        rows = self._db().execute(
+            "SELECT path, scan_time, size, vcp, fields, elevations FROM scans "
+            "WHERE radar_id = ? AND scan_time BETWEEN ? AND ? ORDER BY scan_time", (radar_id, start, end)
+        ).fetchall()
+        return [{
+            "file": os.path.basename(path),
+            "scan_time": datetime.fromtimestamp(scan_time, timezone.utc).isoformat(),
+            "size": size,
+            "vcp": vcp,
+            "fields": json.loads(fields) if fields else None,
+            "elevations": json.loads(elevations) if elevations else None,
+        } for path, scan_time, size, vcp, fields, elevations in self._existing(rows)]
+
+    def sync(self):
+        """Reconciles the catalog with the data directory: records unknown volumes and forgets deleted ones."""
+        on_disk = {path for path in glob(os.path.join(self.data_dir, "*.bin")) if VOLUME_NAME.match(os.path.basename(path))}
+        known = {row[0] for row in self._db().execute("SELECT path FROM scans")}
+        for path in known - on_disk:
+            self.remove(path)
+        for path in on_disk - known:
+            meta = product_cache.get(path, "_volume", -1, "json")  # Summary of volumes already precomputed
+            self.add(path, json.loads(meta) if meta is not None else None)
+        print(f"Scan catalog: {len(on_disk)} volumes, {len(on_disk - known)} added, {len(known - on_disk)} removed")
+
+    def enforce_retention(self, max_age=RETENTION_MAX_AGE, max_bytes=RETENTION_MAX_BYTES, now=None):
+        """
+        Deletes volumes older than max_age seconds, then the oldest ones until the total is within max_bytes.
+        The latest volume of every radar is always kept, so a quiet site still has something to serve. Grid
+        mapping tables and gate geometry files that went unused for a while are deleted too (see the evict()
+        methods in RT_gridding and RT_geometry).
+
+        Returns:
+            int: Number of bytes of volumes freed.
+        """
+        now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        with self._retention_lock:
+            db = self._db()
+            # Oldest first, without the latest scan of each radar
+            candidates = db.execute(
+                "SELECT path, scan_time, size FROM scans WHERE scan_time < "
+                "(SELECT MAX(scan_time) FROM scans AS latest WHERE latest.radar_id = scans.radar_id) ORDER BY scan_time"
+            ).fetchall()
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM scans").fetchone()[0]
+
+            freed = 0
+            for path, scan_time, size in candidates:
+                if scan_time >= now - max_age and total <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.remove(path)
+                total -= size
+                freed += size
+            freed_tables = grid_tables.evict() + gate_geometry.evict()
+        if freed:
+            print(f"Retention freed {freed / 1024**2:.1f} MB of volumes, {total / 1024**2:.1f} MB kept")
+        if freed_tables:
+            print(f"Retention freed {freed_tables / 1024**2:.1f} MB of grid mapping tables and gate geometry")
+        return freed
+
+    def stats(self):
+        count, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM scans").fetchone()
+        radars = self._db().execute("SELECT COUNT(DISTINCT radar_id) FROM scans").fetchone()[0]
+        return {"volumes": count, "radars": radars, "bytes": total, "max_bytes": RETENTION_MAX_BYTES,
+                "max_age_hours": RETENTION_MAX_AGE / 3600}
+
+# Shared catalog of ../data, updated by every ingest path
+scan_catalog = ScanCatalog()
+
+# One ingest per radar at a time, so the scheduler, requests and the progressive ingest never assemble or
+# publish the same volume twice
+_ingest_locks = {}
+_ingest_locks_lock = threading.Lock()
+
+def ingest_lock(radar_id):
+    """Returns the lock held by every ingest path while it assembles and publishes a volume of a radar."""
+    with _ingest_locks_lock:
+        return _ingest_locks.setdefault(radar_id, threading.Lock())
+
+def _record_meta(file_path, future):
+    """Adds the summary of a volume to its catalog row once its products are precomputed."""
+    if future.exception() is None:
+        try:
+            scan_catalog.add(file_path, product_cache.get_volume_meta(file_path))
+        except (OSError, ValueError) as e:
+            print(f"Error cataloging {file_path}: {e}")
+
+def register_volume(file_path):
+    """
+    Publishes a freshly assembled volume: records it in the catalog, queues its products for precomputation
+    and applies the retention policy.
+    """
+    scan_catalog.add(file_path)
+    future = schedule_precompute(file_path)
+    future.add_done_callback(lambda future: _record_meta(file_path, future))
+    scan_catalog.enforce_retention()
+    return future
@@ -0,0 +1,173 @@
+# This file holds the contoured polygon products
+# Instead of one quad per gate, a sweep is drawn as a few filled isobands of its field's colour scale (see
+# color_table in RT_data_processing): marching squares over the quantized codes on the polar (azimuth bin, gate)
+# grid, then each band is projected, simplified within a tolerance and emitted as a few large polygons with holes
+import bisect
+
+import numpy as np
+import pyart
+import contourpy
+
+try:
+    import shapely  # Optional: simplifies the contours; without it they keep every marching squares vertex
+except ImportError:
+    shapely = None
+
+from RT_data_processing import color_table, quantize_sweep, feature_collection_chunks, select_sweep
+from RT_gridding import canonical_sweep
+from RT_volume_cache import read_radar
+from RT_product_cache import product_cache, product_sweep, read_sweep
+
+CONTOUR_TOLERANCE = 1000.0  # Default distance (m) a simplified contour may stray from the marching squares one
+MAX_CONTOUR_TOLERANCE = 20000.0
+COORDINATE_DECIMALS = 5  # About a meter
+CONTOUR_BANDS = 16  # Bands over the norm range of a field: 5 dBZ for reflectivity
+
+def contour_bands(field, count=CONTOUR_BANDS):
+    """
+    Splits the codes of a field into count equal bands (see field_quantization in RT_data_processing).
+
+    Returns:
+        list: (first code, end code, code drawn) of every band, end exclusive. The band is drawn in the colour of
+        its middle code; bands whose colour is fully transparent are left out, they would draw nothing.
+    """
+    table = color_table(field)
+    starts = [run[0] for run in table["runs"]]
+    edges = np.linspace(0, table["levels"], count + 1).round().astype(int)
+    bands = []
+    for first, end in zip(edges[:-1], edges[1:]):
+        middle = int((first + end - 1) // 2)
+        run = table["runs"][bisect.bisect_right(starts, middle) - 1]
+        if run[4] > 0:
+            bands.append((int(first), int(end), middle))
+    return bands
+
+def band_polygons(generator, first, end):
+    """
+    Runs marching squares for one band of codes.
+
+    Returns:
+        tuple: (points float64[n, 2] of (gate, azimuth bin) grid coordinates, ring offsets into the points,
+        polygon offsets into the rings), or None if the band is empty.
+    """
+    points, offsets, outer_offsets = generator.filled(first - 0.5, end - 0.5)
+    if not points or points[0] is None:
+        return None
+    return points[0], offsets[0], outer_offsets[0]
+
+def drop_small_rings(points, offsets, outer_offsets, min_area):
+    """
+    Drops the rings enclosing less than min_area: whole polygons when it is their outer ring, holes otherwise.
+    Rings are closed, like marching squares emits them.
+
+    Returns:
+        tuple: (points, ring offsets, polygon offsets) of what is left, in the same layout.
+    """
+    x, y = points[:, 0], points[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    cross[offsets[1:-1] - 1] = 0.0  # Pairs spanning two rings
+    areas = np.abs(np.add.reduceat(np.append(cross, 0.0), offsets[:-1])) / 2.0
+
+    ring_polygon = np.repeat(np.arange(len(outer_offsets) - 1), np.diff(outer_offsets))
+    keep = (areas >= min_area) & (areas[outer_offsets[:-1]] >= min_area)[ring_polygon]
+    lengths = np.diff(offsets)[keep].astype(np.intp)
+    rings = np.bincount(ring_polygon[keep], minlength=len(outer_offsets) - 1)
+    return (points[np.repeat(keep, np.diff(offsets))], np.concatenate([[0], np.cumsum(lengths)]),
+            np.concatenate([[0], np.cumsum(rings[rings > 0])]))
+
+def contour_features(radar, field, sweep_index, tolerance=CONTOUR_TOLERANCE):
+    """
+    Builds the isoband features of one sweep of a field, one batch per band (see contour_bands()).
+
+    Gate values sit at their bin centre and gate range; band edges fall halfway between gates of different
+    bands, like the edges of the gate polygons.
+
+    Args:
+        tolerance (float): Simplification tolerance in meters, 0 to keep every vertex.
+
+    Yields:
+        list: GeoJSON Polygon features carrying the code of the band's colour as "q", like the gate polygons.
+    """
+    values, valid = canonical_sweep(radar, field, sweep_index)
+    codes, valid, _, _ = quantize_sweep(np.ma.masked_array(values, mask=~valid), field)
+    # Bin 0 is repeated after the last one so the bands close across north
+    z = np.ma.masked_array(np.vstack([codes, codes[:1]]).astype(np.float64), mask=~np.vstack([valid, valid[:1]]))
+    generator = contourpy.contour_generator(z=z, fill_type=contourpy.FillType.ChunkCombinedOffsetOffset)
+
+    ranges = radar.range["data"]
+    range_start, range_step = float(ranges[0]), float(ranges[1] - ranges[0])
+    resolution = 360.0 / codes.shape[0]
+    elevation = float(np.median(radar.get_elevation(sweep_index)))
+    lat0 = float(radar.latitude["data"][0])
+    lon0 = float(radar.longitude["data"][0])
+
+    for first, end, code in contour_bands(field):
+        band = band_polygons(generator, first, end)
+        if band is None:
+            continue
+        points, offsets, outer_offsets = band
+        x, y, _ = pyart.core.antenna_to_cartesian((range_start + range_step * points[:, 0]) / 1000.0,
+                                                  (points[:, 1] + 0.5) * resolution, elevation)
+        points = np.column_stack([x, y])
+
+        # Speckle and pinholes narrower than the tolerance are below the level of detail as well
+        points, offsets, outer_offsets = drop_small_rings(points, offsets, outer_offsets, tolerance ** 2)
+        if len(outer_offsets) < 2:
+            continue
+        if shapely is not None and tolerance > 0:
+            polygons = shapely.from_ragged_array(shapely.GeometryType.POLYGON, points, (offsets, outer_offsets))
+            polygons = shapely.simplify(polygons, tolerance, preserve_topology=True)
+            polygons = shapely.get_parts(polygons[~shapely.is_empty(polygons)])  # Simplifying can split a polygon
+            if polygons.size == 0:
+                continue
+            _, points, (offsets, outer_offsets) = shapely.to_ragged_array(polygons)
+
+        lon, lat = pyart.core.cartesian_to_geographic_aeqd(points[:, 0], points[:, 1], lon0, lat0)
+        coordinates = np.round(np.column_stack([lon, lat]), COORDINATE_DECIMALS).tolist()
+        offsets, outer_offsets = offsets.tolist(), outer_offsets.tolist()
+        yield [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [
+                    coordinates[offsets[ring]:offsets[ring + 1]] for ring in range(outer_offsets[polygon], outer_offsets[polygon + 1])
+                ]},
+                "properties": {"q": code},
+            }
+            for polygon in range(len(outer_offsets) - 1)
+        ]
+
+def stream_sweep_contours(radar, field, sweep_index, tolerance=CONTOUR_TOLERANCE):
+    """
+    Renders one sweep of a field as a GeoJSON FeatureCollection of isoband polygons, see contour_features().
+
+    Returns:
+        generator: bytes chunks of the serialized FeatureCollection.
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+    return feature_collection_chunks(contour_features(radar, field, sweep_index, tolerance))
+
+def contour_variant(tolerance):
+    """Product cache variant of the contoured polygons at a tolerance."""
+    return f"contour|{float(tolerance)}"
+
+def render_contour_product(file_path, field, elevation, tolerance=CONTOUR_TOLERANCE):
+    """
+    Makes sure the contoured polygons of the sweep closest to the elevation are in the product cache.
+
+    Returns:
+        str: Path of the cached product.
+    """
+    sweep_index = product_sweep(product_cache.get_volume_meta(file_path), field, elevation)
+    variant = contour_variant(tolerance)
+    path = product_cache.lookup(file_path, field, sweep_index, "geojson", variant)
+    if path is None:
+        radar, radar_sweep = read_sweep(file_path, field, sweep_index)
+        product_cache.put(file_path, field, sweep_index, "geojson", stream_sweep_contours(radar, field, radar_sweep, tolerance), variant)
+        path = product_cache.path(file_path, field, sweep_index, "geojson", variant)
+    return path
+
+def extract_radar_contours(file_path, field, elevation, tolerance=CONTOUR_TOLERANCE):
+    """Contours the sweep closest to the elevation of a volume that is not cached, like a partial one."""
+    radar = read_radar(file_path)
+    return b"".join(stream_sweep_contours(radar, field, select_sweep(radar, elevation), tolerance))
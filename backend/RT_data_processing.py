@@ -5,25 +5,59 @@ from glob import glob
 from datetime import datetime
 import json
 import re
+import struct
+import time
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import matplotlib.colors
 import matplotlib
 
+try:
+    import orjson  # Optional: encodes features several times faster than the json module
+except ImportError:
+    orjson = None
+
+from RT_volume_cache import read_radar
+from RT_gridding import grid_radar_field, canonical_sweep
+from RT_geometry import canonical_sweep_geometry
+from RT_derived import DERIVED_FIELDS, DERIVED_SOURCE
+from RT_metrics import observe_span
+
+# reduce: how gates are aggregated at coarse zoom levels (max, mean, or absmax to keep the strongest inbound
+# or outbound velocity)
+# dtype: integer type products quantize the field to over its norm range (see field_quantization)
 cmaps = {
-    'reflectivity': {'cmap' : 'pyart_NWSRef', 'norm': (0,80)},
-    'velocity': {'cmap' : 'pyart_NWSVel', 'norm' : (-30,30)},
-    'spectrum_width': {'cmap' : 'pyart_NWS_SPW', 'norm' : (0,10)},
-    'differential_reflectivity': {'cmap' : 'pyart_RefDiff', 'norm' : (-5,5)},
-    'differential_phase': {'cmap' : 'pyart_SCook18', 'norm' : (0,180)},
-    'cross_correlation_ratio': {'cmap' : 'pyart_Carbone42', 'norm' : (0,1)},
-    'clutter_filter_power_removed': {'cmap' : 'pyart_NWSRef', 'norm': (0,80)}
+    'reflectivity': {'cmap' : 'pyart_NWSRef', 'norm': (0,80), 'reduce': 'max', 'dtype': 'uint8'},
+    'velocity': {'cmap' : 'pyart_NWSVel', 'norm' : (-30,30), 'reduce': 'absmax', 'dtype': 'uint8'},
+    'spectrum_width': {'cmap' : 'pyart_NWS_SPW', 'norm' : (0,10), 'reduce': 'max', 'dtype': 'uint8'},
+    'differential_reflectivity': {'cmap' : 'pyart_RefDiff', 'norm' : (-5,5), 'reduce': 'mean', 'dtype': 'uint8'},
+    'differential_phase': {'cmap' : 'pyart_SCook18', 'norm' : (0,180), 'reduce': 'mean', 'dtype': 'uint16'},
+    'cross_correlation_ratio': {'cmap' : 'pyart_Carbone42', 'norm' : (0,1), 'reduce': 'mean', 'dtype': 'uint16'},
+    'clutter_filter_power_removed': {'cmap' : 'pyart_NWSRef', 'norm': (0,80), 'reduce': 'max', 'dtype': 'uint8'},
+    # Derived volume products, see RT_derived
+    'composite_reflectivity': {'cmap' : 'pyart_NWSRef', 'norm': (0,80), 'reduce': 'max', 'dtype': 'uint8'},
+    'echo_tops': {'cmap' : 'pyart_HomeyerRainbow', 'norm': (0,20), 'reduce': 'max', 'dtype': 'uint8'},
+    'vil': {'cmap' : 'pyart_ChaseSpectral', 'norm': (0,80), 'reduce': 'max', 'dtype': 'uint8'}
 }
 
+# Binary sweep layout (little endian):
+#   header    magic, version, dtype code, flags, rays, gates, site lat/lon (f8), fixed angle, range start,
+#             range spacing, scale, offset, site altitude (f4)
+#   azimuths  float32[rays]
+#   values    uint8 or uint16[rays * gates] per dtype code, gate value = offset + scale * code
+#   mask      packed bits[rays * gates], 1 = valid gate
+FEATURE_BATCH = 20000  # Features built and encoded at a time while streaming a FeatureCollection
+
+SWEEP_MAGIC = b"RSWP"
+SWEEP_VERSION = 1
+SWEEP_HEADER = struct.Struct("<4sHBBIIddffffff")
+SWEEP_DTYPE_CODES = {np.dtype(np.uint8): 1, np.dtype(np.uint16): 2}
+
 def get_radar_elevations(file_path):
     """Extract and return radar elevation angles from a NEXRAD file."""
     try:
-        radar = pyart.io.read_nexrad_archive(file_path)
+        radar = read_radar(file_path)
         elevations = radar.fixed_angle["data"]  # Extract elevation angles
         rounded_elevations = [float("%.02f"%(angle)) for angle in elevations]
         rounded_elevations = set(rounded_elevations)  # Remove duplicates
@@ -33,39 +67,61 @@ def get_radar_elevations(file_path):
         return []
     
 def get_radar_fields(file_path):
-    """Extract and return radar fields from a NEXRAD file."""
+    """Extract and return radar fields from a NEXRAD file, plus the derived fields it can produce (see RT_derived)."""
     try:
-        radar = pyart.io.read_nexrad_archive(file_path)
+        radar = read_radar(file_path)
         radar_fields = list(radar.fields.keys())  # Extract field names
+        if DERIVED_SOURCE in radar_fields:
+            radar_fields += list(DERIVED_FIELDS)
         return radar_fields
     except Exception as e:
         print(f"Error reading radar file: {e}")
         return []
     
-def find_latest_radar_file(radar_id, data_dir="../data"):
+def get_radar_dropdowns(file_path):
+    """Returns the elevation angles and fields of a NEXRAD file, decoding it once."""
+    return get_radar_elevations(file_path), get_radar_fields(file_path)
+
+def radar_file_time(file_path):
+    """Returns the scan time encoded in a radar file name (RADAR_YYYYmmdd-HHMMSS.bin)."""
+    return datetime.strptime(os.path.basename(file_path).split("_")[-1].split(".")[0], "%Y%m%d-%H%M%S")
+
+def find_radar_files(radar_id, count, data_dir="../data"):
     """
-    Finds the most recent radar file for the given radar_id.
-    
+    Finds the most recent radar files for the given radar_id.
+
     Args:
         radar_id (str): The radar station ID (e.g., KTLX).
+        count (int): Number of files to return.
         data_dir (str): Directory where radar files are stored.
 
     Returns:
-        str: Path to the latest radar file or None if no files are found.
+        list: Paths to up to count radar files, oldest first.
     """
     search_pattern = os.path.join(data_dir, f"{radar_id}_*.bin")
     radar_files = glob(search_pattern)
 
-    if not radar_files:
-        return None
-
     # Extract timestamps from filenames and sort to find the latest
     regex_pattern = re.compile(rf".*{radar_id}_\d{{8}}-\d{{6}}\.bin$")
     radar_files = [f for f in radar_files if regex_pattern.match(os.path.basename(f))]
+
+    radar_files.sort(key=radar_file_time)
+
+    return radar_files[-count:] if count > 0 else []
+
+def find_latest_radar_file(radar_id, data_dir="../data"):
+    """
+    Finds the most recent radar file for the given radar_id.
     
-    radar_files.sort(key=lambda f: datetime.strptime(f.split("_")[-1].split(".")[0], "%Y%m%d-%H%M%S"), reverse=True)
+    Args:
+        radar_id (str): The radar station ID (e.g., KTLX).
+        data_dir (str): Directory where radar files are stored.
 
-    return radar_files[0]
+    Returns:
+        str: Path to the latest radar file or None if no files are found.
+    """
+    radar_files = find_radar_files(radar_id, 1, data_dir)
+    return radar_files[-1] if radar_files else None
 
 def sanitize_data(data_array):
     """Replace NaN and infinite values with None (JSON-compliant)."""
@@ -74,14 +130,168 @@ def sanitize_data(data_array):
         for v in data_array
     ]
 
+def field_colormap(field):
+    """Returns the colormap and normalization configured for a field in the cmaps table."""
+    settings = cmaps.get(field, {})
+    cmap = matplotlib.cm.get_cmap(settings.get('cmap', 'pyart_NWSRef'))
+    vmin, vmax = settings.get('norm', (0, 75))
+    return cmap, matplotlib.colors.Normalize(vmin=vmin, vmax=vmax)
+
+@lru_cache(maxsize=None)
+def colormap_rgba(field):
+    """
+    Precomputes the RGBA colour of every bin of a field's colormap.
+
+    The table holds the cmap.N bin colours followed by the under and over colours, so it can be
+    indexed directly with the output of colormap_indices().
+
+    Returns:
+        ndarray: uint8[cmap.N + 2, 4]
+    """
+    cmap, _ = field_colormap(field)
+    rgba = np.vstack([cmap(np.arange(cmap.N)), cmap.get_under(), cmap.get_over()])
+    return np.rint(rgba * 255).astype(np.uint8)
+
+def field_quantization(field):
+    """
+    Returns the fixed quantization of a field: (dtype, scale, offset), value = offset + scale * code.
+
+    Codes span the whole integer range of the field's dtype over its norm range; values outside the range
+    are clipped onto its ends, which is also where the colormap puts them.
+    """
+    settings = cmaps.get(field, {})
+    dtype = np.dtype(settings.get('dtype', 'uint16'))
+    vmin, vmax = settings.get('norm', (0, 75))
+    return dtype, (vmax - vmin) / np.iinfo(dtype).max, vmin
+
+@lru_cache(maxsize=None)
+def color_table(field):
+    """
+    Builds the colour lookup table of a field's quantized codes, served once to clients so products only
+    carry codes.
+
+    Colours are piecewise constant along the codes, so the table is sent as runs: each run is
+    [first code, r, g, b, a] and lasts until the next run starts.
+
+    Returns:
+        dict: field, dtype, scale, offset, levels (number of codes) and runs.
+    """
+    dtype, scale, offset = field_quantization(field)
+    codes = np.arange(np.iinfo(dtype).max + 1)
+    rgba = colormap_rgba(field)[colormap_indices(offset + scale * codes, field)]
+    starts = np.flatnonzero(np.r_[True, (rgba[1:] != rgba[:-1]).any(axis=1)])
+    return {
+        "field": field,
+        "dtype": dtype.name,
+        "scale": scale,
+        "offset": offset,
+        "levels": int(codes.size),
+        "runs": [[int(start), *rgba[start].tolist()] for start in starts],
+    }
+
+def colormap_indices(values, field):
+    """
+    Quantizes values into colormap lookup table indices.
+
+    Mirrors the binning matplotlib does inside Colormap.__call__, so colormap_rgba(field)[index] is the
+    same colour as cmap(norm(value)).
+    """
+    cmap, norm = field_colormap(field)
+    scaled = np.ma.getdata(norm(values)) * cmap.N
+    scaled[scaled == cmap.N] = cmap.N - 1
+    under = scaled < 0
+    over = scaled >= cmap.N
+    indices = np.clip(scaled, 0, cmap.N - 1).astype(np.intp)
+    indices[under] = cmap.N
+    indices[over] = cmap.N + 1
+    return indices
+
+def iter_polygon_features(lat_grid, lon_grid, radar_data, field, batch_size=FEATURE_BATCH):
+    """
+    Builds one GeoJSON polygon feature per valid gate of a sweep, batch_size gates at a time.
+
+    The gate quads of a batch are assembled from the corner arrays at once and invalid gates are dropped with
+    a single boolean mask. Features carry the gate's quantized code as "q"; clients turn it into a value and a
+    colour with the field's color_table().
+
+    Args:
+        lat_grid (ndarray): Gate latitudes, shape (rays, gates).
+        lon_grid (ndarray): Gate longitudes, shape (rays, gates).
+        radar_data (MaskedArray): Field values, shape (rays, gates).
+        field (str): Field name used to look up the quantization.
+        batch_size (int): Features per yielded list.
+
+    Yields:
+        list: GeoJSON features, ordered by ray then gate.
+    """
+    codes, valid, _, _ = quantize_sweep(radar_data[:-1, :-1], field)
+    all_az_idx, all_r_idx = np.nonzero(valid)
+
+    for batch_start in range(0, all_az_idx.size, batch_size):
+        az_idx = all_az_idx[batch_start:batch_start + batch_size]
+        r_idx = all_r_idx[batch_start:batch_start + batch_size]
+
+        # Corners go counter-clockwise from the gate itself and the ring is closed on the first corner
+        corner_az = np.stack([az_idx, az_idx, az_idx + 1, az_idx + 1, az_idx], axis=1)
+        corner_r = np.stack([r_idx, r_idx + 1, r_idx + 1, r_idx, r_idx], axis=1)
+        rings = np.stack([lon_grid[corner_az, corner_r], lat_grid[corner_az, corner_r]], axis=2).astype(np.float64)
+
+        yield [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "properties": {"q": code}
+            }
+            for ring, code in zip(rings.tolist(), codes[az_idx, r_idx].tolist())
+        ]
+
+def dump_json(obj):
+    """Serializes to compact JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def feature_collection_chunks(feature_batches):
+    """
+    Encodes batches of features into a FeatureCollection, one chunk of bytes per batch, so a collection
+    never has to exist as a whole list or string.
+
+    Batches are usually generated lazily, so the time spent waiting on the next batch is recorded as the
+    polygonize stage and the time spent encoding as the serialize stage (see RT_metrics).
+
+    Yields:
+        bytes: Consecutive pieces of the serialized FeatureCollection.
+    """
+    polygonize_seconds = serialize_seconds = 0.0
+    features = size = 0
+    batches = iter(feature_batches)
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        polygonize_seconds += time.perf_counter() - start
+        if batch is None:
+            break
+        if not batch:
+            continue
+        start = time.perf_counter()
+        encoded = dump_json(batch)[1:-1]  # Drop the list brackets, the collection has its own
+        serialize_seconds += time.perf_counter() - start
+        features += len(batch)
+        size += len(encoded) + (0 if first else 1)
+        yield encoded if first else b"," + encoded
+        first = False
+    observe_span("polygonize", polygonize_seconds, features=features)
+    observe_span("serialize", serialize_seconds, features=features, bytes=size)
+    yield b"]}"
+
 def extract_radar_data(file_path, field, elevation):
     """
     Extracts radar data, interpolates it onto a uniform lat/lon grid, and returns it as GeoJSON.
     """
     try:
-        print(f"Opening radar file: {file_path}")
-        radar = pyart.io.read_nexrad_archive(file_path)
-        print("Radar file loaded successfully.")
+        radar = read_radar(file_path)
 
         # Check if field exists
         if field not in radar.fields:
@@ -97,121 +307,198 @@ def extract_radar_data(file_path, field, elevation):
 
 
         # Convert radar data into a 2D lat/lon grid
-        grid = pyart.map.grid_from_radars(
-            radar, 
+        lat_grid, lon_grid, value_grid = grid_radar_field(
+            radar,
+            field,
             grid_shape=(1, 500, 500),  # 500x500 resolution
-            grid_limits=((0, 20000), (-150000, 150000), (-150000, 150000)),
-            fields=[field]
+            grid_limits=((0, 20000), (-150000, 150000), (-150000, 150000))
         )
 
-        print("Grid mapping completed successfully.")
-
-        lat_grid = grid.point_latitude["data"][0]
-        lon_grid = grid.point_longitude["data"][0]
-        value_grid = grid.fields[field]["data"][0]
-
-        lat_flat = lat_grid.flatten()
-        lon_flat = lon_grid.flatten()
-        val_flat = value_grid.flatten()
+        codes, valid, _, _ = quantize_sweep(value_grid, field)
+        lat_flat = lat_grid[valid]
+        lon_flat = lon_grid[valid]
+        code_flat = codes[valid]
 
         # Bulky, only use for debug
         #print(f"Sample Data - Lat: {lat_grid[:5]}, Lon: {lon_grid[:5]}, Values: {value_grid[:5]}") 
 
-        cmap = matplotlib.cm.get_cmap('pyart_NWSRef')  # Think about getting the color map from the radar package
-        norm = matplotlib.colors.Normalize(vmin=np.nanmin(0), vmax=np.nanmax(60))  
-
         geojson_features = []
-        # Iterate and build features ONLY for valid (unmasked) values
-        for lat, lon, val in zip(lat_flat, lon_flat, val_flat):
-            if np.ma.is_masked(val) or np.isnan(val) or np.isinf(val):
-                continue
-            color = matplotlib.colors.rgb2hex(cmap(norm(val)))
+        # Build features ONLY for valid (unmasked) values, as quantized codes (see color_table)
+        for lat, lon, code in zip(lat_flat.tolist(), lon_flat.tolist(), code_flat.tolist()):
             geojson_features.append({
                 "type": "Feature",
                 "geometry": {
                     "type": "Point",
-                    "coordinates": [float(lon), float(lat)]
+                    "coordinates": [lon, lat]
                 },
                 "properties": {
-                    "value": float(val),
-                    "color": color
+                    "q": code
                 }
             })
 
-        print(f"GeoJSON Data Prepared, Features: {len(geojson_features)}")
-
-        return json.dumps({"type": "FeatureCollection", "features": geojson_features})
+        return b"".join(feature_collection_chunks([geojson_features]))
 
     except Exception as e:
         print(f"Error processing radar file {file_path}: {e}")
-        return json.dumps({"error": str(e)})  # Ensure JSON response format
+        return json.dumps({"error": str(e)}).encode("utf-8")  # Ensure JSON response format
+
+def select_sweep(radar, elevation):
+    """Returns the index of the sweep whose fixed angle is closest to the requested elevation."""
+    return int(np.argmin(np.abs(radar.fixed_angle["data"] - elevation)))
+
+def unique_elevation_sweeps(radar):
+    """
+    Maps every unique rounded elevation of a volume to the sweep the product endpoints would select for it.
+
+    Returns:
+        dict: {rounded elevation: sweep index}
+    """
+    return elevation_sweeps(radar.fixed_angle["data"])
+
+def elevation_sweeps(fixed_angles):
+    """Like unique_elevation_sweeps(), from the fixed angles (float32 array) of the sweeps of a volume."""
+    elevations = {float("%.02f"%(angle)) for angle in fixed_angles}
+    return {elevation: int(np.argmin(np.abs(fixed_angles - elevation))) for elevation in sorted(elevations)}
+
+def grid_fallback(radar, field):
+    """
+    Grids a field over every sweep, which is what the polygon products show for a sweep with no valid gate.
+
+    Returns:
+        tuple: (lat grid, lon grid, masked value grid)
+    """
+    grid_shape = (1, 500, 500)
+    grid_limits = ((0, 2000), (-150000, 150000), (-150000, 150000))
+    return grid_radar_field(radar, field, grid_shape=grid_shape, grid_limits=grid_limits)
+
+def stream_sweep_polygons(radar, field, sweep_index):
+    """
+    Renders one sweep of a field as a GeoJSON FeatureCollection of gate polygons, encoded batch by batch.
+
+    Returns:
+        generator: bytes chunks of the serialized FeatureCollection, see feature_collection_chunks().
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+
+    radar_data = radar.get_field(sweep_index, field)
+
+    print(f"Field: {field} Raw sweep shape: {radar_data.shape}, masked: {np.ma.is_masked(radar_data)}, valid pts: {np.count_nonzero(~radar_data.mask)}")
+
+    use_grid_method = np.count_nonzero(~radar_data.mask) == 0
+
+    if use_grid_method:
+        print("Switching to gridding method due to fully masked sweep data")
+        lat_grid, lon_grid, radar_data = grid_fallback(radar, field)
+    else:
+        lat_grid, lon_grid, radar_data = canonical_sweep_geometry(radar, field, sweep_index)
+
+    return feature_collection_chunks(iter_polygon_features(lat_grid, lon_grid, radar_data, field))
+
+def render_sweep_polygons(radar, field, sweep_index):
+    """
+    Renders one sweep of a field as a GeoJSON FeatureCollection of gate polygons.
+
+    Returns:
+        bytes: The serialized FeatureCollection.
+    """
+    return b"".join(stream_sweep_polygons(radar, field, sweep_index))
 
 def extract_radar_polygons(file_path, field, elevation):
     try:
-        radar = pyart.io.read_nexrad_archive(file_path)
+        radar = read_radar(file_path)
+        return render_sweep_polygons(radar, field, select_sweep(radar, elevation))
 
-        if field not in radar.fields:
-            raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+    except Exception as e:
+        return json.dumps({"error": str(e)}).encode("utf-8")
 
-        sweep_index = np.argmin(np.abs(radar.fixed_angle["data"] - elevation))
-        radar_data = radar.get_field(sweep_index, field)
-
-        print(f"Field: {field} Raw sweep shape: {radar_data.shape}, masked: {np.ma.is_masked(radar_data)}, valid pts: {np.count_nonzero(~radar_data.mask)}")
-
-        use_grid_method = np.count_nonzero(~radar_data.mask) == 0
-
-        if use_grid_method:
-            print("Switching to gridding method due to fully masked sweep data")
-            grid_shape = (1, 500, 500)
-            grid_limits = ((0, 2000), (-150000, 150000), (-150000, 150000))
-            grid = pyart.map.grid_from_radars(
-                radar, 
-                grid_shape=grid_shape, 
-                grid_limits=grid_limits,
-                fields=[field]
-            )
-            lat_grid = grid.point_latitude['data'][0]
-            lon_grid = grid.point_longitude['data'][0]
-            radar_data = grid.fields[field]['data'][0]
-        else:
-            azimuths = radar.get_azimuth(sweep_index)
-            ranges = radar.range['data']
-            lat_grid, lon_grid, _ = radar.get_gate_lat_lon_alt(sweep_index)
-
-        features = []
-        cmap = matplotlib.cm.get_cmap(cmaps[field]['cmap']) if 'cmap' in cmaps[field] else matplotlib.cm.get_cmap('pyart_NWSRef')
-        norm = (matplotlib.colors.Normalize(vmin=cmaps[field]['norm'][0], vmax=cmaps[field]['norm'][1]) if 'norm' in cmaps[field]
-                else matplotlib.colors.Normalize(vmin=0, vmax=75))
-        print(f"Color map: {cmap.name}, Norm: {norm.vmin} to {norm.vmax}")
-
-        lat_shape, lon_shape = lat_grid.shape
-        for az_idx in range(lat_shape - 1):
-            for r_idx in range(lon_shape - 1):
-                value = radar_data[az_idx, r_idx]
-
-                if np.ma.is_masked(value) or np.isnan(value) or np.isinf(value) or value == -9999:
-                    continue
-
-                lat1, lon1 = lat_grid[az_idx, r_idx], lon_grid[az_idx, r_idx]
-                lat2, lon2 = lat_grid[az_idx, r_idx + 1], lon_grid[az_idx, r_idx + 1]
-                lat3, lon3 = lat_grid[az_idx + 1, r_idx + 1], lon_grid[az_idx + 1, r_idx + 1]
-                lat4, lon4 = lat_grid[az_idx + 1, r_idx], lon_grid[az_idx + 1, r_idx]
-
-                color = matplotlib.colors.rgb2hex(cmap(norm(value)))
-
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Polygon",
-                        "coordinates": [[[lon1, lat1], [lon2, lat2], [lon3, lat3], [lon4, lat4], [lon1, lat1]]]
-                    },
-                    "properties": {"value": float(value), "color": color}
-                }
-                features.append(feature)
+def quantize_sweep(radar_data, field):
+    """
+    Quantizes field values with the field's fixed quantization (see field_quantization).
+
+    Args:
+        radar_data (MaskedArray): Field values, shape (rays, gates).
+        field (str): Field name used to look up the quantization.
+
+    Returns:
+        tuple: (codes, valid mask, scale, offset) where value = offset + scale * code.
+    """
+    dtype, scale, vmin = field_quantization(field)
+    vmax = vmin + scale * np.iinfo(dtype).max
+    values = np.ma.getdata(radar_data)
+    valid = ~np.ma.getmaskarray(radar_data) & np.isfinite(values) & (values != -9999)
+    codes = np.zeros(values.shape, dtype=dtype)
+    codes[valid] = np.rint((np.clip(values[valid], vmin, vmax) - vmin) / scale)
+    return codes, valid, scale, vmin
+
+def render_sweep_binary(radar, field, sweep_index):
+    """
+    Packs one sweep of a field into the compact binary sweep layout described by SWEEP_HEADER.
+
+    The client rebuilds the gate geometry from the site location, azimuths and range spacing, so the
+    payload is a few MB of typed arrays instead of one JSON feature per gate.
+
+    Returns:
+        bytes: The packed sweep.
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+
+    ranges = radar.range['data']
+    return pack_sweep(radar, field, sweep_index, radar.get_field(sweep_index, field), radar.get_azimuth(sweep_index),
+                      float(ranges[0]), float(ranges[1] - ranges[0]))
 
-        print(f"GeoJSON Data Prepared, Features: {len(features)}")
+def render_sweep_frame(radar, field, sweep_index):
+    """
+    Packs one sweep like render_sweep_binary(), with the rays snapped onto the canonical azimuth bins (see
+    canonical_sweep in RT_gridding), so consecutive volumes of a site line up gate for gate. These are the
+    frames of the loop products (see RT_loop).
+
+    Returns:
+        bytes: The packed sweep, azimuths at the bin centres.
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
 
-        return json.dumps({"type": "FeatureCollection", "features": features})
+    values, valid = canonical_sweep(radar, field, sweep_index)
+    resolution = 360.0 / values.shape[0]
+    ranges = radar.range['data']
+    return pack_sweep(radar, field, sweep_index, np.ma.masked_array(values, mask=~valid),
+                      (np.arange(values.shape[0]) + 0.5) * resolution, float(ranges[0]), float(ranges[1] - ranges[0]))
+
+def pack_sweep(radar, field, sweep_index, radar_data, azimuths, range_start, range_spacing):
+    """
+    Packs sweep values laid out on the given azimuths and regular range gates (see render_sweep_binary).
+
+    Returns:
+        bytes: The packed sweep.
+    """
+    codes, valid, scale, offset = quantize_sweep(radar_data, field)
+    azimuths = np.asarray(azimuths, dtype=np.float32)
+    n_rays, n_gates = codes.shape
+
+    header = SWEEP_HEADER.pack(
+        SWEEP_MAGIC, SWEEP_VERSION, SWEEP_DTYPE_CODES[codes.dtype], 0, n_rays, n_gates,
+        float(radar.latitude['data'][0]), float(radar.longitude['data'][0]),
+        float(radar.fixed_angle['data'][sweep_index]), range_start, range_spacing,
+        scale, offset, float(radar.altitude['data'][0])
+    )
+    payload = b"".join([header, azimuths.tobytes(), codes.astype(codes.dtype.newbyteorder("<")).tobytes(), np.packbits(valid).tobytes()])
+
+    print(f"Binary sweep prepared: {n_rays}x{n_gates} gates, {len(payload)} bytes")
+    return payload
+
+def extract_radar_binary(file_path, field, elevation):
+    """
+    Packs the sweep closest to the requested elevation, see render_sweep_binary().
+
+    Returns:
+        bytes: The packed sweep, or None if the sweep could not be extracted.
+    """
+    try:
+        radar = read_radar(file_path)
+        return render_sweep_binary(radar, field, select_sweep(radar, elevation))
 
     except Exception as e:
-        return json.dumps({"error": str(e)})
\ No newline at end of file
+        print(f"Error packing radar file {file_path}: {e}")
+        return None
@@ -1,22 +1,194 @@
 # This file is the main script running the api queries from the NEXRAD real time data stream via AWS S3
 # Any testing scripts will be done under the data exploration directory in the sample_query.py file
 import os
+import shutil
 import boto3
 from botocore.config import Config
 from botocore import UNSIGNED
 from datetime import datetime
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Configure S3 client for unsigned requests
+from RT_metrics import span
+
+BUCKET_NAME = "unidata-nexrad-level2-chunks"
+MAX_WAIT_TIME = 60  # Max time (seconds) before using fallback
+WAIT_INTERVAL = 5  # Time (seconds) between rechecks
+LISTING_TTL = 1.0  # Time (seconds) a bucket listing is reused for repeated lookups
+MAX_VOLUME_NUMBER = 999  # Volume numbers in the chunk bucket wrap around after this
+STALLED_VOLUME_TIME = 60  # Time (seconds) without a new chunk after which a volume without E chunk is passed over
+DOWNLOAD_WORKERS = 16  # Concurrent chunk downloads per volume
+DOWNLOAD_RETRIES = 3  # Attempts per chunk before giving up on it
+RETRY_BACKOFF = 0.5  # Base delay (seconds) of the exponential backoff between attempts
+COPY_BUFFER_SIZE = 1024 * 1024  # Buffer size when sendfile() is unavailable
+ASSEMBLE_IN_MEMORY = os.environ.get("ASSEMBLE_IN_MEMORY", "1") != "0"  # Keep chunks in memory instead of ../data
+
+# Configure S3 client for unsigned requests, with enough pooled connections for the download workers
 s3 = boto3.client(
     's3',
     region_name='us-east-1',
-    config=Config(signature_version=UNSIGNED)
+    config=Config(
+        signature_version=UNSIGNED,
+        max_pool_connections=DOWNLOAD_WORKERS * 2,
+        tcp_keepalive=True,
+        retries={'max_attempts': 2, 'mode': 'standard'}
+    )
 )
 
-BUCKET_NAME = "unidata-nexrad-level2-chunks"
-MAX_WAIT_TIME = 60  # Max time (seconds) before using fallback
-WAIT_INTERVAL = 5  # Time (seconds) between rechecks
+def parse_chunk_key(key):
+    """
+    Splits a chunk key such as KTLX/585/20250129-150000-001-S into its parts.
+
+    Returns:
+        tuple: (radar_id, volume number, timestamp YYYYMMDDHHMMSS, sequence number, chunk type) or None.
+    """
+    key_parts = key.split("/")
+    if len(key_parts) < 3:
+        return None
+    name_parts = key_parts[2].split("-")
+    if len(name_parts) < 4:
+        return None
+    return key_parts[0], int(key_parts[1]), name_parts[0] + name_parts[1], int(name_parts[2]), name_parts[3][-1]
+
+class ScanListingIndex:
+    """
+    Per-radar index of the newest volumes in the chunk bucket.
+
+    The first lookup of a radar scans its whole prefix once. After that, only the newest known volume is
+    listed forward from its last seen key (StartAfter), and the next volume number's prefix is probed once
+    that volume has its E chunk, or has had no new chunk for STALLED_VOLUME_TIME seconds (an aborted volume).
+    If that prefix stays empty for STALLED_VOLUME_TIME too, the radar skipped a volume number or restarted its
+    numbering (e.g. after an RDA restart), so the whole radar prefix is listed again like on the first lookup.
+    Lookups within LISTING_TTL seconds of each other are answered without listing. Every radar is refreshed
+    under its own lock, so a slow listing of one radar never holds up the others.
+    """
+
+    def __init__(self, client=None, bucket=BUCKET_NAME, ttl=LISTING_TTL):
+        self.client = client
+        self.bucket = bucket
+        self.ttl = ttl
+        self.list_requests = 0
+        self._radars = {}  # radar_id -> {"volumes": {volume: state}, "checked_at": monotonic time, "lock": Lock}
+        self._lock = threading.Lock()  # Only guards self._radars and the counter
+
+    def _s3(self):
+        return self.client or s3
+
+    def _list_page(self, prefix, start_after=None, continuation=None):
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        if continuation:
+            kwargs['ContinuationToken'] = continuation
+        with self._lock:
+            self.list_requests += 1
+        with span("s3_list", prefix=prefix) as attributes:
+            page = self._s3().list_objects_v2(**kwargs)
+            attributes["keys"] = len(page.get('Contents', []))
+        return page
+
+    def _list(self, prefix, start_after=None):
+        objects = []
+        continuation = None
+        while True:
+            page = self._list_page(prefix, start_after, continuation)
+            objects.extend(page.get('Contents', []))
+            if not page.get('IsTruncated'):
+                return objects
+            continuation = page['NextContinuationToken']
+
+    @staticmethod
+    def _add_objects(volumes, objects):
+        for obj in objects:
+            parts = parse_chunk_key(obj['Key'])
+            if not parts:
+                continue
+            _, volume, timestamp, _, chunk_type = parts
+            state = volumes.get(volume)
+            if state is None or timestamp > state["timestamp"]:
+                # New volume, or a volume number that wrapped around and was reused
+                state = volumes[volume] = {"timestamp": timestamp, "files": [], "chunk_types": set(), "last_key": "",
+                                           "updated_at": time.monotonic()}
+            elif timestamp < state["timestamp"]:
+                continue
+            state["updated_at"] = time.monotonic()
+            state["files"].append(obj)
+            state["chunk_types"].add(chunk_type)
+            state["last_key"] = max(state["last_key"], obj['Key'])
+
+    @staticmethod
+    def _newest(volumes, count=2):
+        return sorted(volumes, key=lambda volume: volumes[volume]["timestamp"], reverse=True)[:count]
+
+    def _refresh(self, radar_id, volumes):
+        if not volumes:
+            # Bootstrap with one full scan of the radar prefix
+            self._add_objects(volumes, self._list(f"{radar_id}/"))
+            return
+
+        volume = self._newest(volumes, 1)[0]
+        for _ in range(MAX_VOLUME_NUMBER):
+            state = volumes[volume]
+            if 'E' not in state["chunk_types"]:
+                self._add_objects(volumes, self._list(f"{radar_id}/{volume}/", start_after=state["last_key"]))
+                if 'E' not in state["chunk_types"] and time.monotonic() - state["updated_at"] < STALLED_VOLUME_TIME:
+                    return
+
+            # The newest volume is complete (or was aborted), so check whether the next one has started
+            next_volume = volume % MAX_VOLUME_NUMBER + 1
+            objects = self._list(f"{radar_id}/{next_volume}/")
+            newer = [obj for obj in objects if parse_chunk_key(obj['Key']) and parse_chunk_key(obj['Key'])[2] > state["timestamp"]]
+            if not newer:
+                missing_since = state.setdefault("next_missing_since", time.monotonic())
+                if time.monotonic() - missing_since >= STALLED_VOLUME_TIME:
+                    state["next_missing_since"] = time.monotonic()
+                    objects = self._list(f"{radar_id}/")
+                    self._add_objects(volumes, [obj for obj in objects if parse_chunk_key(obj['Key'])
+                                                and parse_chunk_key(obj['Key'])[2] > state["timestamp"]])
+                return
+            volumes.pop(next_volume, None)
+            self._add_objects(volumes, newer)
+            volume = next_volume
+
+    def latest_volumes(self, radar_id):
+        """
+        Returns the newest and the previous volume of a radar.
+
+        Returns:
+            list: Up to two dicts with "volume", "timestamp", "files" and "chunk_types", newest first.
+        """
+        with self._lock:
+            entry = self._radars.setdefault(radar_id, {"volumes": {}, "checked_at": None, "lock": threading.Lock()})
+        with entry["lock"]:
+            now = time.monotonic()
+            if entry["checked_at"] is None or now - entry["checked_at"] >= self.ttl:
+                self._refresh(radar_id, entry["volumes"])
+                entry["checked_at"] = now
+
+            volumes = entry["volumes"]
+            newest = self._newest(volumes, 2)
+            # Forget volumes that can no longer be the latest or the fallback
+            for volume in list(volumes):
+                if volume not in newest:
+                    del volumes[volume]
+            return [
+                {
+                    "volume": volume,
+                    "timestamp": volumes[volume]["timestamp"],
+                    "files": sorted(volumes[volume]["files"], key=lambda obj: obj['Key']),
+                    "chunk_types": set(volumes[volume]["chunk_types"]),
+                }
+                for volume in newest
+            ]
+
+    def latest_volume(self, radar_id):
+        """Returns the newest volume number of a radar, or None."""
+        volumes = self.latest_volumes(radar_id)
+        return volumes[0]["volume"] if volumes else None
+
+# Shared listing index used by find_latest_scan and the progressive ingest
+scan_index = ScanListingIndex()
 
 def find_latest_scan(radar_id, local_dir="../data"):
     """
@@ -29,55 +201,13 @@ def find_latest_scan(radar_id, local_dir="../data"):
     Returns:
         tuple: (list of file objects, timestamp of the latest scan)
     """
-    prefix = f"{radar_id}/"
-    paginator = s3.get_paginator('list_objects_v2')
-    
-    latest_files = []
-    previous_files = []
-    latest_timestamp = None
-    previous_timestamp = None
-    #elapsed_time = 0
-
-    #while elapsed_time < MAX_WAIT_TIME:
-    ### BEGIN - Commented out the while loop to test the function
-    response_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix)
-    
-    temp_latest_files = []
-    temp_previous_files = []
-    temp_latest_timestamp = None
-    temp_previous_timestamp = None
-    chunk_types = set()
-
-    # Iterate through all objects in the bucket for the given radar ID
-    for page in response_iterator:
-        if 'Contents' not in page:
-            continue
-        for obj in page['Contents']:
-            key_parts = obj['Key'].split("/")
-            if len(key_parts) < 3:
-                continue
-            
-            timestamp = key_parts[2].split("-")[0] + key_parts[2].split("-")[1]  # Extract timestamp
-            chunk_type = key_parts[-1].split(".")[0][-1]  # Extract last character (chunk type)
-
-            if not temp_latest_timestamp or timestamp > temp_latest_timestamp:
-                temp_previous_timestamp = temp_latest_timestamp
-                temp_previous_files = temp_latest_files
-
-                temp_latest_timestamp = timestamp
-                temp_latest_files = [obj]
-                chunk_types = {chunk_type}
-            elif timestamp == temp_latest_timestamp:
-                temp_latest_files.append(obj)
-                chunk_types.add(chunk_type)
-
-    # Ensure we have both a latest and previous timestamp
-    if temp_previous_timestamp:
-        latest_files = temp_latest_files
-        previous_files = temp_previous_files
-        latest_timestamp = temp_latest_timestamp
-        previous_timestamp = temp_previous_timestamp
-    
+    volumes = scan_index.latest_volumes(radar_id)
+    if not volumes:
+        print(f"No scans found for {radar_id}")
+        return [], None
+
+    latest = volumes[0]
+    latest_files, latest_timestamp, chunk_types = latest["files"], latest["timestamp"], latest["chunk_types"]
     print(f"Latest scan: {latest_timestamp} ({len(latest_files)} chunks) | Chunks: {chunk_types}")
 
     # Check if the scan contains at least one "S", multiple "I", and one "E"
@@ -85,65 +215,212 @@ def find_latest_scan(radar_id, local_dir="../data"):
         print(f"Scan {latest_timestamp} is complete. Proceeding with download.")
         return latest_files, latest_timestamp
 
+    if len(volumes) < 2:
+        print(f"No previous scan available. Using incomplete latest scan {latest_timestamp}.")
+        return latest_files, latest_timestamp
+
+    previous_files, previous_timestamp = volumes[1]["files"], volumes[1]["timestamp"]
+
     # Check for a previous scan in local storage
     previous_file_path = os.path.join(local_dir, f"{radar_id}_{previous_timestamp[0:8]}-{previous_timestamp[8:]}.bin")
     if os.path.exists(previous_file_path):
         print(f"Using previous scan {previous_timestamp} as fallback.")
         return previous_files, previous_timestamp
 
-        # Wait before retrying
-        #time.sleep(WAIT_INTERVAL)
-        #elapsed_time += WAIT_INTERVAL
+    print(f"Using previous scan {previous_timestamp}.")
+    return previous_files, previous_timestamp
 
-    # If timeout, use previous scan if available
-    if previous_files:
-        #print(f"Timeout reached! Using previous scan {previous_timestamp}.")
-        print(f"Using previous scan {previous_timestamp}.")
-        return previous_files, previous_timestamp
-    else:
-        #print(f"Timeout reached! No previous scan available. Using incomplete latest scan {latest_timestamp}.")
-        print(f"No previous scan available. Using incomplete latest scan {latest_timestamp}.")
-        return latest_files, latest_timestamp
+def _with_retries(chunk_key, fetch):
+    """Calls fetch(), retrying with exponential backoff. Returns its result and the number of attempts."""
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            return fetch(), attempt
+        except Exception as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            print(f"Retrying {chunk_key} in {delay:.1f}s (attempt {attempt} failed: {e})")
+            time.sleep(delay)
+
+def _check_size(file_obj, size):
+    if 'Size' in file_obj and size != file_obj['Size']:
+        raise IOError(f"size mismatch, expected {file_obj['Size']} bytes but got {size}")
+
+def _download_chunk(file_obj, download_dir):
+    """
+    Downloads one chunk, retrying with exponential backoff and checking its size against the listing.
+
+    Returns:
+        dict: key, local path, bytes, seconds and attempts of the download.
+    """
+    chunk_key = file_obj['Key']
+    local_file_path = os.path.join(download_dir, os.path.basename(chunk_key))
+    start = time.perf_counter()
+
+    def fetch():
+        s3.download_file(BUCKET_NAME, chunk_key, local_file_path)
+        size = os.path.getsize(local_file_path)
+        _check_size(file_obj, size)
+        return size
+
+    size, attempts = _with_retries(chunk_key, fetch)
+    return {
+        "key": chunk_key,
+        "path": local_file_path,
+        "bytes": size,
+        "seconds": time.perf_counter() - start,
+        "attempts": attempts,
+    }
+
+def _fetch_chunk(file_obj):
+    """Same as _download_chunk, but keeps the chunk in memory. The result carries the bytes under "data"."""
+    chunk_key = file_obj['Key']
+    start = time.perf_counter()
+
+    def fetch():
+        data = s3.get_object(Bucket=BUCKET_NAME, Key=chunk_key)['Body'].read()
+        _check_size(file_obj, len(data))
+        return data
+
+    data, attempts = _with_retries(chunk_key, fetch)
+    return {
+        "key": chunk_key,
+        "data": data,
+        "bytes": len(data),
+        "seconds": time.perf_counter() - start,
+        "attempts": attempts,
+    }
 
-def download_chunks(file_list, download_dir="../data"):
+def _fetch_all(fetch_chunk, file_list, max_workers, timings):
     """
-    Downloads all chunks for the latest radar scan.
+    Runs fetch_chunk over every chunk in parallel. Returns the results in chunk sequence order.
+
+    Raises:
+        IOError: If any chunk failed to download, so a truncated volume is never assembled.
+    """
+    results = []
+    start = time.perf_counter()
+
+    with span("download", chunks=len(file_list)) as attributes:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(fetch_chunk, file_obj): file_obj['Key'] for file_obj in file_list}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    print(f"Downloaded: {result.get('path', result['key'])}")
+                    results.append(result)
+                except Exception as e:
+                    print(f"Error downloading {futures[future]}: {e}")
+        attributes["bytes"] = sum(result["bytes"] for result in results)
+        attributes["failed"] = len(file_list) - len(results)
+
+    elapsed = time.perf_counter() - start
+    total_bytes = attributes["bytes"]
+    print(f"Downloaded {len(results)}/{len(file_list)} chunks ({total_bytes / 1024**2:.1f} MB) in {elapsed:.2f}s")
+
+    if timings is not None:
+        chunk_timings = [{key: value for key, value in result.items() if key != "data"} for result in results]
+        timings["chunks"] = sorted(chunk_timings, key=lambda result: result["key"])
+        timings["seconds"] = elapsed
+        timings["bytes"] = total_bytes
+        timings["failed"] = len(file_list) - len(results)
+
+    if len(results) < len(file_list):
+        # Chunks already written to disk would never be assembled, cataloged or cleaned up
+        for result in results:
+            if "path" in result and os.path.exists(result["path"]):
+                os.remove(result["path"])
+        raise IOError(f"{len(file_list) - len(results)} of {len(file_list)} chunks failed to download")
+
+    # Chunks finish in any order but must be assembled in sequence order
+    return sorted(results, key=lambda result: _chunk_sequence(result["key"]))
+
+def download_chunks(file_list, download_dir="../data", max_workers=DOWNLOAD_WORKERS, timings=None):
+    """
+    Downloads all chunks for the latest radar scan in parallel.
     
     Args:
         file_list (list): List of objects representing chunks to download.
         download_dir (str): Directory to save downloaded chunks.
+        max_workers (int): Maximum number of concurrent downloads.
+        timings (dict): Optional dict filled with per-chunk and per-volume download timing.
     
     Returns:
-        list: List of paths to the downloaded chunk files.
+        list: List of paths to the downloaded chunk files, in chunk sequence order.
     """
     os.makedirs(download_dir, exist_ok=True)
-    local_file_paths = []
+    results = _fetch_all(lambda file_obj: _download_chunk(file_obj, download_dir), file_list, max_workers, timings)
+    return [result["path"] for result in results]
 
-    for file_obj in file_list:
-        chunk_key = file_obj['Key']
-        local_file_path = os.path.join(download_dir, os.path.basename(chunk_key))
+def download_chunks_to_memory(file_list, max_workers=DOWNLOAD_WORKERS, timings=None):
+    """
+    Downloads all chunks for the latest radar scan in parallel without writing them to disk.
+
+    Returns:
+        list: The chunk contents (bytes), in chunk sequence order.
+    """
+    return [result["data"] for result in _fetch_all(_fetch_chunk, file_list, max_workers, timings)]
+
+def _chunk_sequence(file_path):
+    """Sort key of a downloaded chunk file: its sequence number, e.g. 20250129-150000-012-I -> 12."""
+    name = os.path.basename(file_path)
+    parts = name.split("-")
+    return (int(parts[2]) if len(parts) >= 4 and parts[2].isdigit() else -1, name)
 
+def _append_file(src_file, dst_file):
+    """Appends one open file to another, copying inside the kernel where sendfile() is available."""
+    size = os.fstat(src_file.fileno()).st_size
+    if hasattr(os, "sendfile"):
+        dst_file.flush()
+        offset = 0
         try:
-            s3.download_file(BUCKET_NAME, chunk_key, local_file_path)
-            print(f"Downloaded: {local_file_path}")
-            local_file_paths.append(local_file_path)
-        except Exception as e:
-            print(f"Error downloading {chunk_key}: {e}")
+            while offset < size:
+                sent = os.sendfile(dst_file.fileno(), src_file.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            dst_file.seek(0, os.SEEK_END)
+            return
+        except OSError:
+            # Not supported for this pair of files: fall back to buffered copying from where we stopped
+            src_file.seek(offset)
+            dst_file.seek(0, os.SEEK_END)
+    shutil.copyfileobj(src_file, dst_file, COPY_BUFFER_SIZE)
 
-    return local_file_paths
+def tmp_path(path):
+    """Temporary file to write path through, unique per process and thread so concurrent writers never share one."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
 
 def assemble_chunks(local_file_paths, output_file):
     """
     Combines all downloaded chunks into a single file.
 
+    The chunks are streamed into a temporary file next to the output, which is then renamed into place,
+    so readers never see a partially assembled volume.
+
     Args:
         local_file_paths (list): Paths to the downloaded chunk files.
         output_file (str): Path for the final combined file.
     """
-    with open(output_file, "wb") as combined_file:
-        for file_path in sorted(local_file_paths):
-            with open(file_path, "rb") as chunk_file:
-                combined_file.write(chunk_file.read())
-            os.remove(file_path)  # Optionally delete individual chunk files
-            print(f"Deleted: {file_path}")
-    print(f"Combined file saved to: {output_file}")
\ No newline at end of file
+    ordered_paths = sorted(local_file_paths, key=_chunk_sequence)
+    tmp_file = tmp_path(output_file)
+    with span("assemble", chunks=len(ordered_paths)):
+        with open(tmp_file, "wb") as combined_file:
+            for file_path in ordered_paths:
+                with open(file_path, "rb") as chunk_file:
+                    _append_file(chunk_file, combined_file)
+        os.replace(tmp_file, output_file)
+
+    for file_path in ordered_paths:
+        os.remove(file_path)  # Optionally delete individual chunk files
+        print(f"Deleted: {file_path}")
+    print(f"Combined file saved to: {output_file}")
+
+def write_volume(data, output_file):
+    """Writes an assembled volume through a temporary file and an atomic rename."""
+    tmp_file = tmp_path(output_file)
+    with span("assemble", bytes=len(data)):
+        with open(tmp_file, "wb") as combined_file:
+            combined_file.write(data)
+        os.replace(tmp_file, output_file)
+    print(f"Combined file saved to: {output_file}")
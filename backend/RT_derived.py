@@ -0,0 +1,134 @@
+# This file holds the derived volume products: composite reflectivity, echo tops and VIL
+# They combine every elevation of a volume, so the reflectivity of each elevation is sampled once per scan onto
+# one common layout, the canonical azimuth bins of the lowest sweep by the ground range of the volume's range
+# gates, and each product is a vectorized reduction over those levels. The result is a single pseudo sweep laid
+# out like the lowest one, which the sweep renderers of RT_data_processing draw like any other field
+import math
+
+import numpy as np
+
+from RT_gridding import canonical_azimuths, canonical_sweep
+
+DERIVED_SOURCE = "reflectivity"
+EFFECTIVE_RADIUS = 6371000.0 * 4.0 / 3.0  # 4/3 earth beam propagation model, as pyart
+ECHO_TOP_THRESHOLD = 18.0  # dBZ, the NWS echo tops threshold
+VIL_MAX_DBZ = 56.0  # Reflectivity is capped here so hail does not dominate VIL
+ELEVATION_TOLERANCE = 0.1  # Degrees between sweeps merged into one level, like the two sweeps of a split cut
+
+def sample_levels(radar, source=DERIVED_SOURCE):
+    """
+    Samples every elevation of a volume onto the layout of the derived products.
+
+    Output gate g lies at a ground distance from the site equal to the range of gate g, on the canonical azimuth
+    bins of the lowest sweep. Each elevation is looked up at the slant range reaching that ground distance;
+    sweeps of the same elevation are merged by maximum.
+
+    Returns:
+        tuple: (index of the lowest sweep with data, levels) where levels lists (beam height float64[gates] in m
+        above sea level, values float32[bins, gates] with NaN where there is no data), lowest elevation first.
+    """
+    ranges = radar.range["data"].astype(np.float64)
+    range_start, range_step = ranges[0], ranges[1] - ranges[0]
+    theta = ranges / EFFECTIVE_RADIUS
+    altitude = float(radar.altitude["data"][0])
+
+    sweeps = [(float(np.median(radar.get_elevation(sweep_index))), sweep_index) for sweep_index in range(radar.nsweeps)]
+    sweeps = [(elevation, sweep_index) for elevation, sweep_index in sorted(sweeps)
+              if not np.ma.getmaskarray(radar.get_field(sweep_index, source)).all()]
+    if not sweeps:
+        raise ValueError(f"No {source} data to derive products from")
+
+    base = sweeps[0][1]
+    resolution, nbins = canonical_azimuths(radar.get_azimuth(base).size)
+    centres = (np.arange(nbins) + 0.5) * resolution
+
+    levels = []
+    for elevation, sweep_index in sweeps:
+        values, valid = canonical_sweep(radar, source, sweep_index)
+        sweep_resolution, sweep_bins = canonical_azimuths(values.shape[0])
+        rows = np.floor(centres / sweep_resolution).astype(np.intp) % sweep_bins
+
+        # Slant range and height of the beam over each ground distance (law of sines, as in RT_mosaic)
+        angle = math.radians(elevation)
+        slant = EFFECTIVE_RADIUS * np.sin(theta) / np.cos(angle + theta)
+        height = np.sqrt(slant ** 2 + EFFECTIVE_RADIUS ** 2 + 2 * slant * EFFECTIVE_RADIUS * math.sin(angle)) - EFFECTIVE_RADIUS
+        gate = np.rint((slant - range_start) / range_step)
+        inside = (gate >= 0) & (gate < values.shape[1])
+        gate = np.where(inside, gate, 0).astype(np.intp)
+
+        sampled = np.where(valid[rows][:, gate] & inside, values[rows][:, gate], np.nan).astype(np.float32)
+        if levels and elevation - levels[-1][0] < ELEVATION_TOLERANCE:
+            levels[-1][2] = np.fmax(levels[-1][2], sampled)
+        else:
+            levels.append([elevation, height + altitude, sampled])
+    return base, [(height, values) for _, height, values in levels]
+
+def composite_reflectivity(levels):
+    """Maximum reflectivity (dBZ) over every elevation."""
+    return np.fmax.reduce([values for _, values in levels])
+
+def echo_tops(levels, threshold=ECHO_TOP_THRESHOLD):
+    """Height (km above sea level) of the highest beam reaching threshold dBZ, NaN where none does."""
+    tops = np.full(levels[0][1].shape, np.nan, dtype=np.float32)
+    for height, values in levels:
+        tops = np.where(values >= threshold, (height / 1000.0).astype(np.float32), tops)
+    return tops
+
+def vertically_integrated_liquid(levels, max_dbz=VIL_MAX_DBZ):
+    """
+    Vertically integrated liquid (kg/m²): 3.44e-6 * Z^(4/7) integrated over height, Z (mm⁶/m³) averaged across
+    each pair of consecutive elevations. NaN where no elevation has data.
+    """
+    vil = np.zeros(levels[0][1].shape, dtype=np.float32)
+    seen = np.zeros(vil.shape, dtype=bool)
+    previous_height, previous_z = None, None
+    for height, values in levels:
+        z = np.exp(np.minimum(values, max_dbz) * np.float32(math.log(10.0) / 10.0))  # dBZ to Z
+        if previous_z is not None:
+            layer = np.power((previous_z + z) * np.float32(0.5), np.float32(4.0 / 7.0))
+            layer *= (3.44e-6 * (height - previous_height)).astype(np.float32)
+            vil += np.fmax(layer, 0.0, out=layer)  # Layers missing either elevation (NaN) add nothing
+        seen |= ~np.isnan(values)
+        previous_height, previous_z = height, z
+    vil[~seen] = np.nan
+    return vil
+
+# Derived pseudo-fields, with the function computing each one from the sampled levels and its Py-ART field metadata
+DERIVED_FIELDS = {
+    "composite_reflectivity": {"compute": composite_reflectivity, "units": "dBZ", "long_name": "Composite reflectivity"},
+    "echo_tops": {"compute": echo_tops, "units": "km", "long_name": "Echo tops (18 dBZ) above sea level"},
+    "vil": {"compute": vertically_integrated_liquid, "units": "kg/m^2", "long_name": "Vertically integrated liquid"},
+}
+
+def derive_fields(radar):
+    """
+    Computes every derived field of a volume from one sampling of its elevations.
+
+    Returns:
+        dict: {field: float32[bins, gates] on the canonical azimuth bins of the lowest sweep, NaN where there
+        is no data}, plus "sweep", the index of that sweep.
+    """
+    base, levels = sample_levels(radar)
+    fields = {field: settings["compute"](levels) for field, settings in DERIVED_FIELDS.items()}
+    fields["sweep"] = np.int64(base)
+    return fields
+
+def derived_sweep_radar(radar, sweep_index, fields):
+    """
+    Builds the single sweep radar the derived fields are rendered from: sweep_index of radar (the sweep the
+    fields were laid out on, see derive_fields()) with every derived field on its rays.
+
+    Returns:
+        pyart.core.Radar: Radar with one sweep holding the derived fields.
+    """
+    sweep = radar.extract_sweeps([sweep_index])
+    nbins = fields["composite_reflectivity"].shape[0]
+    rows = np.floor(sweep.get_azimuth(0) / (360.0 / nbins)).astype(np.intp) % nbins
+    for field, settings in DERIVED_FIELDS.items():
+        sweep.add_field(field, {
+            "data": np.ma.masked_invalid(fields[field][rows]),
+            "units": settings["units"],
+            "long_name": settings["long_name"],
+            "_FillValue": -9999.0,
+        }, replace_existing=True)
+    return sweep
@@ -0,0 +1,134 @@
+# This file holds the executors that keep blocking radar work off the FastAPI event loop
+# CPU-bound decoding and rendering runs in a process pool, I/O-bound S3 and disk work in a thread pool, and
+# a single-flight layer lets concurrent identical requests share one computation
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from RT_metrics import traced, worker_call, merge_worker_result, forget_worker_stats
+
+CPU_WORKERS = int(os.environ.get("RADAR_CPU_WORKERS", os.cpu_count() or 2))
+IO_WORKERS = int(os.environ.get("RADAR_IO_WORKERS", 32))
+
+# Modules imported once by the fork server, so every worker starts with Py-ART and matplotlib loaded
+WORKER_PRELOAD = ["RT_data_processing", "RT_product_cache"]
+
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="radar-io")
+_cpu_pool = None
+
+def _init_worker():
+    """Gives every worker an equal share of the volume cache budget, so together they stay within it."""
+    from RT_volume_cache import volume_cache, MAX_CACHE_BYTES
+    volume_cache.max_bytes = MAX_CACHE_BYTES // CPU_WORKERS
+
+def cpu_pool():
+    """
+    Returns the process pool for decode and render work, starting it on first use.
+
+    Workers are forked from a fork server rather than from the API process, which by then runs an event
+    loop and boto3 threads that are not safe to fork. Each worker keeps its own decoded volume cache, with an
+    equal share of RADAR_CACHE_MAX_BYTES (see RT_volume_cache). Decoded volumes are not shared between workers:
+    tasks go to whichever worker is free, so products of one volume rendered on different workers each decode
+    it (or, through read_radar_sweep, just the cut they need) once per worker.
+    """
+    global _cpu_pool
+    if _cpu_pool is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(WORKER_PRELOAD)
+        _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=context, initializer=_init_worker)
+    return _cpu_pool
+
+async def run_io(fn, *args, **kwargs):
+    """
+    Runs a blocking I/O-bound call in the thread pool, in the caller's context (request ID and profiler, see
+    traced in RT_metrics).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(contextvars.copy_context().run, traced, fn, *args, **kwargs))
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Runs a CPU-bound call in the process pool. fn and its arguments must be picklable. The call runs under the
+    caller's request ID and its spans are recorded in this process (see worker_call in RT_metrics).
+    """
+    global _cpu_pool
+    loop = asyncio.get_running_loop()
+    fn, args, kwargs = worker_call(fn, *args, **kwargs)
+    try:
+        return merge_worker_result(await loop.run_in_executor(cpu_pool(), functools.partial(fn, *args, **kwargs)))
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool for the next call
+        _cpu_pool = None
+        forget_worker_stats()
+        raise
+
+def shutdown_executors():
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+    io_pool.shutdown(wait=False, cancel_futures=True)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation.
+
+    The first caller of a key runs it; callers arriving while it is in flight await the same result. A caller
+    that disconnects does not cancel the shared computation. do() coalesces coroutines on the event loop,
+    call() coalesces blocking calls made from several threads.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Awaits fn(*args, **kwargs) (a coroutine function), shared with every concurrent call of key."""
+        future = self._flights.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = future
+            future.add_done_callback(lambda done: self._flights.pop(key) if self._flights.get(key) is done else None)
+        return await asyncio.shield(future)
+
+    def call(self, key, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in this thread, or waits for the same call of key running in another thread."""
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                self.leaders += 1
+                future = Future()
+                self._flights[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+        return future.result()
+
+    def stats(self):
+        calls = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+        }
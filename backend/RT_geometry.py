@@ -0,0 +1,118 @@
+# This file holds the persistent store of per-site gate geometry
+# The lat/lon of every gate only depends on the site, the azimuth bins, the range gates and the elevation of a
+# sweep, so it is projected once and kept as float32 .npy files that every worker process memory-maps
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pyart
+
+from RT_gridding import canonical_azimuths, canonical_sweep, evict_stale_files
+
+GEOMETRY_DIR = os.environ.get("GEOMETRY_DIR", "../data/geometry")
+GEOMETRY_MEMORY = 64  # Memory maps kept open per process
+GEOMETRY_MAX_AGE = float(os.environ.get("GEOMETRY_MAX_AGE_DAYS", 7)) * 86400  # Seconds an unused file is kept
+
+def sweep_geometry_key(radar, sweep_index):
+    """
+    Describes the gate layout of a sweep: radar ID and site, canonical azimuth bins, range gates and the
+    measured elevation (see RT_gridding.geometry_key for why measured rather than fixed).
+    """
+    ranges = radar.range["data"]
+    return {
+        "radar_id": str(radar.metadata.get("instrument_name", "")),
+        "site": [round(float(radar.latitude["data"][0]), 4), round(float(radar.longitude["data"][0]), 4),
+                 round(float(radar.altitude["data"][0]), 1)],
+        "azimuth_bins": canonical_azimuths(len(radar.get_azimuth(sweep_index)))[1],
+        "range": [float(ranges[0]), float(ranges[1] - ranges[0]) if len(ranges) > 1 else 0.0, int(len(ranges))],
+        "elevation": round(float(np.median(radar.get_elevation(sweep_index))), 3),
+    }
+
+def project_gates(key):
+    """
+    Projects the gates of a geometry key like Radar.get_gate_lat_lon_alt, on the canonical azimuth bin centres.
+
+    Returns:
+        ndarray: float32[2, bins + 1, gates] of lat and lon. The extra row repeats bin 0 so the last bin's
+        polygons close the circle.
+    """
+    lat0, lon0, _ = key["site"]
+    range_start, range_step, ngates = key["range"]
+    nbins = key["azimuth_bins"]
+    azimuths = (np.arange(nbins + 1) % nbins + 0.5) * (360.0 / nbins)
+    x, y, _ = pyart.core.antenna_vectors_to_cartesian(
+        range_start + range_step * np.arange(ngates), azimuths, np.full(nbins + 1, key["elevation"]))
+    lon, lat = pyart.core.cartesian_to_geographic_aeqd(x, y, lon0, lat0)
+    return np.stack([lat, lon]).astype(np.float32)
+
+class GateGeometryStore:
+    """
+    Gate lat/lon of every sweep layout seen so far, as read-only memory maps.
+
+    Files are named {radar_id}_{hash of the key}.npy under GEOMETRY_DIR and written through an atomic rename,
+    so worker processes share the pages of one file and never see a partial one. Files not mapped for
+    GEOMETRY_MAX_AGE are deleted by evict() (see the retention policy in RT_catalog).
+    """
+
+    def __init__(self, geometry_dir=GEOMETRY_DIR, max_open=GEOMETRY_MEMORY):
+        self.geometry_dir = geometry_dir
+        self.max_open = max_open
+        self.builds = 0
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, radar, sweep_index):
+        """
+        Returns the gate geometry of a sweep, projecting and storing it the first time its layout is seen.
+
+        Returns:
+            tuple: (lat, lon) float32 arrays of shape (bins + 1, gates), rows in canonical azimuth bin order.
+        """
+        key = sweep_geometry_key(radar, sweep_index)
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+        path = os.path.join(self.geometry_dir, f"{key['radar_id'] or 'site'}_{digest[:24]}.npy")
+
+        with self._lock:
+            geometry = self._maps.get(path)
+            if geometry is None:
+                if not os.path.exists(path):
+                    os.makedirs(self.geometry_dir, exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                    np.save(tmp_path, project_gates(key))
+                    os.replace(tmp_path, path)
+                    self.builds += 1
+                else:
+                    os.utime(path)  # Mark as recently used for eviction
+                geometry = self._maps[path] = np.load(path, mmap_mode="r")
+                while len(self._maps) > self.max_open:
+                    self._maps.popitem(last=False)
+            else:
+                self._maps.move_to_end(path)
+        return geometry[0], geometry[1]
+
+    def evict(self, max_age=GEOMETRY_MAX_AGE, now=None):
+        """
+        Deletes the files not mapped for max_age seconds. Processes that still map one keep their pages.
+
+        Returns:
+            int: Number of bytes freed.
+        """
+        return evict_stale_files(self.geometry_dir, max_age, now)
+
+# Shared store used by the polygon renderer
+gate_geometry = GateGeometryStore()
+
+def canonical_sweep_geometry(radar, field, sweep_index):
+    """
+    Returns a sweep of a field with its gate geometry, both in canonical azimuth bin order.
+
+    Returns:
+        tuple: (lat, lon, masked values); values have one more row than bins, repeating bin 0 like the geometry.
+    """
+    lat, lon = gate_geometry.get(radar, sweep_index)
+    values, valid = canonical_sweep(radar, field, sweep_index)
+    values = np.ma.masked_array(np.vstack([values, values[:1]]), mask=~np.vstack([valid, valid[:1]]))
+    return lat, lon, values
@@ -0,0 +1,290 @@
+# This file holds the gridding engine that replaces per-request pyart.map.grid_from_radars calls
+# A site's gate geometry is the same from one volume to the next, so the gate -> grid neighbours and weights of
+# pyart's Barnes2 / dist_beam gridding are computed once per (site, sweep geometry, grid spec), stored as a
+# sparse matrix, and every later volume is gridded with one sparse matrix-vector product
+import os
+import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pyart
+import scipy.sparse
+
+from RT_metrics import span
+
+GRID_TABLE_DIR = os.environ.get("GRID_TABLE_DIR", "../data/grid_tables")
+GRID_TABLE_MEMORY = 4  # Mapping tables kept in memory
+GRID_TABLE_MAX_AGE = float(os.environ.get("GRID_TABLE_MAX_AGE_DAYS", 7)) * 86400  # Seconds an unused table is kept
+GRID_SHAPE = (1, 500, 500)
+GRID_LIMITS = ((0, 20000), (-150000, 150000), (-150000, 150000))
+
+# pyart.map.map_gates_to_grid defaults: dist_beam radius of influence and Barnes2 weights
+MIN_RADIUS = 250.0
+BEAM_FACTOR = np.tan(np.deg2rad(1.0 * 1.0))  # tan(nb * bsp)
+GATE_BATCH = 200000  # Gates per vectorized batch while building a table
+
+def canonical_azimuths(nrays):
+    """
+    Returns the nominal azimuth resolution and bin count of a sweep with nrays rays (0.5 or 1 degree for NEXRAD).
+    """
+    resolution = 0.5 if nrays > 540 else 1.0
+    return resolution, int(round(360 / resolution))
+
+def canonical_sweep(radar, field, sweep_index):
+    """
+    Reorders one sweep of a field onto its canonical azimuth bins, bin k centred on (k + 0.5) * resolution.
+
+    Rays jitter by a fraction of a degree between volumes; snapping them to fixed bins is what lets the
+    same mapping table serve every volume of a site.
+
+    Returns:
+        tuple: (values float32[bins, gates], valid bool[bins, gates])
+    """
+    data = radar.get_field(sweep_index, field)
+    resolution, nbins = canonical_azimuths(data.shape[0])
+    bins = np.floor(radar.get_azimuth(sweep_index) / resolution).astype(np.int64) % nbins
+
+    values = np.zeros((nbins, data.shape[1]), dtype=np.float32)
+    valid = np.zeros((nbins, data.shape[1]), dtype=bool)
+    values[bins] = np.ma.getdata(data)
+    valid[bins] = ~np.ma.getmaskarray(data)
+    return values, valid
+
+def _grid_params(grid_shape, grid_limits):
+    """Grid starts and steps as computed by pyart (a single level grid sits at its lower limit)."""
+    starts, steps = [], []
+    for n, (start, stop) in zip(grid_shape, grid_limits):
+        starts.append(float(start))
+        steps.append(0.0 if n == 1 else (stop - start) / (n - 1.0))
+    return starts, steps
+
+def geometry_key(radar, grid_shape=GRID_SHAPE, grid_limits=GRID_LIMITS):
+    """
+    Describes everything a mapping table depends on: site location, range gates, canonical sweep layout
+    and the grid spec. Volumes with equal keys share a table.
+    """
+    starts, steps = _grid_params(grid_shape, grid_limits)
+    ranges = radar.range["data"]
+    return {
+        "site": [round(float(radar.latitude["data"][0]), 4), round(float(radar.longitude["data"][0]), 4),
+                 round(float(radar.altitude["data"][0]), 1)],
+        "range": [float(ranges[0]), float(ranges[1] - ranges[0]) if len(ranges) > 1 else 0.0, int(len(ranges))],
+        # Measured elevations sit a few hundredths of a degree off the fixed angles, enough to move the beam
+        # by ~100 m at the edge of the grid; they are quantized in the data, so their median is stable
+        "sweeps": [[round(float(np.median(radar.get_elevation(sweep_index))), 3),
+                    canonical_azimuths(len(radar.get_azimuth(sweep_index)))[1]]
+                   for sweep_index in range(radar.nsweeps)],
+        "grid": [list(grid_shape), starts, steps],
+    }
+
+class GridMappingTable:
+    """
+    Sparse gate -> grid weights for one geometry key.
+
+    Columns index the canonical sweeps of a volume laid end to end (see canonical_sweep), rows the flattened
+    grid. A field is gridded as (W @ (values * valid)) / (W @ valid), masked where no valid gate contributes,
+    which is the weighted mean pyart computes.
+    """
+
+    def __init__(self, key, weights, lat, lon):
+        self.key = key
+        self.weights = weights.tocsr()
+        self.lat = lat
+        self.lon = lon
+
+    @classmethod
+    def build(cls, key):
+        """Computes the table of a geometry key. Takes seconds; callers should go through grid_tables."""
+        lat0, lon0, _ = key["site"]
+        range_start, range_step, ngates = key["range"]
+        grid_shape, starts, steps = key["grid"]
+        nz, ny, nx = grid_shape
+        ranges = range_start + range_step * np.arange(ngates)
+
+        rows, cols, vals = [], [], []
+        column_offset = 0
+        for elevation, nbins in key["sweeps"]:
+            resolution = 360.0 / nbins
+            azimuths = (np.arange(nbins) + 0.5) * resolution
+            elevations = np.full(nbins, elevation)
+            x, y, z = pyart.core.antenna_vectors_to_cartesian(ranges, azimuths, elevations)
+            x, y, z = (np.asarray(c, dtype=np.float32).ravel().astype(np.float64) for c in (x, y, z))
+            columns = column_offset + np.arange(x.size)
+            column_offset += x.size
+
+            roi = np.maximum(np.sqrt(x * x + y * y + z * z) * BEAM_FACTOR, MIN_RADIUS)
+            # Gates whose radius of influence misses the grid entirely never contribute
+            keep = np.abs(z - starts[0]) <= roi
+            for c, start, step, n in ((x, starts[2], steps[2], nx), (y, starts[1], steps[1], ny)):
+                keep &= (c + roi >= start) & (c - roi <= start + step * (n - 1))
+            kept = np.flatnonzero(keep)
+
+            for batch_start in range(0, kept.size, GATE_BATCH):
+                gates = kept[batch_start:batch_start + GATE_BATCH]
+                for r, c, v in _gate_weights(x[gates], y[gates], z[gates], roi[gates], starts, steps, grid_shape):
+                    rows.append(r)
+                    cols.append(columns[gates][c])
+                    vals.append(v)
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        vals = np.concatenate(vals) if vals else np.zeros(0, dtype=np.float32)
+        weights = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(nz * ny * nx, column_offset), dtype=np.float32)
+
+        grid_y = starts[1] + steps[1] * np.arange(ny)
+        grid_x = starts[2] + steps[2] * np.arange(nx)
+        lon, lat = pyart.core.cartesian_to_geographic_aeqd(*np.meshgrid(grid_x, grid_y), lon0, lat0)
+        return cls(key, weights, lat, lon)
+
+    def grid(self, radar, field):
+        """
+        Grids every sweep of a field.
+
+        Returns:
+            tuple: (lat grid, lon grid, masked value grid), the lowest grid level of each like grid_from_radars.
+        """
+        values, valid = [], []
+        for sweep_index in range(radar.nsweeps):
+            sweep_values, sweep_valid = canonical_sweep(radar, field, sweep_index)
+            values.append(sweep_values.ravel())
+            valid.append(sweep_valid.ravel())
+        values = np.concatenate(values)
+        valid = np.concatenate(valid).astype(np.float32)
+
+        weight_sum = self.weights @ valid
+        value_sum = self.weights @ (values * valid)
+        nz, ny, nx = self.key["grid"][0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grid = np.ma.masked_array(value_sum / weight_sum, mask=weight_sum == 0)
+        return self.lat, self.lon, grid.reshape(nz, ny, nx)[0]
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"  # Workers building the same table must not share a temp file
+        np.savez(
+            tmp_path,
+            key=json.dumps(self.key),
+            data=self.weights.data, indices=self.weights.indices, indptr=self.weights.indptr,
+            shape=np.array(self.weights.shape), lat=self.lat, lon=self.lon,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as table:
+            weights = scipy.sparse.csr_matrix(
+                (table["data"], table["indices"], table["indptr"]), shape=tuple(table["shape"]))
+            return cls(json.loads(str(table["key"])), weights, table["lat"], table["lon"])
+
+def _gate_weights(x, y, z, roi, starts, steps, grid_shape):
+    """
+    Yields (grid rows, gate positions within the batch, weights) of a batch of gates, one offset of the
+    search box at a time, with the same box and distance rules as pyart's GateToGridMapper.map_gate.
+    """
+    nz, ny, nx = grid_shape
+    x = x - starts[2]
+    y = y - starts[1]
+    z = z - starts[0]
+    roi2 = roi * roi
+    x_min = np.maximum(np.ceil((x - roi) / steps[2]), 0).astype(np.int64)
+    x_max = np.minimum(np.floor((x + roi) / steps[2]), nx - 1).astype(np.int64)
+    y_min = np.maximum(np.ceil((y - roi) / steps[1]), 0).astype(np.int64)
+    y_max = np.minimum(np.floor((y + roi) / steps[1]), ny - 1).astype(np.int64)
+    span_x = int(max(0, (x_max - x_min).max(initial=-1) + 1))
+    span_y = int(max(0, (y_max - y_min).max(initial=-1) + 1))
+    dz2 = z * z  # Single level grid: every grid point sits at z = 0
+
+    for dx in range(span_x):
+        xi = x_min + dx
+        in_x = xi <= x_max
+        dist_x2 = (steps[2] * xi - x) ** 2
+        for dy in range(span_y):
+            yi = y_min + dy
+            dist2 = dist_x2 + (steps[1] * yi - y) ** 2 + dz2
+            hit = np.flatnonzero(in_x & (yi <= y_max) & (dist2 <= roi2))
+            if hit.size:
+                weight = (np.exp(-dist2[hit] / (roi2[hit] / 4)) + 1e-5).astype(np.float32)
+                yield yi[hit] * nx + xi[hit], hit, weight
+
+def evict_stale_files(directory, max_age, now=None):
+    """
+    Deletes the files of a directory not used (see os.utime) for max_age seconds. Keys of the on-disk stores
+    include the measured elevation, so new ones keep appearing and the old ones are never looked up again.
+
+    Returns:
+        int: Number of bytes freed.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = (now if now is not None else time.time()) - max_age
+    freed = 0
+    for entry in os.scandir(directory):
+        try:
+            stat = entry.stat()
+            if entry.is_file() and stat.st_mtime < cutoff:
+                os.remove(entry.path)
+                freed += stat.st_size
+        except FileNotFoundError:
+            pass
+    return freed
+
+class GridTableStore:
+    """
+    Keeps mapping tables on disk under GRID_TABLE_DIR and the most recently used ones in memory. Tables not
+    loaded for GRID_TABLE_MAX_AGE are deleted by evict() (see the retention policy in RT_catalog).
+    """
+
+    def __init__(self, table_dir=GRID_TABLE_DIR, max_tables=GRID_TABLE_MEMORY):
+        self.table_dir = table_dir
+        self.max_tables = max_tables
+        self.builds = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the table of a geometry key, loading or building (and persisting) it on a miss."""
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+        with self._lock:
+            table = self._tables.get(digest)
+            if table is not None:
+                self._tables.move_to_end(digest)
+                return table
+
+            path = os.path.join(self.table_dir, f"{digest}.npz")
+            if os.path.exists(path):
+                table = GridMappingTable.load(path)
+                os.utime(path)  # Mark as recently used for eviction
+            else:
+                print(f"Building grid mapping table {digest[:12]} for site {key['site']}")
+                table = GridMappingTable.build(key)
+                self.builds += 1
+                os.makedirs(self.table_dir, exist_ok=True)
+                table.save(path)
+
+            self._tables[digest] = table
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+            return table
+
+    def evict(self, max_age=GRID_TABLE_MAX_AGE, now=None):
+        """Deletes the tables not loaded for max_age seconds. Returns the number of bytes freed."""
+        return evict_stale_files(self.table_dir, max_age, now)
+
+# Shared store used by the gridded endpoints
+grid_tables = GridTableStore()
+
+def grid_radar_field(radar, field, grid_shape=GRID_SHAPE, grid_limits=GRID_LIMITS):
+    """
+    Drop-in for pyart.map.grid_from_radars(radar, grid_shape, grid_limits, fields=[field]) on a single level
+    grid centred on the radar.
+
+    Returns:
+        tuple: (lat grid, lon grid, masked value grid)
+    """
+    if grid_shape[0] != 1:
+        raise ValueError("Mapping tables only support single level grids")
+    with span("grid", field=field):
+        table = grid_tables.get(geometry_key(radar, grid_shape, grid_limits))
+        return table.grid(radar, field)
@@ -0,0 +1,181 @@
+# This file holds the background scheduler that keeps radars warm
+# Configured radars (WARM_RADARS) and recently requested ones are polled on a cadence matching their VCP scan
+# interval, so the API answers from already ingested local data instead of blocking on S3
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+
+SCHEDULER_ENABLED = os.environ.get("INGEST_SCHEDULER", "1") != "0"  # Set INGEST_SCHEDULER=0 to only ingest on request
+WARM_RADARS = [radar_id.strip() for radar_id in os.environ.get("WARM_RADARS", "").split(",") if radar_id.strip()]
+RECENT_REQUEST_WINDOW = 1800  # Time (seconds) a requested radar stays warm after its last request
+MAX_CONCURRENT_INGESTS = int(os.environ.get("MAX_CONCURRENT_INGESTS", 4))
+MIN_POLL_INTERVAL = 30  # Time (seconds) between polls while waiting for the next volume
+MAX_POLL_INTERVAL = 1800  # Backoff ceiling (seconds) for sites that stopped producing volumes
+
+# Approximate time (seconds) to complete one volume for common VCPs
+VCP_SCAN_INTERVALS = {
+    12: 270, 212: 270, 112: 330, 121: 330, 215: 360, 11: 300, 211: 300, 21: 360, 221: 360, 35: 420, 31: 600, 32: 600,
+}
+DEFAULT_SCAN_INTERVAL = 300
+
+def scan_interval(vcp):
+    """Returns the expected time between volumes for a VCP."""
+    return VCP_SCAN_INTERVALS.get(vcp, DEFAULT_SCAN_INTERVAL)
+
+def _scan_age(timestamp):
+    """Seconds between a YYYYMMDD-HHMMSS scan timestamp and now."""
+    scan_time = datetime.strptime(timestamp, "%Y%m%d-%H%M%S").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - scan_time).total_seconds()
+
+class IngestScheduler:
+    """
+    Polls warm radars in the background with a global cap on concurrent ingests.
+
+    Args:
+        ingest_fn (callable): Blocking function radar_id -> (path of the latest local volume, True if it is new).
+        vcp_fn (callable): Blocking function path -> VCP number of a volume, or None.
+        warm_radars (list): Radars kept warm regardless of requests.
+    """
+
+    def __init__(self, ingest_fn, vcp_fn=None, warm_radars=WARM_RADARS, max_concurrency=MAX_CONCURRENT_INGESTS):
+        self.ingest_fn = ingest_fn
+        self.vcp_fn = vcp_fn
+        self.warm_radars = set(warm_radars)
+        self.max_concurrency = max_concurrency
+        self._radars = {}
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+        self._waiting = set()
+        self._running = set()
+        for radar_id in self.warm_radars:
+            self._add(radar_id)
+
+    def _add(self, radar_id):
+        return self._radars.setdefault(radar_id, {
+            "next_poll": time.monotonic(),
+            "interval": DEFAULT_SCAN_INTERVAL,
+            "idle_polls": 0,
+            "vcp": None,
+            "latest_file": None,
+            "last_requested": None,
+            "last_poll": None,
+            "last_error": None,
+            "schedule_lag": 0.0,
+        })
+
+    def touch(self, radar_id):
+        """Marks a radar as recently requested, so it is polled and kept warm for RECENT_REQUEST_WINDOW."""
+        new = radar_id not in self._radars
+        state = self._add(radar_id)
+        state["last_requested"] = time.monotonic()
+        if new and self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Starts the scheduler loop on the running event loop."""
+        if not SCHEDULER_ENABLED:
+            print("Background ingest scheduler disabled")
+            return
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            for radar_id in list(self._radars):
+                state = self._radars[radar_id]
+                if radar_id not in self.warm_radars and (state["last_requested"] is None or now - state["last_requested"] > RECENT_REQUEST_WINDOW):
+                    if radar_id not in self._waiting and radar_id not in self._running:
+                        del self._radars[radar_id]
+                    continue
+                if state["next_poll"] <= now and radar_id not in self._waiting and radar_id not in self._running:
+                    self._waiting.add(radar_id)
+                    asyncio.create_task(self._poll(radar_id))
+
+            # Sleep until the next radar is due, or until a new radar is requested
+            next_due = min((state["next_poll"] for state in self._radars.values()), default=now + MIN_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.5, min(next_due - now, MIN_POLL_INTERVAL)))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, radar_id):
+        state = self._radars[radar_id]
+        async with self._semaphore:
+            self._waiting.discard(radar_id)
+            self._running.add(radar_id)
+            started = time.monotonic()
+            state["schedule_lag"] = max(0.0, started - state["next_poll"])
+            try:
+                path, assembled = await asyncio.to_thread(self.ingest_fn, radar_id)
+                state["last_error"] = None
+            except Exception as e:
+                print(f"Scheduled ingest of {radar_id} failed: {e}")
+                path, assembled = None, False
+                state["last_error"] = str(e)
+            finally:
+                self._running.discard(radar_id)
+
+        state["last_poll"] = time.monotonic()
+        if path and (assembled or state["vcp"] is None) and self.vcp_fn is not None:
+            try:
+                state["vcp"] = await asyncio.to_thread(self.vcp_fn, path)
+            except Exception as e:
+                print(f"Could not read the VCP of {path}: {e}")
+        if path:
+            state["latest_file"] = path
+
+        interval = scan_interval(state["vcp"])
+        age = self._data_age(state)
+        if age is not None and age < 3 * interval:
+            # The latest volume started at its timestamp, so the one after it completes two intervals later
+            state["idle_polls"] = 0
+            state["interval"] = max(MIN_POLL_INTERVAL, 2 * interval - age)
+        else:
+            # No recent volume: back off on sites that stay idle
+            state["interval"] = min(MIN_POLL_INTERVAL * 2 ** state["idle_polls"], MAX_POLL_INTERVAL)
+            state["idle_polls"] += 1
+        state["next_poll"] = state["last_poll"] + state["interval"]
+
+    @staticmethod
+    def _data_age(state):
+        latest_file = state["latest_file"]
+        if not latest_file:
+            return None
+        return _scan_age(os.path.basename(latest_file).split("_")[-1].split(".")[0])
+
+    def status(self):
+        """Returns the queue depth and the per-radar lag of the scheduler."""
+        now = time.monotonic()
+        radars = {}
+        for radar_id, state in self._radars.items():
+            latest_file = state["latest_file"]
+            radars[radar_id] = {
+                "warm": radar_id in self.warm_radars,
+                "vcp": state["vcp"],
+                "latest_file": os.path.basename(latest_file) if latest_file else None,
+                "data_age_seconds": self._data_age(state),
+                "next_poll_in_seconds": state["next_poll"] - now,
+                "poll_interval_seconds": state["interval"],
+                "idle_polls": state["idle_polls"],
+                "schedule_lag_seconds": state["schedule_lag"],
+                "last_error": state["last_error"],
+            }
+        return {
+            "queue_depth": len(self._waiting),
+            "in_flight": len(self._running),
+            "max_concurrency": self.max_concurrency,
+            "radars": radars,
+        }
@@ -0,0 +1,338 @@
+# This file holds low level helpers for the NEXRAD Level II archive format
+# An assembled volume is a 24 byte volume header followed by LDM records, each one a 4 byte big-endian
+# control word (the record size) and a bzip2 compressed run of 2432 byte messages or variable length message 31s
+import os
+import bz2
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from RT_executors import CPU_WORKERS
+
+VOLUME_HEADER_SIZE = 24
+CONTROL_WORD_SIZE = 4
+CTM_HEADER_SIZE = 12  # Legacy channel terminal manager bytes in front of every message
+MESSAGE_HEADER = struct.Struct(">HBBHHIHH")  # size (halfwords), channel, type, sequence, date, ms, segments, segment
+RECORD_SIZE = 2432  # Fixed length of every message other than message 31
+
+# Message 31 header, following the message header: id, collect ms/date, azimuth number/angle, compression,
+# spare, radial length, azimuth resolution, radial status, elevation number, cut sector, elevation angle, ...
+MSG31_HEADER = struct.Struct(">4sIHHfBBHBBBBf")
+MSG31_BLOCKS = struct.Struct(">2xH10I")  # Block count and the offsets of the data blocks, after the header above
+DATA_BLOCK_HEADER = struct.Struct(">c3s4xHhh")  # Block type, name, gate count, first gate and gate spacing (m)
+MSG5_HEADER = struct.Struct(">HHHHHBB10x")  # Size, pattern type, pattern (VCP) number, cut count, ...
+MSG5_CUT_SIZE = 46  # Every cut of message 5 starts with its elevation angle (360 / 65536 degree units)
+INDEX_PEEK_SIZE = 65536  # Decompressed bytes read from a record to find its first radial while indexing
+# Threads decompressing records per process; every run_cpu worker decompresses at once, so they split the cores
+DECOMPRESS_WORKERS = int(os.environ.get("DECOMPRESS_WORKERS", max(1, (os.cpu_count() or 1) // CPU_WORKERS)))
+
+# Radial status codes of message 31
+START_OF_ELEVATION = 0
+INTERMEDIATE_RADIAL = 1
+END_OF_ELEVATION = 2
+START_OF_VOLUME = 3
+END_OF_VOLUME = 4
+START_OF_LAST_ELEVATION = 5
+
+def split_records(buf, offset=VOLUME_HEADER_SIZE):
+    """
+    Splits a compressed Level II buffer into its LDM records.
+
+    Args:
+        buf (bytes): Contents of an assembled volume or of a single chunk.
+        offset (int): Where the first control word starts (24 for a file that begins with a volume header).
+
+    Returns:
+        list: (offset, size) of the bzip2 payload of every complete record.
+    """
+    records = []
+    pos = offset
+    while pos + CONTROL_WORD_SIZE <= len(buf):
+        size = abs(struct.unpack_from(">i", buf, pos)[0])
+        if size == 0 or pos + CONTROL_WORD_SIZE + size > len(buf):
+            break
+        records.append((pos + CONTROL_WORD_SIZE, size))
+        pos += CONTROL_WORD_SIZE + size
+    return records
+
+def has_volume_header(buf):
+    """Checks whether a buffer starts with an AR2V volume header (true for the S chunk of a volume)."""
+    return buf[:4] == b"AR2V"
+
+def decompress_record(buf, offset, size):
+    """Decompresses one LDM record."""
+    return bz2.decompress(buf[offset:offset + size])
+
+def iter_messages(data):
+    """
+    Walks the messages of a decompressed record.
+
+    Yields:
+        tuple: (message type, offset of the message including its CTM bytes, total message length)
+    """
+    pos = 0
+    while pos + CTM_HEADER_SIZE + MESSAGE_HEADER.size <= len(data):
+        size, _, msg_type, _, _, _, segments, segment = MESSAGE_HEADER.unpack_from(data, pos + CTM_HEADER_SIZE)
+        if msg_type == 31:
+            if size == 65535:
+                size = (segments << 16) | segment
+            length = CTM_HEADER_SIZE + size * 2
+        else:
+            length = RECORD_SIZE
+        if length <= CTM_HEADER_SIZE:
+            break
+        yield msg_type, pos, length
+        pos += length
+
+def parse_radial(data, pos):
+    """
+    Parses the header of a message 31 radial.
+
+    Returns:
+        dict: azimuth_number, azimuth_angle, radial_status, elevation_number and elevation_angle of the radial.
+    """
+    fields = MSG31_HEADER.unpack_from(data, pos + CTM_HEADER_SIZE + MESSAGE_HEADER.size)
+    return {
+        "azimuth_number": fields[3],
+        "azimuth_angle": fields[4],
+        "radial_status": fields[9],
+        "elevation_number": fields[10],
+        "elevation_angle": fields[12],
+    }
+
+def radial_moments(data, pos):
+    """
+    Lists the moments carried by a message 31 radial.
+
+    Returns:
+        list: [name, gate count, first gate (m), gate spacing (m)] of every moment data block.
+    """
+    body = pos + CTM_HEADER_SIZE + MESSAGE_HEADER.size
+    count, *pointers = MSG31_BLOCKS.unpack_from(data, body + MSG31_HEADER.size)
+    moments = []
+    for pointer in pointers[:count]:
+        if pointer == 0:
+            continue
+        block_type, name, ngates, first_gate, gate_spacing = DATA_BLOCK_HEADER.unpack_from(data, body + pointer)
+        if block_type == b"D":
+            moments.append([name.decode("ascii").strip(), ngates, first_gate, gate_spacing])
+    return moments
+
+def parse_vcp(data):
+    """
+    Reads the volume coverage pattern (message 5) out of the metadata messages of a volume.
+
+    Returns:
+        tuple: (VCP number, [elevation angle of every cut]) or (None, None) if there is no message 5.
+    """
+    for msg_type, pos, _ in iter_messages(data):
+        if msg_type != 5:
+            continue
+        body = pos + CTM_HEADER_SIZE + MESSAGE_HEADER.size
+        _, _, pattern, cuts, _, _, _ = MSG5_HEADER.unpack_from(data, body)
+        angles = [struct.unpack_from(">H", data, body + MSG5_HEADER.size + MSG5_CUT_SIZE * i)[0] * 360.0 / 65536.0
+                  for i in range(cuts)]
+        return pattern, angles
+    return None, None
+
+def _add_range(ranges, offset, size):
+    """Appends a byte range, merging it with the previous one if they touch."""
+    if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+        ranges[-1][1] += size
+    else:
+        ranges.append([offset, size])
+
+def _index_messages(buf):
+    """Cut index of an uncompressed volume: byte ranges of the messages of every elevation cut."""
+    stream = memoryview(buf)[VOLUME_HEADER_SIZE:]
+    metadata, cuts = [], {}
+    for msg_type, pos, length in iter_messages(stream):
+        offset = VOLUME_HEADER_SIZE + pos
+        if msg_type != 31:
+            if not cuts:
+                _add_range(metadata, offset, length)
+            continue
+        number = parse_radial(stream, pos)["elevation_number"]
+        cut = cuts.get(number)
+        if cut is None:
+            cut = cuts[number] = {"ranges": [], "moments": radial_moments(stream, pos)}
+        _add_range(cut["ranges"], offset, length)
+    metadata_bytes = b"".join(bytes(buf[offset:offset + size]) for offset, size in metadata)
+    return metadata, cuts, metadata_bytes
+
+def _index_records(buf):
+    """
+    Cut index of a compressed volume: the LDM records holding every elevation cut.
+
+    Only the head of a record is decompressed when its cut is known from it: radials are in elevation order, so
+    a record holds a single cut when the next record continues that cut or starts the next one. Records that
+    may span a cut boundary (and the last one) are decompressed whole.
+    """
+    metadata, metadata_bytes, heads = [], b"", []
+    for offset, size in split_records(buf):
+        head = bz2.BZ2Decompressor().decompress(buf[offset:offset + size], max_length=INDEX_PEEK_SIZE)
+        msg_type, pos, _ = next(iter_messages(head), (None, 0, 0))
+        if msg_type != 31:
+            data = decompress_record(buf, offset, size)
+            pos = next((msg_pos for msg_type, msg_pos, _ in iter_messages(data) if msg_type == 31), None)
+            if pos is None:
+                if not heads:  # The metadata record(s) in front of the first radial
+                    metadata.append([offset, size])
+                    metadata_bytes += data
+                continue
+            head = data
+        heads.append((offset, size, parse_radial(head, pos), radial_moments(head, pos)))
+
+    cuts = {}
+    for i, (offset, size, radial, moments) in enumerate(heads):
+        number = radial["elevation_number"]
+        following = heads[i + 1][2] if i + 1 < len(heads) else None
+        single_cut = following is not None and (
+            following["elevation_number"] == number
+            or following["radial_status"] in (START_OF_ELEVATION, START_OF_VOLUME, START_OF_LAST_ELEVATION))
+        if single_cut:
+            cuts.setdefault(number, {"ranges": [], "moments": moments})["ranges"].append([offset, size])
+            continue
+        data = decompress_record(buf, offset, size)
+        for msg_type, pos, _ in iter_messages(data):
+            if msg_type != 31:
+                continue
+            number = parse_radial(data, pos)["elevation_number"]
+            cut = cuts.setdefault(number, {"ranges": [], "moments": radial_moments(data, pos)})
+            if not cut["ranges"] or cut["ranges"][-1] != [offset, size]:
+                cut["ranges"].append([offset, size])
+    return metadata, cuts, metadata_bytes
+
+def index_volume(buf):
+    """
+    Builds the cut index of an assembled volume, so a single elevation cut can be read without decompressing
+    or parsing the rest of the volume (see cut_volume).
+
+    Returns:
+        dict: compressed flag, metadata byte ranges, VCP number and cut angles (message 5), and for every
+        elevation number its byte ranges and the moments of its first radial.
+    """
+    compressed = is_compressed(buf)
+    metadata, cuts, metadata_bytes = _index_records(buf) if compressed else _index_messages(buf)
+    vcp, cut_angles = parse_vcp(metadata_bytes)
+    return {
+        "compressed": compressed,
+        "metadata": metadata,
+        "vcp": vcp,
+        "cut_angles": cut_angles,
+        "cuts": {str(number): cut for number, cut in sorted(cuts.items())},
+    }
+
+def cut_volume(file_path, index, elevation_number):
+    """
+    Reads the metadata and one elevation cut of a volume, as an uncompressed volume of its own.
+
+    Returns:
+        bytes: Volume header, metadata messages and the messages of the cut (plus, for compressed volumes,
+        the neighbouring radials sharing its records).
+    """
+    cut = index["cuts"][str(elevation_number)]
+    parts = []
+    with open(file_path, "rb") as volume_file:
+        header = volume_file.read(VOLUME_HEADER_SIZE)
+        for offset, size in index["metadata"] + cut["ranges"]:
+            volume_file.seek(offset)
+            parts.append(volume_file.read(size))
+    if index["compressed"]:
+        parts = decompress_records(parts)
+    return b"".join([header, *parts])
+
+def record_radials(data):
+    """Parses every message 31 radial header of a decompressed record."""
+    return [parse_radial(data, pos) for msg_type, pos, _ in iter_messages(data) if msg_type == 31]
+
+def is_compressed(buf):
+    """Checks whether the records after the volume header are bzip2 compressed."""
+    return buf[VOLUME_HEADER_SIZE + CONTROL_WORD_SIZE:VOLUME_HEADER_SIZE + CONTROL_WORD_SIZE + 2] == b"BZ"
+
+# Decompression thread pools of this process, by size, reused across volumes
+_decompress_pools = {}
+_decompress_pools_lock = threading.Lock()
+
+def _decompress_pool(max_workers):
+    with _decompress_pools_lock:
+        pool = _decompress_pools.get(max_workers)
+        if pool is None:
+            pool = _decompress_pools[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="decompress")
+        return pool
+
+def decompress_records(records, max_workers=DECOMPRESS_WORKERS):
+    """
+    Decompresses bzip2 records in parallel. The bz2 module releases the GIL while decompressing, so threads
+    scale without copying the records into other processes, and they also run inside the workers of run_cpu.
+
+    Args:
+        records (list): Compressed record payloads (without their control word).
+        max_workers (int): Threads to spread the records over, 1 to decompress them in this thread.
+
+    Returns:
+        list: The decompressed records, in order.
+    """
+    if max_workers <= 1 or len(records) <= 1:
+        return [bz2.decompress(record) for record in records]
+    return list(_decompress_pool(max_workers).map(bz2.decompress, records))
+
+def message_stream(buf, max_workers=DECOMPRESS_WORKERS):
+    """Returns the uncompressed message stream of an assembled volume (everything after the volume header)."""
+    if not is_compressed(buf):
+        return buf[VOLUME_HEADER_SIZE:]
+    view = memoryview(buf)
+    records = [view[offset:offset + size] for offset, size in split_records(buf)]
+    return b"".join(decompress_records(records, max_workers))
+
+def decompress_volume(buf, max_workers=DECOMPRESS_WORKERS):
+    """
+    Rewrites a compressed volume as an uncompressed one, decompressing its records in parallel, so the reader
+    (Py-ART) only has to parse messages.
+
+    Returns:
+        bytes: The volume header followed by the message stream, or buf itself if it is not compressed.
+    """
+    if not is_compressed(buf):
+        return buf
+    view = memoryview(buf)
+    parts = decompress_records([view[offset:offset + size] for offset, size in split_records(buf)], max_workers)
+    # Readers check the first CTM bytes for a compression record marker; they carry nothing in a message stream
+    parts[0] = bytes(CTM_HEADER_SIZE) + parts[0][CTM_HEADER_SIZE:]
+    return b"".join([buf[:VOLUME_HEADER_SIZE], *parts])
+
+def volume_to_chunks(buf, radials_per_chunk=120):
+    """
+    Splits an assembled volume into the S/I/E chunk layout of the real-time chunk bucket.
+
+    The S chunk holds the volume header and the metadata record, every following chunk one compressed
+    record of at most radials_per_chunk radials that never spans two elevation cuts, and the last one is E.
+
+    Returns:
+        list: (chunk type, chunk bytes) in sequence order.
+    """
+    stream = message_stream(buf)
+    messages = list(iter_messages(stream))
+    first_radial = next(i for i, (msg_type, _, _) in enumerate(messages) if msg_type == 31)
+
+    def record(start, end):
+        data = bz2.compress(stream[start:end])
+        return struct.pack(">i", len(data)) + data
+
+    metadata_end = messages[first_radial][1]
+    chunks = [["S", buf[:VOLUME_HEADER_SIZE] + record(0, metadata_end)]]
+
+    group_start = metadata_end
+    group_size = 0
+    for msg_type, pos, length in messages[first_radial:]:
+        group_size += 1
+        status = parse_radial(stream, pos)["radial_status"] if msg_type == 31 else None
+        if group_size == radials_per_chunk or status in (END_OF_ELEVATION, END_OF_VOLUME):
+            chunks.append(["I", record(group_start, pos + length)])
+            group_start = pos + length
+            group_size = 0
+    if group_size:
+        chunks.append(["I", record(group_start, len(stream))])
+
+    chunks[-1][0] = "E"
+    return [tuple(chunk) for chunk in chunks]
@@ -0,0 +1,192 @@
+# This file holds the zoom- and viewport-aware level of detail of the sweep products
+# Gates are aggregated in azimuth and range until an aggregated gate covers a couple of screen pixels at the
+# requested zoom, and blocks outside the requested bounding box are dropped, so payloads and render time scale
+# with what is visible instead of with the full sweep. Viewports are snapped outward to a coarse grid at their zoom
+# level, so the renders of nearby viewports are one product, cached like the full resolution ones
+import math
+
+import numpy as np
+
+from RT_data_processing import cmaps, iter_polygon_features, feature_collection_chunks, render_sweep_polygons, pack_sweep
+from RT_geometry import canonical_sweep_geometry
+from RT_product_cache import product_cache, product_sweep, read_sweep
+
+TILE_SIZE = 256  # Web mercator tile size (pixels) the zoom levels refer to
+EARTH_CIRCUMFERENCE = 40075016.686  # Meters at the equator
+TARGET_PIXELS = 2.0  # Smallest on-screen size (pixels) of an aggregated gate
+MAX_AZIMUTH_FACTOR = 8  # Never merge more than this many azimuth bins
+VIEWPORT_MARGIN = 0.1  # Fraction of the bounding box added on every side, so edge polygons are not cut off
+VIEWPORT_GRID = 2  # Tiles at the viewport's zoom level that its bounding box is snapped outward to
+
+def parse_bbox(bbox):
+    """Parses a "west,south,east,north" query parameter into a tuple of floats."""
+    west, south, east, north = (float(value) for value in bbox.split(","))
+    if west >= east or south >= north:
+        raise ValueError(f"Invalid bounding box {bbox}, expected west,south,east,north")
+    return west, south, east, north
+
+def quantize_viewport(bbox, zoom):
+    """
+    Snaps a viewport to a whole zoom level and its bounding box outward to a grid of VIEWPORT_GRID tile widths,
+    so viewports a small pan apart share one cached render.
+
+    Returns:
+        tuple: ((west, south, east, north), zoom)
+    """
+    zoom = int(round(zoom))
+    step = VIEWPORT_GRID * 360.0 / 2 ** zoom
+    west, south, east, north = bbox
+    west, south = math.floor(west / step) * step, max(math.floor(south / step) * step, -90.0)
+    east, north = math.ceil(east / step) * step, min(math.ceil(north / step) * step, 90.0)
+    return (west, south, east, north), zoom
+
+def lod_variant(bbox, zoom):
+    """Product cache variant of the render of a (quantized) viewport."""
+    return f"lod|{zoom}|{','.join(f'{value:.6f}' for value in bbox)}"
+
+def ground_resolution(zoom, latitude):
+    """Meters per screen pixel at a web mercator zoom level and latitude."""
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(latitude)) / (TILE_SIZE * 2 ** zoom)
+
+def _divisor_at_most(n, limit):
+    """Largest divisor of n that is at most limit (and at least 1)."""
+    return max(d for d in range(1, max(1, int(limit)) + 1) if n % d == 0)
+
+def reduce_blocks(blocks, reducer):
+    """
+    Reduces masked blocks of shape (rows, cols, gates per block) along their last axis.
+
+    Returns:
+        MaskedArray: (rows, cols), masked where a block has no valid gate.
+    """
+    if reducer == "mean":
+        return blocks.mean(axis=2)
+    if reducer == "absmax":
+        picks = np.ma.argmax(np.ma.abs(blocks), axis=2, fill_value=-1)
+        reduced = np.take_along_axis(np.ma.getdata(blocks), picks[..., None], axis=2)[..., 0]
+        return np.ma.masked_array(reduced, mask=blocks.count(axis=2) == 0)
+    return blocks.max(axis=2)
+
+def sweep_lod(radar, field, sweep_index, bbox, zoom):
+    """
+    Aggregates a sweep for a viewport.
+
+    Args:
+        radar (Radar): Decoded volume.
+        field (str): Radar field name.
+        sweep_index (int): Sweep to aggregate.
+        bbox (tuple): (west, south, east, north) of the viewport in degrees.
+        zoom (float): Web mercator zoom level of the viewport.
+
+    Returns:
+        dict: lat/lon block corner arrays (blocks + 1 in each direction), the block values (masked outside the
+        viewport, padded with one masked row and column like the corner arrays), and the azimuth / range
+        aggregation factors. None if no gate of the sweep is visible.
+    """
+    lat, lon, values = canonical_sweep_geometry(radar, field, sweep_index)
+    nbins = values.shape[0] - 1
+    values = values[:nbins]
+
+    west, south, east, north = bbox
+    margin_x = (east - west) * VIEWPORT_MARGIN
+    margin_y = (north - south) * VIEWPORT_MARGIN
+    visible = ((lon[:nbins] >= west - margin_x) & (lon[:nbins] <= east + margin_x) &
+               (lat[:nbins] >= south - margin_y) & (lat[:nbins] <= north + margin_y))
+    if not visible.any():
+        return None
+
+    # Coarsest aggregation that still keeps an aggregated gate at TARGET_PIXELS on screen
+    ranges = radar.range["data"]
+    gate_spacing = float(ranges[1] - ranges[0])
+    meters = TARGET_PIXELS * ground_resolution(zoom, float(radar.latitude["data"][0]))
+    range_factor = max(1, int(meters // gate_spacing))
+    typical_range = max(float(np.median(np.broadcast_to(ranges, visible.shape)[visible])), gate_spacing)
+    arc = typical_range * math.radians(360.0 / nbins)
+    azimuth_factor = _divisor_at_most(nbins, min(MAX_AZIMUTH_FACTOR, meters // arc))
+
+    # Pad the gates to whole blocks, then fold every block into the last axis
+    ngates = values.shape[1]
+    nblocks_r = -(-ngates // range_factor)
+    pad = nblocks_r * range_factor - ngates
+    padded = np.ma.concatenate([values, np.ma.masked_all((nbins, pad), dtype=values.dtype)], axis=1) if pad else values
+    visible = np.pad(visible, ((0, 0), (0, pad)))
+    nblocks_az = nbins // azimuth_factor
+    shape = (nblocks_az, azimuth_factor, nblocks_r, range_factor)
+    blocks = padded.reshape(shape).transpose(0, 2, 1, 3).reshape(nblocks_az, nblocks_r, -1)
+    block_visible = visible.reshape(shape).any(axis=(1, 3))
+
+    reduced = reduce_blocks(blocks, cmaps.get(field, {}).get("reduce", "max"))
+    reduced[~block_visible] = np.ma.masked
+
+    # Drop the range blocks past the last visible one
+    last_block = int(np.flatnonzero(block_visible.any(axis=0)).max()) + 1
+    reduced = reduced[:, :last_block]
+
+    rows = np.arange(0, nbins + 1, azimuth_factor)
+    cols = np.minimum(np.arange(last_block + 1) * range_factor, ngates - 1)
+    data = np.ma.masked_all((nblocks_az + 1, last_block + 1), dtype=np.float32)
+    data[:-1, :-1] = reduced
+    return {
+        "lat": np.asarray(lat[rows][:, cols]),
+        "lon": np.asarray(lon[rows][:, cols]),
+        "values": data,
+        "azimuth_factor": azimuth_factor,
+        "range_factor": range_factor,
+    }
+
+def render_sweep_lod(radar, field, sweep_index, bbox, zoom, fmt):
+    """
+    Renders a sweep for a viewport in the same output formats as the full resolution products.
+
+    Returns:
+        bytes: GeoJSON FeatureCollection or packed binary sweep.
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+
+    if np.ma.count(radar.get_field(sweep_index, field)) == 0:
+        # Fully masked sweeps fall back to the gridded rendering, which is already coarse
+        return render_sweep_polygons(radar, field, sweep_index)
+
+    lod = sweep_lod(radar, field, sweep_index, bbox, zoom)
+
+    if fmt == "binary":
+        ranges = radar.range["data"]
+        spacing = float(ranges[1] - ranges[0])
+        if lod is None:
+            return pack_sweep(radar, field, sweep_index, np.ma.masked_all((0, 0)), [], float(ranges[0]), spacing)
+        nbins = lod["values"].shape[0] - 1
+        azimuths = (np.arange(nbins) + 0.5) * (360.0 / nbins)
+        # Each block sits at the centre of the gates it aggregates
+        range_start = float(ranges[0]) + spacing * (lod["range_factor"] - 1) / 2
+        return pack_sweep(radar, field, sweep_index, lod["values"][:-1, :-1], azimuths, range_start, spacing * lod["range_factor"])
+
+    batches = iter_polygon_features(lod["lat"], lod["lon"], lod["values"], field) if lod else []
+    return b"".join(feature_collection_chunks(batches))
+
+def extract_radar_lod(file_path, field, elevation, bbox, zoom, fmt):
+    """Renders the sweep closest to the requested elevation for a viewport, see render_sweep_lod()."""
+    sweep_index = product_sweep(product_cache.get_volume_meta(file_path), field, elevation)
+    radar, sweep_index = read_sweep(file_path, field, sweep_index)
+    return render_sweep_lod(radar, field, sweep_index, bbox, zoom, fmt)
+
+def render_lod_product(file_path, field, elevation, bbox, zoom, fmt):
+    """
+    Makes sure the render of a (quantized) viewport is in the product cache, rendering it on a miss.
+
+    Returns:
+        str: Path of the cached product.
+    """
+    sweep_index = product_sweep(product_cache.get_volume_meta(file_path), field, elevation)
+    variant = lod_variant(bbox, zoom)
+    path = product_cache.lookup(file_path, field, sweep_index, fmt, variant)
+    if path is None:
+        radar, radar_sweep = read_sweep(file_path, field, sweep_index)
+        product_cache.put(file_path, field, sweep_index, fmt, render_sweep_lod(radar, field, radar_sweep, bbox, zoom, fmt), variant)
+        path = product_cache.path(file_path, field, sweep_index, fmt, variant)
+    return path
+
+def get_lod_product(file_path, field, elevation, bbox, zoom, fmt):
+    """Like render_lod_product(), but returns the product bytes."""
+    with open(render_lod_product(file_path, field, elevation, bbox, zoom, fmt), "rb") as product_file:
+        return product_file.read()
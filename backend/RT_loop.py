@@ -0,0 +1,116 @@
+# This file holds the loop (time animation) products
+# A loop is one keyframe, the packed sweep of the oldest volume on the canonical azimuth bins, followed by one
+# delta per later volume listing only the gates that changed. Frames and deltas live in the product cache under
+# the identity of their volume(s), so when a new scan slides the loop window forward only its frame and its
+# delta from the previous scan are computed
+import struct
+from datetime import timezone
+
+import numpy as np
+
+from RT_data_processing import SWEEP_HEADER, SWEEP_DTYPE_CODES, radar_file_time
+from RT_product_cache import product_cache, get_product
+
+# Loop layout (little endian), every record padded to 4 bytes so the client can view its arrays in place:
+#   header    magic, version, frame count
+#   frames    kind, scan time (unix seconds, f8), payload length, then the payload:
+#               LOOP_KEYFRAME  a packed sweep, see SWEEP_HEADER in RT_data_processing
+#               LOOP_DELTA     changed gate count n, gate indices uint32[n], new codes[n] (the keyframe's dtype),
+#                              new mask packed bits[n]; applies to the frame before it
+LOOP_MAGIC = b"RLOP"
+LOOP_VERSION = 1
+LOOP_HEADER = struct.Struct("<4sHH")
+LOOP_FRAME_HEADER = struct.Struct("<B3xdI")
+LOOP_KEYFRAME = 0
+LOOP_DELTA = 1
+MAX_LOOP_FRAMES = 24
+SWEEP_DTYPES = {code: dtype for dtype, code in SWEEP_DTYPE_CODES.items()}
+
+def unpack_frame(payload):
+    """
+    Reads back the gate arrays of a packed sweep.
+
+    Returns:
+        dict: header fields (rays, gates, dtype, range_start, range_spacing, scale, offset), codes and valid
+        flat arrays.
+    """
+    (_, _, dtype_code, _, rays, gates, _, _, _, range_start, range_spacing, scale, offset, _) = SWEEP_HEADER.unpack_from(payload)
+    dtype = np.dtype(SWEEP_DTYPES[dtype_code]).newbyteorder("<")
+    start = SWEEP_HEADER.size + rays * 4
+    codes = np.frombuffer(payload, dtype=dtype, count=rays * gates, offset=start)
+    bits = np.frombuffer(payload, dtype=np.uint8, offset=start + codes.nbytes)
+    return {
+        "rays": rays, "gates": gates, "dtype": dtype, "range_start": range_start, "range_spacing": range_spacing,
+        "scale": scale, "offset": offset,
+        "codes": codes, "valid": np.unpackbits(bits, count=rays * gates).astype(bool),
+    }
+
+def _frame_record(kind, file_path, payload):
+    padding = -len(payload) % 4
+    header = LOOP_FRAME_HEADER.pack(kind, radar_file_time(file_path).replace(tzinfo=timezone.utc).timestamp(), len(payload))
+    return b"".join([header, payload, b"\0" * padding])
+
+def _same_layout(previous, current):
+    keys = ("rays", "gates", "dtype", "range_start", "range_spacing", "scale", "offset")
+    return all(previous[key] == current[key] for key in keys)
+
+def encode_delta(previous, current):
+    """
+    Encodes the gates of current that differ from previous, code or mask, as a LOOP_DELTA payload.
+
+    Returns:
+        bytes: The payload, or None if the frames do not line up or a keyframe would be smaller.
+    """
+    if not _same_layout(previous, current):
+        return None
+    current_codes = np.where(current["valid"], current["codes"], 0)
+    previous_codes = np.where(previous["valid"], previous["codes"], 0)
+    changed = np.flatnonzero((current_codes != previous_codes) | (current["valid"] != previous["valid"]))
+
+    n = len(changed)
+    if n * (4 + current["dtype"].itemsize + 1 / 8) >= current["codes"].size * (current["dtype"].itemsize + 1 / 8):
+        return None
+    return b"".join([
+        struct.pack("<I", n), changed.astype("<u4").tobytes(), current_codes[changed].astype(current["dtype"]).tobytes(),
+        np.packbits(current["valid"][changed]).tobytes(),
+    ])
+
+def _loop_delta_key(field, tilt):
+    """(field, sweep, format, variant) of the delta between two volumes in the product cache."""
+    return field, "loop", "delta", float(tilt)
+
+def cached_loop_delta(previous_path, file_path, field, tilt):
+    """Returns the already encoded frame record of file_path following previous_path, or None."""
+    return product_cache.get([previous_path, file_path], *_loop_delta_key(field, tilt))
+
+def render_loop_delta(previous_path, file_path, field, tilt):
+    """
+    Encodes the frame record of file_path following previous_path and stores it in the product cache. Falls back
+    to a keyframe when the sweeps do not line up (a new scan strategy) or when most of the gates changed.
+
+    Returns:
+        bytes: The frame record.
+    """
+    payload = get_product(file_path, field, tilt, "frame")
+    delta = encode_delta(unpack_frame(get_product(previous_path, field, tilt, "frame")), unpack_frame(payload))
+    if delta is None:
+        record = _frame_record(LOOP_KEYFRAME, file_path, payload)
+    else:
+        record = _frame_record(LOOP_DELTA, file_path, delta)
+    field, sweep, fmt, variant = _loop_delta_key(field, tilt)
+    product_cache.put([previous_path, file_path], field, sweep, fmt, record, variant)
+    return record
+
+def assemble_loop(file_paths, field, tilt, delta_records):
+    """
+    Builds the loop payload from the keyframe of the oldest volume and the frame records of the later ones.
+
+    Args:
+        file_paths (list): Volumes of the loop, oldest first, whose frames are already in the product cache.
+        delta_records (list): Frame record of every volume after the first, see render_loop_delta().
+
+    Returns:
+        bytes: The loop, see LOOP_HEADER.
+    """
+    keyframe = _frame_record(LOOP_KEYFRAME, file_paths[0], get_product(file_paths[0], field, tilt, "frame"))
+    return b"".join([LOOP_HEADER.pack(LOOP_MAGIC, LOOP_VERSION, len(file_paths)), keyframe, *delta_records])
@@ -0,0 +1,396 @@
+# This file holds the instrumentation of the hot paths: timing spans, the metrics served at /metrics and a
+# sampling profiler that can be switched on for a single request
+# Every request gets an ID (its X-Request-ID header if it is a hex or UUID string, or a new one) held in a
+# context variable, so the spans of the stages it runs (S3 list, download, assemble, decode, grid, polygonize,
+# serialize) are logged as JSON lines under that ID and observed into per-stage latency histograms. run_io
+# threads inherit the context; run_cpu workers get the ID passed along and send their observations and cache
+# counters back with the result (see worker_call), since metrics live in the API process. Metrics are kept in
+# memory and rendered in the Prometheus text format
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextlib
+import contextvars
+from collections import Counter as SampleCounter
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+SPAN_LOG = os.environ.get("SPAN_LOG", "1") != "0"  # Set SPAN_LOG=0 to keep the metrics but drop the span log lines
+PROFILING_ENABLED = os.environ.get("PROFILING", "0") != "0"  # Honor ?profile=1 / X-Profile: 1 on requests
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "../data/profiles")
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+REQUEST_ID = re.compile(r"^[0-9a-f-]{1,64}$")  # Client request IDs accepted as is; they also name profile files
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Frames a thread sits in while it waits for work; samples ending in them are idle threads, not the request's work
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py", os.path.join("concurrent", "futures", "thread.py"))
+
+REGISTRY = {}  # Metric name -> metric, in registration order
+
+# Cache counters every run_cpu worker sends back with its results: {name: stats function} registered in every
+# process, and the latest counters of each worker seen by the API process, {pid: {name: stats}}
+_stats_functions = {}
+_worker_stats = {}
+_worker_stats_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Returns (sample name, labels, value) of every sample."""
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    apply = inc
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # Bucket counts, sum, count
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    apply = observe
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            entries = [(dict(zip(self.labels, key)), list(counts), total, count)
+                       for key, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": bound if bound == "+Inf" else f"{bound:g}"}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+class Collected(Metric):
+    """A metric read at scrape time from collect(), which returns [(labels dict, value)]; for existing counters."""
+
+    def __init__(self, name, help_text, kind, collect):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, labels, value) for labels, value in self.collect()]
+
+def render_metrics():
+    """Renders every registered metric in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in list(REGISTRY.values()):
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            # One broken collector should not take the whole scrape down
+            print(f"Error collecting metric {metric.name}: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{_format_labels(labels)} {float(value):g}" for name, labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+REQUEST_SECONDS = Histogram("radar_request_seconds", "Latency of HTTP requests by route and status", ("route", "status"))
+RESPONSE_BYTES = Counter("radar_response_bytes_total", "Response body bytes sent, after compression, by route", ("route",))
+STAGE_SECONDS = Histogram("radar_stage_seconds", "Latency of the pipeline stages", ("stage",))
+RESPONSE_FEATURES = Histogram("radar_features", "Features per GeoJSON FeatureCollection sent", (), COUNT_BUCKETS)
+INGEST_LAG = Gauge("radar_ingest_lag_seconds", "Time from the start of a radar's newest volume until it was ingested", ("radar",))
+
+def observe_ingest(radar_id, timestamp):
+    """Sets the ingest lag of a radar from the scan timestamp (YYYYMMDDHHMMSS, UTC) of a volume just published."""
+    scan_time = datetime.strptime(timestamp, "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+    INGEST_LAG.set(time.time() - scan_time.timestamp(), radar=radar_id)
+
+def register_process_stats(name, stats_fn):
+    """Registers the counters of a per-process cache, so they are collected from the run_cpu workers too."""
+    _stats_functions[name] = stats_fn
+
+def process_stats(name):
+    """
+    Returns the counters of a registered cache in this process and in every run_cpu worker, as of the last
+    result each worker sent back.
+
+    Returns:
+        list: One stats dict per process, this one first.
+    """
+    with _worker_stats_lock:
+        workers = [stats[name] for stats in _worker_stats.values() if name in stats]
+    return [_stats_functions[name]()] + workers
+
+def forget_worker_stats():
+    """Drops the counters of the run_cpu workers, when the pool they belonged to is gone."""
+    with _worker_stats_lock:
+        _worker_stats.clear()
+
+class RequestContext:
+    """
+    What the spans of a request need: its ID, the profiler when it is profiled, and in a run_cpu worker the
+    observations to send back to the API process (pending).
+    """
+
+    def __init__(self, request_id, sampler=None, pending=None):
+        self.request_id = request_id
+        self.sampler = sampler
+        self.pending = pending
+
+_request = contextvars.ContextVar("radar_request", default=None)
+
+def current_request_id():
+    context = _request.get()
+    return context.request_id if context else None
+
+def log_event(event, **fields):
+    """Prints one structured log line under the current request ID."""
+    if SPAN_LOG:
+        print(json.dumps({"event": event, "request_id": current_request_id(), **fields}, default=str))
+
+def record(metric, value, **labels):
+    """Observes a value into a histogram or counter, or queues it for the API process inside a run_cpu worker."""
+    context = _request.get()
+    if context is not None and context.pending is not None:
+        context.pending.append((metric.name, value, labels))
+    else:
+        metric.apply(value, **labels)
+
+def observe_span(stage, seconds, **attributes):
+    """Records a stage that was timed by hand, for work that a with block cannot wrap (see span())."""
+    record(STAGE_SECONDS, seconds, stage=stage)
+    log_event("span", stage=stage, ms=round(seconds * 1000.0, 2), **attributes)
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """
+    Times a block as one stage. The block may add attributes to the yielded dict (sizes, counts), which go
+    into the log line.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        observe_span(stage, time.perf_counter() - start, **attributes)
+
+class StackSampler:
+    """
+    Sampling profiler: a thread that records the Python stack of the busy threads working for one request every
+    PROFILE_INTERVAL seconds. Threads count as working for it while they are attached (see attached()), so the
+    other requests sharing the process stay out of its profile. Samples are counted per stack in the folded
+    format of flame graph tools.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = SampleCounter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._threads = SampleCounter()  # Thread ident -> attach depth
+        self._threads_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def attached(self):
+        """Samples the calling thread for the duration of the block."""
+        ident = threading.get_ident()
+        with self._threads_lock:
+            self._threads[ident] += 1
+        try:
+            yield self
+        finally:
+            with self._threads_lock:
+                self._threads[ident] -= 1
+                if self._threads[ident] <= 0:
+                    del self._threads[ident]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._threads_lock:
+                threads = set(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in threads or frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+def write_profile(request_id, samples, profile_dir=PROFILE_DIR):
+    """Writes the folded stacks of a profiled request. Returns the path of the profile."""
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f"{request_id}.folded")
+    with open(path, "w") as profile_file:
+        for stack, count in samples.most_common():
+            profile_file.write(f"{stack} {count}\n")
+    return path
+
+def traced(fn, *args, **kwargs):
+    """Runs fn in this thread for the current request, sampling the thread if the request is profiled."""
+    context = _request.get()
+    if context is None or context.sampler is None:
+        return fn(*args, **kwargs)
+    with context.sampler.attached():
+        return fn(*args, **kwargs)
+
+def traced_call(request_id, profile, fn, *args, **kwargs):
+    """
+    Runs fn in a run_cpu worker under the caller's request ID, collecting its observations (and stack samples
+    if the request is profiled) instead of recording them in the worker.
+
+    Returns:
+        tuple: (result of fn, pending observations, stack samples or None, (pid, cache counters)), see
+        merge_worker_result().
+    """
+    context = RequestContext(request_id, StackSampler().start() if profile else None, pending=[])
+    token = _request.set(context)
+    try:
+        result = traced(fn, *args, **kwargs)
+    finally:
+        _request.reset(token)
+        samples = context.sampler.stop() if context.sampler else None
+    stats = {name: stats_fn() for name, stats_fn in _stats_functions.items()}
+    return result, context.pending, samples, (os.getpid(), stats)
+
+def worker_call(fn, *args, **kwargs):
+    """Wraps a call for the run_cpu process pool so it runs under the current request (see traced_call)."""
+    context = _request.get()
+    request_id = context.request_id if context else None
+    return traced_call, (request_id, bool(context and context.sampler), fn) + args, kwargs
+
+def merge_worker_result(value):
+    """Records the observations and counters a worker sent back with its result and returns the result itself."""
+    result, pending, samples, (pid, stats) = value
+    for name, observed, labels in pending:
+        REGISTRY[name].apply(observed, **labels)
+    with _worker_stats_lock:
+        _worker_stats[pid] = stats
+    context = _request.get()
+    if samples and context is not None and context.sampler is not None:
+        context.sampler.samples.update(samples)
+    return result
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def _wants_profile(scope):
+    if not PROFILING_ENABLED:
+        return False
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return _header(scope, b"x-profile") in ("1", "true") or query.get("profile", [""])[0] in ("1", "true")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware giving every HTTP request an ID (echoed in X-Request-ID), timing it into REQUEST_SECONDS by
+    route template, counting the bytes it sends and, when asked for (see _wants_profile), profiling it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _header(scope, b"x-request-id")
+        if request_id is None or not REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        context = RequestContext(request_id, StackSampler().start() if _wants_profile(scope) else None)
+        token = _request.set(context)
+        start = time.perf_counter()
+        status, sent = 500, 0
+
+        async def send_counted(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+                if context.sampler is not None:
+                    headers.append((b"x-profile", f"{request_id}.folded".encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            seconds = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", "unmatched")  # The template, not the path, to bound the labels
+            REQUEST_SECONDS.observe(seconds, route=route, status=status)
+            RESPONSE_BYTES.inc(sent, route=route)
+            fields = {"route": route, "path": scope["path"], "status": status, "ms": round(seconds * 1000.0, 2), "bytes": sent}
+            if context.sampler is not None:
+                fields["profile"] = write_profile(request_id, context.sampler.stop())
+            log_event("request", **fields)
+            _request.reset(token)
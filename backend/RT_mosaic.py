@@ -0,0 +1,204 @@
+# This file holds the multi-radar mosaic products
+# Every site is sampled onto one common lat/lon grid in its own worker process (the grid cell centres are turned
+# into azimuth / ground range from the site and looked up in the canonical sweeps), and the per-site grids are
+# merged by max or by the nearest radar
+import os
+import json
+import math
+
+import numpy as np
+import pyart
+
+from RT_volume_cache import read_radar
+from RT_data_processing import cmaps, select_sweep, iter_polygon_features, feature_collection_chunks
+from RT_gridding import canonical_sweep
+from RT_product_cache import product_cache
+
+RADAR_SITES_FILE = os.environ.get("RADAR_SITES_FILE", os.path.join(os.path.dirname(__file__), "../frontend/public/radar_sites.json"))
+MOSAIC_RESOLUTION = 0.02  # Default grid spacing (degrees)
+MAX_MOSAIC_CELLS = 1000000  # The spacing is coarsened until the grid fits
+MAX_MOSAIC_RADARS = 12
+SITE_REACH = 460000.0  # Meters around a site a volume can cover; the real maximum range is used once decoded
+EFFECTIVE_RADIUS = 6371000.0 * 4.0 / 3.0  # 4/3 earth beam propagation model, as pyart
+MERGE_METHODS = ("max", "nearest")
+
+def load_radar_sites(sites_file=RADAR_SITES_FILE):
+    """Returns {radar ID: {name, state, lat, lon}} from the frontend's site list."""
+    with open(sites_file) as f:
+        return json.load(f)
+
+def _reach_degrees(lat, reach=SITE_REACH):
+    """Latitude and longitude extent (degrees) of a distance around a point."""
+    reach_lat = reach / 111195.0
+    return reach_lat, reach_lat / max(math.cos(math.radians(lat)), 0.01)
+
+def resolve_mosaic_radars(radar_ids=None, bbox=None, sites=None):
+    """
+    Returns the radar IDs of a mosaic: the requested ones, or every site whose coverage reaches the
+    (west, south, east, north) bounding box, nearest to its centre first.
+    """
+    sites = sites if sites is not None else load_radar_sites()
+    if radar_ids:
+        unknown = [radar_id for radar_id in radar_ids if radar_id not in sites]
+        if unknown:
+            raise ValueError(f"Unknown radar IDs {unknown}")
+        selected = list(dict.fromkeys(radar_ids))
+    else:
+        west, south, east, north = bbox
+        selected = []
+        for radar_id, site in sites.items():
+            reach_lat, reach_lon = _reach_degrees(site["lat"])
+            if west - reach_lon <= site["lon"] <= east + reach_lon and south - reach_lat <= site["lat"] <= north + reach_lat:
+                selected.append(radar_id)
+        center_lon, center_lat = (west + east) / 2, (south + north) / 2
+        selected.sort(key=lambda radar_id: (sites[radar_id]["lon"] - center_lon) ** 2 + (sites[radar_id]["lat"] - center_lat) ** 2)
+
+    if len(selected) > MAX_MOSAIC_RADARS:
+        raise ValueError(f"A mosaic takes at most {MAX_MOSAIC_RADARS} radars, {len(selected)} were selected")
+    return selected
+
+def mosaic_grid(radar_ids, bbox=None, resolution=MOSAIC_RESOLUTION, sites=None):
+    """
+    Defines the common grid of a mosaic: the bounding box if given, otherwise the coverage of the radars.
+
+    Returns:
+        dict: west, south (degrees of the grid's outer corner), resolution (degrees) and nx, ny cell counts.
+    """
+    if bbox is None:
+        sites = sites if sites is not None else load_radar_sites()
+        extents = []
+        for radar_id in radar_ids:
+            site = sites[radar_id]
+            reach_lat, reach_lon = _reach_degrees(site["lat"])
+            extents.append((site["lon"] - reach_lon, site["lat"] - reach_lat, site["lon"] + reach_lon, site["lat"] + reach_lat))
+        bbox = (min(e[0] for e in extents), min(e[1] for e in extents), max(e[2] for e in extents), max(e[3] for e in extents))
+
+    west, south, east, north = bbox
+    while math.ceil((east - west) / resolution) * math.ceil((north - south) / resolution) > MAX_MOSAIC_CELLS:
+        resolution *= 2
+    return {
+        "west": round(west, 6), "south": round(south, 6), "resolution": resolution,
+        "nx": math.ceil((east - west) / resolution), "ny": math.ceil((north - south) / resolution),
+    }
+
+def site_mosaic_grid(file_path, field, tilt, grid):
+    """
+    Samples one volume onto the part of a mosaic grid it covers. Runs in a worker process, one site each.
+
+    Args:
+        file_path (str): Latest volume of the site.
+        field (str): Radar field name.
+        tilt (float): Elevation angle, or None for the composite (maximum over every elevation).
+        grid (dict): Mosaic grid, see mosaic_grid().
+
+    Returns:
+        tuple: (row offset, column offset, values float32 window with NaN where the site has no data,
+        ground distance float32 window from the site), or None if the site does not reach the grid.
+    """
+    radar = read_radar(file_path)
+    if field not in radar.fields:
+        return None
+    lat0 = float(radar.latitude["data"][0])
+    lon0 = float(radar.longitude["data"][0])
+    ranges = radar.range["data"]
+    range_start, range_step = float(ranges[0]), float(ranges[1] - ranges[0])
+
+    # Window of the grid within reach of the site
+    res = grid["resolution"]
+    reach_lat, reach_lon = _reach_degrees(lat0, float(ranges[-1]))
+    row0 = max(0, int((lat0 - reach_lat - grid["south"]) / res))
+    row1 = min(grid["ny"], int(math.ceil((lat0 + reach_lat - grid["south"]) / res)))
+    col0 = max(0, int((lon0 - reach_lon - grid["west"]) / res))
+    col1 = min(grid["nx"], int(math.ceil((lon0 + reach_lon - grid["west"]) / res)))
+    if row0 >= row1 or col0 >= col1:
+        return None
+
+    lats = grid["south"] + res * (np.arange(row0, row1) + 0.5)
+    lons = grid["west"] + res * (np.arange(col0, col1) + 0.5)
+    lon_cells, lat_cells = np.meshgrid(lons, lats)
+    x, y = pyart.core.geographic_to_cartesian_aeqd(lon_cells, lat_cells, lon0, lat0)
+    ground = np.hypot(x, y)
+    azimuth = np.degrees(np.arctan2(x, y)) % 360.0
+    theta = ground / EFFECTIVE_RADIUS
+
+    # The composite takes every sweep: split cuts keep reflectivity and velocity in different sweeps of one angle
+    sweeps = [select_sweep(radar, tilt)] if tilt is not None else range(radar.nsweeps)
+    values = np.full(ground.shape, np.nan, dtype=np.float32)
+    for sweep_index in sweeps:
+        sweep_values, sweep_valid = canonical_sweep(radar, field, sweep_index)
+        nbins, ngates = sweep_values.shape
+        elevation = math.radians(float(np.median(radar.get_elevation(sweep_index))))
+        # Slant range of the gate above each cell: law of sines in the site / earth centre / gate triangle
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slant = EFFECTIVE_RADIUS * np.sin(theta) / np.cos(elevation + theta)
+        gate = np.rint((slant - range_start) / range_step)
+        inside = (gate >= 0) & (gate < ngates)
+        gate = np.where(inside, gate, 0).astype(np.intp)
+        ray = (azimuth / (360.0 / nbins)).astype(np.intp) % nbins
+        hit = inside & sweep_valid[ray, gate]
+        values = np.fmax(values, np.where(hit, sweep_values[ray, gate], np.nan))
+
+    if np.isnan(values).all():
+        return None
+    return row0, col0, values, ground.astype(np.float32)
+
+def merge_site_grids(grid, site_grids, method):
+    """
+    Merges the per-site windows of site_mosaic_grid() into the full mosaic.
+
+    Args:
+        method (str): "max" keeps the largest value of every cell, "nearest" the value of the closest radar.
+
+    Returns:
+        ndarray: float32[ny, nx], NaN where no radar has data.
+    """
+    mosaic = np.full((grid["ny"], grid["nx"]), np.nan, dtype=np.float32)
+    nearest = np.full(mosaic.shape, np.inf, dtype=np.float32)
+    for row0, col0, values, distance in filter(None, site_grids):
+        window = (slice(row0, row0 + values.shape[0]), slice(col0, col0 + values.shape[1]))
+        if method == "max":
+            mosaic[window] = np.fmax(mosaic[window], values)
+        else:
+            closer = ~np.isnan(values) & (distance < nearest[window])
+            mosaic[window][closer] = values[closer]
+            nearest[window][closer] = distance[closer]
+    return mosaic
+
+def mosaic_chunks(grid, mosaic, field):
+    """
+    Encodes a mosaic as a GeoJSON FeatureCollection of grid cells, carrying quantized codes like the sweep
+    products (see color_table in RT_data_processing).
+
+    Returns:
+        generator: bytes chunks of the serialized FeatureCollection.
+    """
+    res = grid["resolution"]
+    lon_corners, lat_corners = np.meshgrid(grid["west"] + res * np.arange(grid["nx"] + 1),
+                                           grid["south"] + res * np.arange(grid["ny"] + 1))
+    values = np.ma.masked_invalid(np.pad(mosaic, ((0, 1), (0, 1)), constant_values=np.nan))
+    return feature_collection_chunks(iter_polygon_features(lat_corners, lon_corners, values, field))
+
+def default_merge_method(field):
+    """Fields aggregated by max (like reflectivity) merge by max; the others take the nearest radar."""
+    return "max" if cmaps.get(field, {}).get("reduce", "max") == "max" else "nearest"
+
+def _mosaic_cache_key(field, tilt, method, grid):
+    """(field, sweep, format, variant) of a mosaic in the product cache, whose files are the input volumes."""
+    return field, "composite" if tilt is None else tilt, "geojson", f"{method}|{json.dumps(grid, sort_keys=True)}"
+
+def cached_mosaic_path(file_paths, field, tilt, method, grid):
+    """Returns the path of an already rendered mosaic of these exact volumes, or None."""
+    return product_cache.lookup(file_paths, *_mosaic_cache_key(field, tilt, method, grid))
+
+def store_mosaic(file_paths, field, tilt, method, grid, site_grids):
+    """
+    Merges the per-site grids of a mosaic and writes it to the product cache. The cache key includes the
+    identity of every input volume, so a new scan of any site gives a new mosaic.
+
+    Returns:
+        str: Path of the cached mosaic.
+    """
+    mosaic = merge_site_grids(grid, site_grids, method)
+    key = _mosaic_cache_key(field, tilt, method, grid)
+    product_cache.put(file_paths, *key[:3], mosaic_chunks(grid, mosaic, field), key[3])
+    return product_cache.path(file_paths, *key)
@@ -0,0 +1,406 @@
+# This file holds the on-disk cache of rendered radar products
+# Products are rendered for every (field, elevation) of a volume right after it is assembled, so the product
+# endpoints serve precomputed bytes instead of decoding and polygonizing on the first HTTP hit
+import io
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from RT_level2 import index_volume
+from RT_executors import cpu_pool
+from RT_metrics import register_process_stats
+from RT_volume_cache import read_radar, read_radar_sweep, MOMENT_FIELDS
+from RT_derived import DERIVED_FIELDS, DERIVED_SOURCE, derive_fields, derived_sweep_radar
+from RT_data_processing import cmaps, unique_elevation_sweeps, elevation_sweeps, stream_sweep_polygons, render_sweep_binary, render_sweep_frame
+
+PRODUCT_CACHE_DIR = os.environ.get("PRODUCT_CACHE_DIR", "../data/products")
+PRODUCT_CACHE_MAX_BYTES = int(os.environ.get("PRODUCT_CACHE_MAX_BYTES", 20 * 1024**3))  # ~20 GB of products
+PRODUCT_VERSION = 2  # Part of every cache key; bump it whenever the layout of a rendered product changes
+DERIVED_SWEEP = "volume"  # Sweep key of the derived products (see RT_derived), which take every sweep of a volume
+
+# Output formats rendered at ingest, and the function producing each one from (radar, field, sweep_index),
+# as bytes or as an iterable of bytes chunks that is written to the cache as it is produced
+PRODUCT_RENDERERS = {
+    "geojson": stream_sweep_polygons,
+    "binary": render_sweep_binary,
+    "frame": render_sweep_frame,
+}
+
+class ProductCache:
+    """
+    Content-addressed store of rendered products, evicted by total size.
+
+    Entries are keyed by a hash of (file identity, field, sweep index, output format) plus an optional variant
+    for products with several parts, like the tiles of a sweep. The file identity includes its size and mtime,
+    so products of a re-assembled volume never collide with stale ones. Products made from several volumes,
+    like mosaics, pass a list of files and are keyed by the identity of every one of them.
+    """
+
+    def __init__(self, cache_dir=PRODUCT_CACHE_DIR, max_bytes=PRODUCT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None  # Computed on first write
+        self._lock = threading.Lock()
+
+    def path(self, file_path, field, sweep_index, fmt, variant=None):
+        """Returns where a product is (or would be) stored."""
+        sources = []
+        for path in [file_path] if isinstance(file_path, str) else sorted(file_path):
+            stat = os.stat(path)
+            sources.append(f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}")
+        identity = f"{PRODUCT_VERSION}|{'|'.join(sources)}|{field}|{sweep_index}|{fmt}"
+        if variant is not None:
+            identity += f"|{variant}"
+        digest = hashlib.sha256(identity.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.{fmt}")
+
+    def get(self, file_path, field, sweep_index, fmt, variant=None):
+        """
+        Returns the cached product bytes, or None on a miss.
+        """
+        path = self.lookup(file_path, field, sweep_index, fmt, variant)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as product_file:
+                return product_file.read()
+        except FileNotFoundError:  # Evicted in the meantime
+            return None
+
+    def lookup(self, file_path, field, sweep_index, fmt, variant=None):
+        """
+        Returns the path of a cached product, so large products can be streamed from disk instead of read whole.
+
+        Returns:
+            str: Path of the product file, or None on a miss.
+        """
+        path = self.path(file_path, field, sweep_index, fmt, variant)
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, file_path, field, sweep_index, fmt, data, variant=None):
+        """
+        Writes a product atomically and evicts the least recently used products if over budget.
+
+        Args:
+            data (bytes or iterable): The product, or an iterable of chunks written as they are produced.
+
+        Returns:
+            int: Size of the product in bytes.
+        """
+        path = self.path(file_path, field, sweep_index, fmt, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            with open(tmp_path, "wb") as product_file:
+                for chunk in [data] if isinstance(data, bytes) else data:
+                    product_file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return size
+
+    def _entries(self):
+        """Lists (mtime, path, size) for every stored product."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """Deletes the least recently used products until the cache is back under 90% of its budget."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+        print(f"Product cache evicted down to {total / 1024**2:.1f} MB")
+
+    def get_volume_index(self, file_path):
+        """Returns the cached cut index of a volume (see index_volume in RT_level2), building it on a miss."""
+        data = self.get(file_path, "_index", -1, "json")
+        if data is not None:
+            return json.loads(data)
+        with open(file_path, "rb") as volume_file:
+            index = index_volume(volume_file.read())
+        self.put(file_path, "_index", -1, "json", json.dumps(index).encode("utf-8"))
+        return index
+
+    def get_volume_meta(self, file_path):
+        """
+        Returns the cached {fixed_angles, fields, sweeps, vcp} summary of a volume. On a miss it is read from the
+        cut index, or decoded if the volume has no VCP message to take the fixed angles from.
+        """
+        data = self.get(file_path, "_volume", -1, "json")
+        if data is not None:
+            return json.loads(data)
+        index = self.get_volume_index(file_path)
+        nsweeps = max(map(int, index["cuts"]), default=0)
+        if index["cut_angles"] and nsweeps <= len(index["cut_angles"]):
+            # Same values as Py-ART: fixed angles from message 5, fields from the moments of any cut
+            fixed_angles = np.array(index["cut_angles"][:nsweeps], dtype="float32")
+            moments = {moment[0] for cut in index["cuts"].values() for moment in cut["moments"]}
+            fields = [field for moment, field in MOMENT_FIELDS.items() if moment in moments]
+            sweeps = elevation_sweeps(fixed_angles)
+            vcp = index["vcp"]
+        else:
+            radar = read_radar(file_path)
+            fixed_angles = radar.fixed_angle["data"]
+            fields = list(radar.fields.keys())
+            sweeps = unique_elevation_sweeps(radar)
+            vcp = radar.metadata.get("vcp_pattern")
+        meta = {
+            "fixed_angles": [float(angle) for angle in fixed_angles],
+            "fields": fields,
+            "sweeps": {str(elevation): index for elevation, index in sweeps.items()},
+            "vcp": int(vcp) if vcp is not None else None,
+        }
+        self.put(file_path, "_volume", -1, "json", json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def get_derived_fields(self, file_path):
+        """Returns the cached derived fields of a volume (see derive_fields in RT_derived), computing them on a miss."""
+        data = self.get(file_path, "_derived", -1, "npz")
+        if data is not None:
+            with np.load(io.BytesIO(data)) as arrays:
+                return dict(arrays)
+        fields = derive_fields(read_radar(file_path))
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **fields)
+        self.put(file_path, "_derived", -1, "npz", buffer.getvalue())
+        return fields
+
+    def resync(self):
+        """Forgets the size total, so it is recomputed from disk after other processes wrote into the cache."""
+        with self._lock:
+            self._total_bytes = None
+
+    def counters(self):
+        """Returns the hit/miss counters of this process, without the size total stats() may scan the disk for."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def stats(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared cache used by the product endpoints and the ingest stage
+product_cache = ProductCache()
+register_process_stats("product", product_cache.counters)
+
+def get_product(file_path, field, elevation, fmt):
+    """
+    Serves a product from the cache, rendering and storing it on a miss.
+
+    Args:
+        file_path (str): Path to the assembled Level II file.
+        field (str): Radar field name.
+        elevation (float): Requested elevation angle.
+        fmt (str): Output format, one of PRODUCT_RENDERERS.
+
+    Returns:
+        bytes: The rendered product.
+    """
+    with open(render_product(file_path, field, elevation, fmt), "rb") as product_file:
+        return product_file.read()
+
+def render_product(file_path, field, elevation, fmt):
+    """
+    Makes sure a product is in the cache, rendering and storing it on a miss, without loading it.
+
+    Returns:
+        str: Path of the cached product, to be opened by the process serving it.
+    """
+    sweep_index = product_sweep(product_cache.get_volume_meta(file_path), field, elevation)
+    path = product_cache.lookup(file_path, field, sweep_index, fmt)
+    if path is None:
+        radar, radar_sweep = read_sweep(file_path, field, sweep_index)
+        product_cache.put(file_path, field, sweep_index, fmt, PRODUCT_RENDERERS[fmt](radar, field, radar_sweep))
+        path = product_cache.path(file_path, field, sweep_index, fmt)
+    return path
+
+def read_sweep(file_path, field, sweep_index):
+    """
+    Reads one sweep of a field for a product, decoding only its cut and moment when possible. DERIVED_SWEEP
+    reads the pseudo sweep of the derived fields.
+
+    Returns:
+        tuple: (radar, index of the sweep in it), see read_radar_sweep in RT_volume_cache.
+    """
+    if sweep_index == DERIVED_SWEEP:
+        return derived_radar(file_path), 0
+    return read_radar_sweep(file_path, field, sweep_index, product_cache.get_volume_index(file_path))
+
+def derived_radar(file_path):
+    """Returns the single sweep radar holding the derived fields of a volume, see derived_sweep_radar in RT_derived."""
+    fields = product_cache.get_derived_fields(file_path)
+    radar, radar_sweep = read_radar_sweep(file_path, DERIVED_SOURCE, int(fields["sweep"]), product_cache.get_volume_index(file_path))
+    return derived_sweep_radar(radar, radar_sweep, fields)
+
+def get_cached_product(file_path, field, elevation, fmt, variant=None):
+    """
+    Serves a product (or one variant of it) only if it is already cached, without decoding the volume.
+
+    Returns:
+        bytes: The rendered product, or None if it (or the volume summary) still has to be rendered.
+    """
+    meta = product_cache.get(file_path, "_volume", -1, "json")
+    if meta is None:
+        return None
+    try:
+        sweep_index = product_sweep(json.loads(meta), field, elevation)
+    except ValueError:
+        return None
+    return product_cache.get(file_path, field, sweep_index, fmt, variant)
+
+def cached_product_path(file_path, field, elevation, fmt, variant=None):
+    """
+    Like get_cached_product(), but returns the path of the cached product instead of its bytes.
+
+    Returns:
+        str: Path of the product file, or None if it still has to be rendered.
+    """
+    meta = product_cache.get(file_path, "_volume", -1, "json")
+    if meta is None:
+        return None
+    try:
+        sweep_index = product_sweep(json.loads(meta), field, elevation)
+    except ValueError:
+        return None
+    return product_cache.lookup(file_path, field, sweep_index, fmt, variant)
+
+def nearest_sweep(meta, elevation):
+    return min(range(len(meta["fixed_angles"])), key=lambda i: abs(meta["fixed_angles"][i] - elevation))
+
+def product_sweep(meta, field, elevation):
+    """
+    Returns the sweep a product is rendered from: the one nearest to the elevation, or DERIVED_SWEEP for the
+    derived fields, which ignore it.
+
+    Raises:
+        ValueError: If the volume lacks the field (or the source field of a derived one).
+    """
+    if field in DERIVED_FIELDS:
+        if DERIVED_SOURCE not in meta["fields"]:
+            raise ValueError(f"Field '{field}' needs {DERIVED_SOURCE}, which the radar data lacks")
+        return DERIVED_SWEEP
+    if field not in meta["fields"]:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {meta['fields']}")
+    return nearest_sweep(meta, elevation)
+
+def _render_and_store(file_path, field, sweep_index, formats):
+    """
+    Worker task: renders every format of one (field, sweep) and stores it, decoding only that cut and moment
+    (see read_sweep). Returns the bytes written.
+    """
+    written = 0
+    radar = None
+    for fmt in formats:
+        if product_cache.lookup(file_path, field, sweep_index, fmt) is not None:
+            continue
+        if radar is None:
+            radar, radar_sweep = read_sweep(file_path, field, sweep_index)
+        written += product_cache.put(file_path, field, sweep_index, fmt, PRODUCT_RENDERERS[fmt](radar, field, radar_sweep))
+    return written
+
+def _render_derived_and_store(file_path, formats):
+    """Worker task: computes the derived fields of a volume and renders every format of each one."""
+    written = 0
+    radar = derived_radar(file_path)
+    for field in DERIVED_FIELDS:
+        for fmt in formats:
+            if product_cache.lookup(file_path, field, DERIVED_SWEEP, fmt) is not None:
+                continue
+            written += product_cache.put(file_path, field, DERIVED_SWEEP, fmt, PRODUCT_RENDERERS[fmt](radar, field, 0))
+    return written
+
+def precompute_products(file_path, formats=tuple(PRODUCT_RENDERERS)):
+    """
+    Renders every field in the cmaps table at every unique elevation of a volume into the product cache, and
+    the derived fields once for the volume. The renders run on the shared process pool (see cpu_pool in
+    RT_executors), each worker decoding what it needs from the published file.
+
+    Args:
+        file_path (str): Path to the freshly assembled Level II file.
+        formats (tuple): Output formats to render.
+
+    Returns:
+        int: Number of bytes written to the cache.
+    """
+    meta = product_cache.get_volume_meta(file_path)
+    fields = [field for field in cmaps if field in meta["fields"]]
+    tasks = [(field, sweep_index) for field in fields for sweep_index in sorted(set(meta["sweeps"].values()))]
+    print(f"Precomputing {len(tasks) * len(formats)} products for {file_path}")
+
+    written = 0
+    pool = cpu_pool()
+    futures = [pool.submit(_render_and_store, file_path, field, sweep_index, formats) for field, sweep_index in tasks]
+    if DERIVED_SOURCE in meta["fields"]:
+        tasks.append(("derived fields", DERIVED_SWEEP))
+        futures.append(pool.submit(_render_derived_and_store, file_path, formats))
+    for (field, sweep_index), future in zip(tasks, futures):
+        try:
+            written += future.result()
+        except Exception as e:
+            print(f"Error precomputing {field} sweep {sweep_index} for {file_path}: {e}")
+
+    # The workers wrote into the same directory, so resynchronize the size accounting
+    product_cache.resync()
+    print(f"Precomputed products for {file_path}: {written / 1024**2:.1f} MB")
+    return written
+
+# Ingest runs one volume at a time in the background; each volume fans out over the shared process pool
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="product-ingest")
+
+def schedule_precompute(file_path):
+    """Queues a freshly assembled volume for product precomputation without blocking the caller."""
+    return _ingest_executor.submit(precompute_products, file_path)
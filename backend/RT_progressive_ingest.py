@@ -0,0 +1,285 @@
+# This file holds the progressive ingest of a volume that is still being scanned
+# Chunks are pulled from the chunk bucket (or a local directory laid out like it) as they appear, and every
+# elevation cut is published to the product endpoints as a partial volume as soon as its last radial lands
+import os
+import re
+import threading
+import time
+
+from RT_data_query import s3, scan_index, ScanListingIndex, BUCKET_NAME, WAIT_INTERVAL, parse_chunk_key, tmp_path
+from RT_level2 import split_records, has_volume_header, decompress_record, record_radials, parse_vcp, VOLUME_HEADER_SIZE, END_OF_ELEVATION, END_OF_VOLUME
+from RT_catalog import register_volume, ingest_lock
+from RT_metrics import observe_ingest
+
+MAX_IDLE_TIME = 600  # Give up on a volume if no new chunk shows up for this many seconds
+PARTIAL_TILT_TOLERANCE = 0.05  # Degrees; the dropdowns round elevations to two decimals
+CHUNK_NAME = re.compile(r"^\d{8}-\d{6}-\d{3}-[SIE]$")  # Name of a chunk object, e.g. 20250129-150000-001-S
+
+# Latest partial volume of every radar being ingested:
+# {radar_id: {file, timestamp, volume, completed_sweeps, elevations, fixed_angles}}
+partial_volumes = {}
+_active_ingests = {}
+_lock = threading.Lock()
+
+class S3ChunkSource:
+    """Reads chunks from the real-time chunk bucket."""
+
+    def __init__(self, client=None, bucket=BUCKET_NAME):
+        self.client = client
+        self.bucket = bucket
+        self.index = scan_index if client is None and bucket == BUCKET_NAME else ScanListingIndex(client, bucket)
+
+    def _s3(self):
+        return self.client or s3
+
+    def _list(self, prefix):
+        paginator = self._s3().get_paginator('list_objects_v2')
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend(page.get('Contents', []))
+        return objects
+
+    def latest_volume(self, radar_id):
+        """Returns the volume number of the newest chunk of a radar, or None."""
+        return self.index.latest_volume(radar_id)
+
+    def list_volume(self, radar_id, volume):
+        """Lists the chunk objects of one volume."""
+        return [obj for obj in self._list(f"{radar_id}/{volume}/") if parse_chunk_key(obj['Key'])]
+
+    def fetch(self, key):
+        return self._s3().get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+class LocalChunkSource:
+    """
+    Reads chunks from a local directory laid out like the bucket: {root}/{radar_id}/{volume}/{chunk name}.
+
+    Chunks should be moved into place atomically (write then rename) by whatever drips them in.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def latest_volume(self, radar_id):
+        newest = None
+        radar_dir = os.path.join(self.root, radar_id)
+        if not os.path.isdir(radar_dir):
+            return None
+        for volume in os.listdir(radar_dir):
+            for obj in self.list_volume(radar_id, volume):
+                parts = parse_chunk_key(obj['Key'])
+                if newest is None or parts[2:4] > newest[2:4]:
+                    newest = parts
+        return newest[1] if newest else None
+
+    def list_volume(self, radar_id, volume):
+        volume_dir = os.path.join(self.root, radar_id, str(volume))
+        if not os.path.isdir(volume_dir):
+            return []
+        objects = []
+        for name in sorted(os.listdir(volume_dir)):
+            if not CHUNK_NAME.match(name):  # e.g. the .tmp file of a chunk still being written
+                continue
+            try:
+                size = os.path.getsize(os.path.join(volume_dir, name))
+            except OSError:  # Renamed or removed since the listing
+                continue
+            objects.append({'Key': f"{radar_id}/{volume}/{name}", 'Size': size})
+        return objects
+
+    def fetch(self, key):
+        with open(os.path.join(self.root, key), "rb") as chunk_file:
+            return chunk_file.read()
+
+class ProgressiveVolume:
+    """
+    Tracks the chunks of one volume and which elevation cuts they complete.
+
+    Chunks may arrive in any order; only the contiguous run starting at chunk 1 is decoded and published.
+    """
+
+    def __init__(self, radar_id, volume, timestamp):
+        self.radar_id = radar_id
+        self.volume = volume
+        self.timestamp = timestamp
+        self.chunks = {}  # sequence number -> (chunk type, bytes)
+        self.contiguous = 0  # Highest sequence number n such that chunks 1..n are all present
+        self.cut_order = []  # Elevation numbers in the order they were scanned
+        self.finished_cuts = set()
+        self.cut_angles = None  # Elevation angle of every cut of the VCP (message 5), once seen
+        self.first_elevations = {}  # Elevation number -> measured elevation of its first radial
+        self.finished = False
+
+    def add_chunk(self, seq, chunk_type, data):
+        """Stores a chunk and parses every chunk that became contiguous. Returns True if a new cut completed."""
+        self.chunks[seq] = (chunk_type, data)
+        completed_before = self.completed_cuts
+        while self.contiguous + 1 in self.chunks:
+            self.contiguous += 1
+            chunk_type, data = self.chunks[self.contiguous]
+            self._parse_chunk(data)
+            if chunk_type == "E":
+                self.finished = True
+        return self.completed_cuts > completed_before
+
+    def _parse_chunk(self, data):
+        offset = VOLUME_HEADER_SIZE if has_volume_header(data) else 0
+        for record_offset, size in split_records(data, offset):
+            record = decompress_record(data, record_offset, size)
+            if offset and self.cut_angles is None:  # The metadata messages are in the first (S) chunk
+                self.cut_angles = parse_vcp(record)[1]
+            for radial in record_radials(record):
+                elevation_number = radial["elevation_number"]
+                if elevation_number not in self.cut_order:
+                    self.cut_order.append(elevation_number)
+                    self.first_elevations[elevation_number] = radial["elevation_angle"]
+                if radial["radial_status"] in (END_OF_ELEVATION, END_OF_VOLUME):
+                    self.finished_cuts.add(elevation_number)
+
+    @property
+    def completed_cuts(self):
+        """Number of leading elevation cuts whose last radial has arrived (= sweeps safe to publish)."""
+        count = 0
+        for elevation_number in self.cut_order:
+            if elevation_number not in self.finished_cuts:
+                break
+            count += 1
+        return count
+
+    def fixed_angles(self):
+        """
+        Fixed angle of every sweep seen so far, like Py-ART reads them: the VCP angle of the sweep's cut, or the
+        elevation of its first radial without a VCP message.
+        """
+        return [self.cut_angles[number - 1] if self.cut_angles and number <= len(self.cut_angles)
+                else self.first_elevations[number] for number in self.cut_order]
+
+    def assembled(self):
+        """Returns the contiguous chunks concatenated into a (possibly partial) Level II volume."""
+        return b"".join(self.chunks[seq][1] for seq in range(1, self.contiguous + 1))
+
+def _write_atomic(path, data):
+    tmp_file = tmp_path(path)
+    with open(tmp_file, "wb") as out_file:
+        out_file.write(data)
+    os.replace(tmp_file, path)
+
+def _volume_filename(radar_id, timestamp, partial=False):
+    suffix = ".partial.bin" if partial else ".bin"
+    return f"{radar_id}_{timestamp[0:8]}-{timestamp[8:]}{suffix}"
+
+def publish_partial(progress, data_dir="../data"):
+    """Writes the completed cuts of a volume to a partial file and registers it for the product endpoints."""
+    path = os.path.join(data_dir, _volume_filename(progress.radar_id, progress.timestamp, partial=True))
+    _write_atomic(path, progress.assembled())
+    completed = progress.completed_cuts
+    fixed_angles = [float(angle) for angle in progress.fixed_angles()]
+    elevations = [float("%.02f"%(angle)) for angle in fixed_angles[:completed]]
+    with _lock:
+        partial_volumes[progress.radar_id] = {
+            "file": path,
+            "timestamp": progress.timestamp,
+            "volume": progress.volume,
+            "completed_sweeps": completed,
+            "elevations": elevations,
+            "fixed_angles": fixed_angles,
+        }
+    print(f"Published partial volume {os.path.basename(path)} with {completed} complete sweeps")
+    return path
+
+def _retire_partial(radar_id):
+    with _lock:
+        entry = partial_volumes.pop(radar_id, None)
+    if entry and os.path.exists(entry["file"]):
+        os.remove(entry["file"])
+
+def ingest_volume_progressively(radar_id, source=None, volume=None, data_dir="../data",
+                                poll_interval=WAIT_INTERVAL, max_idle=MAX_IDLE_TIME):
+    """
+    Follows one volume in the chunk source until its E chunk arrives, publishing every completed cut.
+
+    Args:
+        radar_id (str): The radar station ID (e.g., KTLX).
+        source: Chunk source (S3ChunkSource or LocalChunkSource). Defaults to the chunk bucket.
+        volume (int): Volume number to follow. Defaults to the newest volume in the source.
+        data_dir (str): Directory where radar files are stored.
+        poll_interval (float): Seconds between listings of the volume.
+        max_idle (float): Seconds without a new chunk before giving up.
+
+    Returns:
+        str: Path to the complete assembled volume, or None if it never completed.
+    """
+    source = source or S3ChunkSource()
+    volume = volume if volume is not None else source.latest_volume(radar_id)
+    if volume is None:
+        print(f"No chunks found for {radar_id}")
+        return None
+
+    os.makedirs(data_dir, exist_ok=True)
+    progress = None
+    last_chunk_time = time.monotonic()
+
+    while True:
+        for obj in source.list_volume(radar_id, volume):
+            _, _, timestamp, seq, chunk_type = parse_chunk_key(obj['Key'])
+            if progress is None:
+                progress = ProgressiveVolume(radar_id, volume, timestamp)
+            if seq in progress.chunks:
+                continue
+            last_chunk_time = time.monotonic()
+            if progress.add_chunk(seq, chunk_type, source.fetch(obj['Key'])):
+                publish_partial(progress, data_dir)
+
+        if progress is not None and progress.finished:
+            break
+        if time.monotonic() - last_chunk_time > max_idle:
+            print(f"Volume {volume} of {radar_id} stalled, giving up")
+            _retire_partial(radar_id)
+            return None
+        time.sleep(poll_interval)
+
+    # The scheduler or a request may be assembling the same scan from the chunk bucket meanwhile
+    path = os.path.join(data_dir, _volume_filename(radar_id, progress.timestamp))
+    with ingest_lock(radar_id):
+        if not os.path.exists(path):
+            _write_atomic(path, progress.assembled())
+            register_volume(path)
+            observe_ingest(radar_id, progress.timestamp)
+    _retire_partial(radar_id)
+    print(f"Progressive ingest of {os.path.basename(path)} complete")
+    return path
+
+def start_progressive_ingest(radar_id, source=None, data_dir="../data"):
+    """Starts following the newest volume of a radar in a background thread, unless one is already running."""
+    with _lock:
+        thread = _active_ingests.get(radar_id)
+        if thread is not None and thread.is_alive():
+            return False
+        thread = threading.Thread(
+            target=ingest_volume_progressively,
+            kwargs={"radar_id": radar_id, "source": source, "data_dir": data_dir},
+            name=f"progressive-{radar_id}",
+            daemon=True,
+        )
+        _active_ingests[radar_id] = thread
+    thread.start()
+    return True
+
+def find_partial_sweep_file(radar_id, elevation, latest_file=None):
+    """
+    Returns the partial volume to serve a tilt from, if it is newer than the latest complete file and the
+    sweep at that tilt has fully arrived. Otherwise returns None. Only looks at the fixed angles recorded when
+    the partial volume was published, so it never decodes anything.
+    """
+    with _lock:
+        entry = partial_volumes.get(radar_id)
+    if entry is None or not os.path.exists(entry["file"]):
+        return None
+    if latest_file and os.path.basename(latest_file) >= _volume_filename(radar_id, entry["timestamp"]):
+        return None
+
+    fixed_angles = entry["fixed_angles"]
+    sweep_index = min(range(len(fixed_angles)), key=lambda i: abs(fixed_angles[i] - elevation))
+    if sweep_index >= entry["completed_sweeps"] or abs(fixed_angles[sweep_index] - elevation) > PARTIAL_TILT_TOLERANCE:
+        return None
+    return entry["file"]
@@ -0,0 +1,199 @@
+# This file holds the slippy-map vector tiles of the sweep products
+# Tiles are Mapbox Vector Tiles (spec v2) with one polygon per aggregated gate block (see RT_lod) carrying its
+# quantized code like the other polygon products (see color_table in RT_data_processing), rendered on
+# first request and kept in the product cache under the identity of the scan file, so the tiles of a new scan
+# get new cache keys without any invalidation
+import math
+
+import numpy as np
+
+from RT_data_processing import quantize_sweep, grid_fallback
+from RT_product_cache import product_cache, product_sweep, read_sweep
+from RT_lod import sweep_lod
+
+TILE_EXTENT = 4096  # Tile coordinate units per tile side
+TILE_BUFFER = 256  # Blocks reaching this far past the tile edge are kept, so renderers can clip without seams
+MAX_ZOOM = 18
+TILE_LAYER_KEYS = ("q",)
+
+# Geometry command integers: MoveTo x1, LineTo x3, ClosePath (command id | count << 3)
+_MOVE_TO = 1 | (1 << 3)
+_LINE_TO_3 = 2 | (3 << 3)
+_CLOSE_PATH = 7 | (1 << 3)
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (west, south, east, north) degrees of a web mercator tile.
+    """
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def project_to_tile(lat, lon, z, x, y):
+    """Projects degrees onto the integer coordinates of a tile (origin top left, TILE_EXTENT per side)."""
+    n = 2 ** z
+    lat = np.clip(np.radians(np.asarray(lat, dtype=np.float64)), -1.4844, 1.4844)  # Web mercator latitude limit
+    px = ((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n - x) * TILE_EXTENT
+    py = ((1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * n - y) * TILE_EXTENT
+    return np.rint(px).astype(np.int64), np.rint(py).astype(np.int64)
+
+def _varint(n):
+    """Encodes one unsigned integer as a protobuf varint."""
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _varint_lengths(values):
+    """Byte lengths of the varint encodings of an array of unsigned integers (below 2**35)."""
+    values = np.asarray(values, dtype=np.uint64)
+    return 1 + sum((values >= np.uint64(1 << (7 * k))).astype(np.int64) for k in range(1, 5))
+
+def _varints(values):
+    """Encodes an array of unsigned integers (below 2**35) as consecutive protobuf varints."""
+    values = np.asarray(values, dtype=np.uint64).ravel()
+    lengths = _varint_lengths(values)
+    groups = ((values[:, None] >> (np.uint64(7) * np.arange(5, dtype=np.uint64))) & np.uint64(0x7F)).astype(np.uint8)
+    groups[np.arange(5) < lengths[:, None] - 1] |= 0x80
+    return groups[np.arange(5) < lengths[:, None]].tobytes()
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+def _length_delimited(field_number, payload):
+    return _varint(field_number << 3 | 2) + _varint(len(payload)) + payload
+
+def _tile_value(code):
+    """Encodes a layer value message holding a quantized code as uint_value."""
+    return b"\x28" + _varint(code)
+
+def encode_polygon_features(rings, tags):
+    """
+    Encodes quadrilateral polygon features.
+
+    Args:
+        rings (ndarray): int64[features, 4, 2] tile coordinates, clockwise in tile space (y down).
+        tags (ndarray): int64[features, 2] of (key, value) indices into the layer tables.
+
+    Returns:
+        bytes: Consecutive layer.features entries.
+    """
+    count = len(rings)
+    if count == 0:
+        return b""
+    deltas = np.diff(rings, axis=1, prepend=0)  # The cursor starts at (0, 0) and moves from corner to corner
+    geometry = np.empty((count, 11), dtype=np.int64)
+    geometry[:, 0] = _MOVE_TO
+    geometry[:, 1:3] = _zigzag(deltas[:, 0])
+    geometry[:, 3] = _LINE_TO_3
+    geometry[:, 4:10] = _zigzag(deltas[:, 1:]).reshape(count, 6)
+    geometry[:, 10] = _CLOSE_PATH
+
+    tag_bytes = _varint_lengths(tags).sum(axis=1)
+    geometry_bytes = _varint_lengths(geometry).sum(axis=1)
+    feature_bytes = 1 + _varint_lengths(tag_bytes) + tag_bytes + 2 + 1 + _varint_lengths(geometry_bytes) + geometry_bytes
+
+    # Every feature is the same sequence of varints: the layer.features key and length, then the tags,
+    # type (POLYGON) and geometry fields of the feature message
+    items = np.empty((count, 21), dtype=np.int64)
+    items[:, 0] = 2 << 3 | 2
+    items[:, 1] = feature_bytes
+    items[:, 2] = 2 << 3 | 2
+    items[:, 3] = tag_bytes
+    items[:, 4:6] = tags
+    items[:, 6] = 3 << 3
+    items[:, 7] = 3
+    items[:, 8] = 4 << 3 | 2
+    items[:, 9] = geometry_bytes
+    items[:, 10:] = geometry
+    return _varints(items)
+
+def build_tile(layer_name, lat, lon, radar_data, field, z, x, y):
+    """
+    Builds a vector tile with one polygon per valid cell of a corner grid (laid out like iter_polygon_features).
+
+    Args:
+        layer_name (str): Name of the tile's single layer.
+        lat (ndarray): Cell corner latitudes, shape (rows + 1, cols + 1).
+        lon (ndarray): Cell corner longitudes, shape (rows + 1, cols + 1).
+        radar_data (MaskedArray): Cell values, shape (rows + 1, cols + 1); the last row and column are ignored.
+        field (str): Field name used to look up the quantization.
+        z, x, y (int): Tile coordinates.
+
+    Returns:
+        bytes: The encoded tile.
+    """
+    codes, valid, _, _ = quantize_sweep(radar_data[:-1, :-1], field)
+    row, col = np.nonzero(valid)
+
+    px, py = project_to_tile(lat, lon, z, x, y)
+    corner_row = np.stack([row, row, row + 1, row + 1], axis=1)
+    corner_col = np.stack([col, col + 1, col + 1, col], axis=1)
+    rings = np.stack([px[corner_row, corner_col], py[corner_row, corner_col]], axis=2)
+
+    # Drop cells outside the buffered tile and cells that collapse at this zoom, then make every ring clockwise
+    low, high = -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER
+    inside = ~((rings[..., 0] < low).all(axis=1) | (rings[..., 0] > high).all(axis=1) |
+               (rings[..., 1] < low).all(axis=1) | (rings[..., 1] > high).all(axis=1))
+    following = np.roll(rings, -1, axis=1)
+    area = (rings[..., 0] * following[..., 1] - following[..., 0] * rings[..., 1]).sum(axis=1)
+    keep = inside & (area != 0)
+    rings, area = rings[keep], area[keep]
+    rings[area < 0] = rings[area < 0][:, ::-1]
+    unique_codes, code_index = np.unique(codes[row[keep], col[keep]], return_inverse=True)
+    tags = np.stack([np.zeros_like(code_index), code_index], axis=1)
+
+    layer = b"".join([
+        b"\x78\x02",  # version 2
+        _length_delimited(1, layer_name.encode("utf-8")),
+        encode_polygon_features(rings, tags),
+        *(_length_delimited(3, key.encode("utf-8")) for key in TILE_LAYER_KEYS),
+        *(_length_delimited(4, _tile_value(code)) for code in unique_codes.tolist()),
+        b"\x28" + _varint(TILE_EXTENT),
+    ])
+    return _length_delimited(3, layer)
+
+def render_sweep_tile(radar, field, sweep_index, z, x, y):
+    """
+    Renders one tile of a sweep, aggregated for the tile's zoom like the viewport products.
+
+    Returns:
+        bytes: The encoded tile, with a single layer named after the field.
+    """
+    if field not in radar.fields:
+        raise ValueError(f"Field '{field}' not found in radar data. Available fields: {list(radar.fields.keys())}")
+
+    if np.ma.count(radar.get_field(sweep_index, field)) == 0:
+        lat, lon, radar_data = grid_fallback(radar, field)
+        return build_tile(field, lat, lon, radar_data, field, z, x, y)
+
+    lod = sweep_lod(radar, field, sweep_index, tile_bounds(z, x, y), z)
+    if lod is None:
+        return build_tile(field, np.zeros((1, 1)), np.zeros((1, 1)), np.ma.masked_all((1, 1)), field, z, x, y)
+    return build_tile(field, lod["lat"], lod["lon"], lod["values"], field, z, x, y)
+
+def get_tile(file_path, field, elevation, z, x, y):
+    """
+    Serves a tile of the sweep closest to the requested elevation from the product cache, rendering and
+    storing it on a miss.
+
+    Returns:
+        bytes: The encoded tile.
+    """
+    tile_bounds(z, x, y)  # Validates the tile before anything is decoded
+    sweep_index = product_sweep(product_cache.get_volume_meta(file_path), field, elevation)
+    variant = f"{z}/{x}/{y}"
+    data = product_cache.get(file_path, field, sweep_index, "mvt", variant)
+    if data is None:
+        radar, radar_sweep = read_sweep(file_path, field, sweep_index)
+        data = render_sweep_tile(radar, field, radar_sweep, z, x, y)
+        product_cache.put(file_path, field, sweep_index, "mvt", data, variant)
+    return data
@@ -0,0 +1,223 @@
+# This file holds the in-process cache of decoded Level II volumes
+# Every processing function that needs a Py-ART radar object should go through read_radar() so a volume
+# is decoded once per scan instead of once per request. Products of a single sweep go through read_radar_sweep(),
+# which decodes only that cut and moment when the whole volume is not decoded yet
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pyart
+
+from RT_level2 import cut_volume, decompress_volume
+from RT_metrics import span, register_process_stats
+from RT_executors import SingleFlight
+
+MAX_CACHE_BYTES = int(os.environ.get("RADAR_CACHE_MAX_BYTES", 2 * 1024**3))  # ~2 GB of decoded volumes
+
+# Py-ART field name of every NEXRAD moment, and back
+MOMENT_FIELDS = pyart.config.get_field_mapping("nexrad_archive")
+FIELD_MOMENTS = {field: moment for moment, field in MOMENT_FIELDS.items()}
+
+class RadarVolumeCache:
+    """
+    Memory-bounded LRU cache of decoded radar volumes.
+
+    Entries are keyed on (absolute path, mtime, size) so a file that gets re-assembled under the same
+    name is decoded again instead of serving a stale volume.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (radar, nbytes)
+        self._lock = threading.Lock()
+        self._decodes = SingleFlight()  # Concurrent misses of the same file share one decode
+
+    def get(self, file_path):
+        """
+        Returns the decoded radar volume for a file, reading it on a cache miss.
+
+        Args:
+            file_path (str): Path to the assembled Level II file.
+
+        Returns:
+            pyart.core.Radar: The decoded radar volume.
+        """
+        key = _file_key(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Decode outside the lock so other volumes can still be served meanwhile
+        return self._decodes.call(key, self._decode, key, file_path)
+
+    def _decode(self, key, file_path):
+        radar = self.peek(key)  # Stored by a decode that finished after our lookup
+        if radar is not None:
+            return radar
+        print(f"Decoding radar volume: {file_path}")
+        with open(file_path, "rb") as f:
+            radar = decode_volume(f.read())
+        self.put(key, radar)
+        return radar
+
+    def peek(self, key):
+        """Returns the radar stored under a key, or None, without decoding anything."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, radar):
+        """Stores a decoded volume under the given key and evicts least recently used volumes."""
+        nbytes = radar_nbytes(radar)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (radar, nbytes)
+            self.current_bytes += nbytes
+            # Always keep the newest entry, even if it alone is over budget
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Returns the hit/miss counters and memory usage of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+def _file_key(file_path):
+    """Builds the cache key for a file from its absolute path, mtime and size."""
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+def radar_nbytes(radar):
+    """Estimates the memory footprint of a decoded radar volume from its array payloads."""
+    nbytes = 0
+    for field in radar.fields.values():
+        data = field.get("data")
+        if data is None:
+            continue
+        nbytes += data.nbytes
+        mask = np.ma.getmask(data)
+        if mask is not np.ma.nomask:
+            nbytes += mask.nbytes
+    for attr in ("time", "range", "azimuth", "elevation", "fixed_angle"):
+        data = getattr(radar, attr, None)
+        if data is not None and "data" in data:
+            nbytes += np.asarray(data["data"]).nbytes
+    return nbytes
+
+def decode_volume(data):
+    """
+    Builds the radar object of an assembled volume, its bzip2 records decompressed across cores first
+    (see decompress_volume in RT_level2) instead of one after the other by Py-ART.
+    """
+    with span("decode", bytes=len(data)):
+        return pyart.io.read_nexrad_archive(io.BytesIO(decompress_volume(data)))
+
+# Shared cache used by every endpoint in this process
+volume_cache = RadarVolumeCache()
+register_process_stats("volume", volume_cache.stats)
+
+def read_radar(file_path):
+    """Reads a Level II file through the shared volume cache."""
+    return volume_cache.get(file_path)
+
+def volume_range(index):
+    """
+    Range gates (m) of a whole volume from its cut index, laid out like Py-ART does from every moment of every
+    cut: (first gate, gate spacing, end).
+    """
+    first_gate, gate_spacing, last_gate = None, None, 0.0
+    for cut in index["cuts"].values():
+        moments = sorted((moment for moment in cut["moments"] if moment[0] in MOMENT_FIELDS), key=lambda moment: list(MOMENT_FIELDS).index(moment[0]))
+        if not moments:
+            continue
+        ngates = moments[0][1]  # Py-ART sizes a cut by its first moment
+        for _, _, first, spacing in moments:
+            first_gate = first if first_gate is None else min(first_gate, first)
+            gate_spacing = spacing if gate_spacing is None else min(gate_spacing, spacing)
+            last_gate = max(last_gate, first + spacing * (ngates - 0.5))
+    return first_gate, gate_spacing, last_gate
+
+def _decode_sweep(file_path, field, sweep_index, index):
+    """
+    Decodes one moment of one cut into a single sweep radar on the range gates of the whole volume.
+
+    Returns:
+        pyart.core.Radar: The sweep, or None if it cannot stand in for the sweep of the whole volume: the cut
+        lacks the moment, has no valid gate (products then grid the whole volume) or another gate layout.
+    """
+    cut = index["cuts"].get(str(sweep_index + 1))
+    moment = FIELD_MOMENTS.get(field)
+    if cut is None or moment not in [name for name, _, _, _ in cut["moments"]]:
+        return None
+
+    print(f"Decoding {field} sweep {sweep_index} of radar volume: {file_path}")
+    with span("decode", field=field, sweep=sweep_index):
+        radar = pyart.io.read_nexrad_archive(io.BytesIO(cut_volume(file_path, index, sweep_index + 1)),
+                                             scans=[sweep_index], include_fields=[field])
+    first_gate, gate_spacing, last_gate = volume_range(index)
+    ranges = np.arange(first_gate, last_gate, gate_spacing, "float32")
+    data = radar.fields[field]["data"]
+    if (radar.range["data"][0] != ranges[0] or radar.range["meters_between_gates"] != gate_spacing
+            or radar.ngates > len(ranges) or np.ma.count(data) == 0):
+        return None
+
+    padding = np.ma.masked_all((data.shape[0], len(ranges) - data.shape[1]), dtype=data.dtype)
+    radar.fields[field]["data"] = np.ma.concatenate([data, padding], axis=1)
+    radar.range["data"] = ranges
+    radar.ngates = len(ranges)
+    return radar
+
+def read_radar_sweep(file_path, field, sweep_index, index):
+    """
+    Reads one sweep of one field, decoding only its cut and moment unless the whole volume is already decoded.
+
+    Args:
+        index (dict): Cut index of the volume, see index_volume in RT_level2.
+
+    Returns:
+        tuple: (radar, index of the sweep in it). Either the whole volume and sweep_index, or a single sweep
+        radar with the same gates as the whole volume's sweep and 0.
+    """
+    key = _file_key(file_path)
+    radar = volume_cache.peek(key)
+    if radar is not None:
+        return radar, sweep_index
+
+    sweep_key = key + (field, sweep_index)
+    radar = volume_cache.peek(sweep_key)
+    if radar is None:
+        radar = _decode_sweep(file_path, field, sweep_index, index)
+        if radar is None:
+            return read_radar(file_path), sweep_index
+        volume_cache.put(sweep_key, radar)
+    return radar, 0
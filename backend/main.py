@@ -9,16 +9,32 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from fastapi.responses import FileResponse
+import json
+import asyncio
+from fastapi.responses import FileResponse, Response
 from starlette.requests import Request
 
 # Data handling imports
-from datetime import datetime 
+from datetime import datetime
 #import numpy as np
 
 # Custom NEXRAD API imports
-from RT_data_query import find_latest_scan, download_chunks, assemble_chunks
-from RT_data_processing import get_radar_elevations, get_radar_fields, find_latest_radar_file, extract_radar_data, extract_radar_polygons
+from RT_data_query import find_latest_scan, download_chunks, download_chunks_to_memory, assemble_chunks, write_volume, ASSEMBLE_IN_MEMORY
+from RT_data_processing import get_radar_elevations, get_radar_fields, get_radar_dropdowns, extract_radar_data, extract_radar_polygons, extract_radar_binary, cmaps, color_table
+from RT_volume_cache import volume_cache
+from RT_product_cache import product_cache, get_product, get_cached_product, cached_product_path, render_product
+from RT_catalog import scan_catalog, register_volume, ingest_lock
+from RT_progressive_ingest import start_progressive_ingest, find_partial_sweep_file, partial_volumes
+from RT_ingest_scheduler import IngestScheduler
+from RT_executors import SingleFlight, run_io, run_cpu, shutdown_executors
+from RT_lod import parse_bbox, quantize_viewport, lod_variant, extract_radar_lod, render_lod_product, get_lod_product
+from RT_tiles import get_tile
+from RT_responses import geojson_response
+from RT_loop import MAX_LOOP_FRAMES, cached_loop_delta, render_loop_delta, assemble_loop
+from RT_derived import DERIVED_FIELDS
+from RT_contour import CONTOUR_TOLERANCE, MAX_CONTOUR_TOLERANCE, contour_variant, render_contour_product, extract_radar_contours
+from RT_metrics import MetricsMiddleware, Collected, observe_ingest, process_stats, render_metrics
+from RT_mosaic import MERGE_METHODS, MOSAIC_RESOLUTION, resolve_mosaic_radars, mosaic_grid, default_merge_method, site_mosaic_grid, cached_mosaic_path, store_mosaic
 
 #----------------------------------------------------------------------------------------------------------
 #
@@ -28,6 +44,9 @@ from RT_data_processing import get_radar_elevations, get_radar_fields, find_late
 
 app = FastAPI()
 
+# Concurrent identical requests share one computation
+flights = SingleFlight()
+
 # Defining endpoints
 #origins = [
 #    "http://localhost:8000"
@@ -41,8 +60,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Request IDs, per-route latency and bytes sent, and the per-request profiler (see RT_metrics)
+app.add_middleware(MetricsMiddleware)
+
 #----------------------------------------------------------------------------------------------------------
 #
 # ROUTES
@@ -53,117 +76,171 @@ app.add_middleware(
 # Downloading data and extracting metadata
 ########################################
 
-@app.get("/get-latest-scan/{radar_id}")
-async def get_latest_scan(radar_id: str):
-    # Get the latest scan files
+def ingest_latest_scan(radar_id, timings=None):
+    """
+    Makes sure the latest complete scan of a radar is assembled locally.
+
+    Newly assembled volumes are queued for product precomputation. If a timings dict is given, it is filled
+    with the per-chunk and per-volume download timing (see download_chunks).
+
+    Returns:
+        tuple: (path of the assembled file, True if it was just assembled), or (None, False) if no scan was found
+        or it could not be downloaded whole.
+    """
+    with ingest_lock(radar_id):
+        return _ingest_latest_scan(radar_id, timings)
+
+def _ingest_latest_scan(radar_id, timings):
     print("Finding latest scan...")
     latest_files, timestamp = find_latest_scan(radar_id)
-    
+
     if not latest_files:
-        return {"error": "No files found for the latest scan."}
+        return None, False
 
     # Create a filename for the combined file (e.g., KTLX_20250129-150000.bin)
-    #current_time = datetime.now().strftime("%Y%m%d-%H%M%S")
     current_time = timestamp[0:8] + "-" + timestamp[8:]
     filename = f"{radar_id}_{current_time}.bin"
     output_file_path = os.path.join("../data", filename)
 
     if os.path.exists(output_file_path):
-        return {"message": f"Radar scan data already exists as {filename}"}
+        return output_file_path, False
+
+    # A volume with a missing chunk is not published, so the next poll downloads it again
+    try:
+        if ASSEMBLE_IN_MEMORY:
+            # Assemble in memory; the volume touches the disk once, when it is published, and the pool workers
+            # decode it from there
+            volume = b"".join(download_chunks_to_memory(latest_files, timings=timings))
+            write_volume(volume, output_file_path)
+        else:
+            # Download chunks
+            downloaded_files = download_chunks(latest_files, download_dir="../data", timings=timings)
+
+            # Combine downloaded chunks into one file
+            assemble_chunks(downloaded_files, output_file_path)
+    except IOError as e:
+        print(f"Not publishing {filename}: {e}")
+        return None, False
+
+    # Catalog the new volume and render every product of it in the background
+    register_volume(output_file_path)
+    observe_ingest(radar_id, timestamp)
+
+    return output_file_path, True
+
+def volume_vcp(file_path):
+    """Returns the VCP of a volume from its cached summary, or None if it is unknown."""
+    vcp = product_cache.get_volume_meta(file_path).get("vcp")
+    return int(vcp) if vcp is not None else None
 
-    # Download chunks
-    downloaded_files = download_chunks(latest_files, download_dir="../data")
+# Keeps WARM_RADARS and recently requested radars ingested in the background
+scheduler = IngestScheduler(ingest_latest_scan, vcp_fn=volume_vcp)
 
-    # Combine downloaded chunks into one file
-    assemble_chunks(downloaded_files, output_file_path)
+@app.on_event("startup")
+async def start_scheduler():
+    # Volumes may have been added or removed while the server was down
+    await run_io(scan_catalog.sync)
+    await run_io(scan_catalog.enforce_retention)
+    scheduler.start()
 
-    return {"message": f"Radar scan data saved as {filename}"}
+@app.on_event("shutdown")
+async def stop_background_work():
+    await scheduler.stop()
+    shutdown_executors()
+
+def latest_local_scan(radar_id):
+    """
+    Returns the latest ingested volume of a radar.
+
+    Only blocks on an ingest when nothing of the radar has been ingested yet; the scheduler keeps it fresh.
+    """
+    file_path = scan_catalog.latest(radar_id)
+    if file_path:
+        return file_path
+    file_path, _ = ingest_latest_scan(radar_id)
+    return file_path
+
+def ingest_latest_scan_timed(radar_id):
+    """Runs ingest_latest_scan and returns its download timings along with its result."""
+    timings = {}
+    output_file_path, assembled = ingest_latest_scan(radar_id, timings=timings)
+    return output_file_path, assembled, timings
+
+@app.get("/get-latest-scan/{radar_id}")
+async def get_latest_scan(radar_id: str):
+    scheduler.touch(radar_id)
+    output_file_path, assembled, timings = await flights.do(("ingest", radar_id), run_io, ingest_latest_scan_timed, radar_id)
+
+    if not output_file_path:
+        return {"error": "No files found for the latest scan."}
+
+    filename = os.path.basename(output_file_path)
+    if not assembled:
+        return {"message": f"Radar scan data already exists as {filename}"}
+
+    return {"message": f"Radar scan data saved as {filename}", "download": timings}
+
+@app.get("/get-live-scan/{radar_id}")
+async def get_live_scan(radar_id: str):
+    """
+    API to follow the volume a radar is scanning right now. Each elevation cut is served by the product
+    endpoints as soon as it completes, marked with an "X-Radar-Volume: partial" header.
+    """
+    started = start_progressive_ingest(radar_id)
+    partial = partial_volumes.get(radar_id)
+    return {
+        "message": f"Progressive ingest {'started' if started else 'running'} for {radar_id}",
+        "partial_volume": partial,
+    }
+
+async def resolve_radar_file(radar_id, target_file=None):
+    """Returns the requested file, or the latest ingested volume of the radar (see latest_local_scan)."""
+    if target_file:
+        return f"../data/{target_file}"
+    scheduler.touch(radar_id)
+    return await flights.do(("latest", radar_id), run_io, latest_local_scan, radar_id)
 
 @app.get("/get-radar-elevations/{radar_id}")
 async def get_radar_elevations_api(radar_id: str, target_file: str = None):
     """API to return elevation angles for a radar"""
-    if target_file:
-        file_path = f"../data/{target_file}"
-    else:
-        ### Using the get_latest_scan logic 
-        print("Finding latest scan...")
-        latest_files, timestamp = find_latest_scan(radar_id)
-        
-        if not latest_files:
-            return {"error": "No files found for the latest scan."}
-
-        current_time = timestamp[0:8] + "-" + timestamp[8:]
-        filename = f"{radar_id}_{current_time}.bin"
-        output_file_path = os.path.join("../data", filename)
-
-        if not os.path.exists(output_file_path):
-            # Download chunks
-            downloaded_files = download_chunks(latest_files, download_dir="../data")
-            # Combine downloaded chunks into one file
-            assemble_chunks(downloaded_files, output_file_path)
+    file_path = await resolve_radar_file(radar_id, target_file)
+    if not file_path:
+        return {"error": "No files found for the latest scan."}
 
-        file_path = output_file_path
     print("File path: ", file_path)
     if not os.path.exists(file_path):
         return {"error": "Radar file not found"}
     
-    angles = get_radar_elevations(file_path)
+    angles = await flights.do(("elevations", file_path), run_cpu, get_radar_elevations, file_path)
     return {"elevation_angles": angles}
 
 @app.get("/get-radar-fields/{radar_id}")
 async def get_radar_fields_api(radar_id: str, target_file: str = None):
     """API to return available radar fields for a radar scan."""
-    if target_file:
-        file_path = f"../data/{target_file}"
-    else:
-        print("Finding latest scan...")
-        latest_files, timestamp = find_latest_scan(radar_id)
-        
-        if not latest_files:
-            return {"error": "No files found for the latest scan."}
-
-        current_time = timestamp[0:8] + "-" + timestamp[8:]
-        filename = f"{radar_id}_{current_time}.bin"
-        output_file_path = os.path.join("../data", filename)
-
-        if not os.path.exists(output_file_path):
-            downloaded_files = download_chunks(latest_files, download_dir="../data")
-            assemble_chunks(downloaded_files, output_file_path)
-
-        file_path = output_file_path
+    file_path = await resolve_radar_file(radar_id, target_file)
+    if not file_path:
+        return {"error": "No files found for the latest scan."}
 
     print("File path: ", file_path)
     if not os.path.exists(file_path):
         return {"error": "Radar file not found"}
     
-    fields = get_radar_fields(file_path)
+    fields = await flights.do(("fields", file_path), run_cpu, get_radar_fields, file_path)
     return {"radar_fields": fields}
 
 @app.get("/get-dropdowns/{radar_id}")
 async def get_radar_fields_api(radar_id: str):
     """API to return elevation angles and radar fields for a radar scan."""
-    print("Finding latest scan...")
-    latest_files, timestamp = find_latest_scan(radar_id)
-    
-    if not latest_files:
-        return {"error": "No files found for the latest scan."}
+    file_path = await resolve_radar_file(radar_id)
 
-    current_time = timestamp[0:8] + "-" + timestamp[8:]
-    filename = f"{radar_id}_{current_time}.bin"
-    output_file_path = os.path.join("../data", filename)
-
-    if not os.path.exists(output_file_path):
-        downloaded_files = download_chunks(latest_files, download_dir="../data")
-        assemble_chunks(downloaded_files, output_file_path)
-
-    file_path = output_file_path
+    if not file_path:
+        return {"error": "No files found for the latest scan."}
 
     print("File path: ", file_path)
     if not os.path.exists(file_path):
         return {"error": "Radar file not found"}
     
-    angles = get_radar_elevations(file_path)
-    fields = get_radar_fields(file_path)
+    angles, fields = await flights.do(("dropdowns", file_path), run_cpu, get_radar_dropdowns, file_path)
     return {"elevation_angles": angles, "radar_fields": fields}
 
 ########################################
@@ -171,39 +248,338 @@ async def get_radar_fields_api(radar_id: str):
 ########################################
 
 @app.get("/get/{field}/{tilt}/{radar_id}")
-async def get_radar_data(field: str, tilt: float, radar_id: str):
+async def get_radar_data(field: str, tilt: float, radar_id: str, request: Request):
     """
     API endpoint to fetch radar data for a given field, elevation angle, and radar site.
     """
     # Find the latest available radar file
-    radar_file = find_latest_radar_file(radar_id)
+    scheduler.touch(radar_id)
+    radar_file = await run_io(scan_catalog.latest, radar_id)
 
     if not radar_file:
         return {"error": f"No radar file found for {radar_id}"}
 
     # Extract radar data
-    radar_data = extract_radar_data(radar_file, field, tilt)
+    radar_data = await flights.do(("points", radar_file, field, tilt), run_cpu, extract_radar_data, radar_file, field, tilt)
 
     if not radar_data:
         return {"error": f"Failed to extract {field} data at {tilt}° from {radar_id}"}
 
-    return radar_data
+    return await geojson_response(radar_data, request.headers.get("accept-encoding"))
+
+async def load_product(radar_id, field, tilt, fmt, viewport=None, contour=None):
+    """
+    Loads a product of the latest volume of a radar, preferring a completed sweep of the volume being scanned.
+
+    Cached products are read on the thread pool; anything that needs decoding or rendering goes to the
+    process pool. With a viewport ((west, south, east, north), zoom, quantized by parse_viewport) the sweep is
+    clipped and aggregated for it instead (see RT_lod). With a contour tolerance (m), GeoJSON products
+    are isobands instead of gate polygons (see RT_contour). Full GeoJSON products are large, so they are
+    returned as the path of the cached product, to be streamed from disk (see RT_responses).
+
+    Returns:
+        tuple: (product bytes or path or None, True if it came from a partial volume, error message or None)
+    """
+    radar_file = await run_io(scan_catalog.latest, radar_id)
+
+    # Serve a sweep of the volume still being scanned if it is newer than the latest complete one; the derived
+    # fields need every sweep, so they always come from a complete volume
+    partial_file = None if field in DERIVED_FIELDS else await run_io(find_partial_sweep_file, radar_id, tilt, radar_file)
+    if partial_file:
+        try:
+            if viewport:
+                payload = await run_cpu(extract_radar_lod, partial_file, field, tilt, *viewport, fmt)
+            elif contour is not None:
+                payload = await run_cpu(extract_radar_contours, partial_file, field, tilt, contour)
+            elif fmt == "geojson":
+                payload = await run_cpu(extract_radar_polygons, partial_file, field, tilt)
+            else:
+                payload = await run_cpu(extract_radar_binary, partial_file, field, tilt)
+        except Exception as e:
+            print(f"Error rendering {fmt} from partial radar file {partial_file}: {e}")
+            return None, True, f"Failed to extract {field} data at {tilt}° from {radar_id}"
+        return payload, True, None
+
+    if not radar_file:
+        return None, False, f"No radar file found for {radar_id}"
+
+    try:
+        if viewport:
+            variant = lod_variant(*viewport)
+            if fmt == "geojson":
+                payload = await run_io(cached_product_path, radar_file, field, tilt, fmt, variant)
+                if payload is None:
+                    payload = await run_cpu(render_lod_product, radar_file, field, tilt, *viewport, fmt)
+            else:
+                payload = await run_io(get_cached_product, radar_file, field, tilt, fmt, variant)
+                if payload is None:
+                    payload = await run_cpu(get_lod_product, radar_file, field, tilt, *viewport, fmt)
+            return payload, False, None
+        if contour is not None:
+            payload = await run_io(cached_product_path, radar_file, field, tilt, fmt, contour_variant(contour))
+            if payload is None:
+                payload = await run_cpu(render_contour_product, radar_file, field, tilt, contour)
+            return payload, False, None
+        if fmt == "geojson":
+            payload = await run_io(cached_product_path, radar_file, field, tilt, fmt)
+            if payload is None:
+                payload = await run_cpu(render_product, radar_file, field, tilt, fmt)
+            return payload, False, None
+        payload = await run_io(get_cached_product, radar_file, field, tilt, fmt)
+        if payload is None:
+            payload = await run_cpu(get_product, radar_file, field, tilt, fmt)
+    except Exception as e:
+        print(f"Error rendering {fmt} from radar file {radar_file}: {e}")
+        return None, False, f"Failed to extract {field} data at {tilt}° from {radar_id}"
+    return payload, False, None
+
+def parse_viewport(bbox, zoom):
+    """Returns ((west, south, east, north), zoom) from the product query parameters, or None for the full sweep."""
+    if bbox is None or zoom is None:
+        return None
+    return quantize_viewport(parse_bbox(bbox), zoom)
 
 @app.get("/get-polygons/{field}/{tilt}/{radar_id}")
-async def get_radar_polygons(field: str, tilt: float, radar_id: str):
+async def get_radar_polygons(field: str, tilt: float, radar_id: str, request: Request, bbox: str = None, zoom: float = None,
+                             contour: bool = False, tolerance: float = CONTOUR_TOLERANCE):
     """
     API endpoint to fetch radar data as geospatial polygons for a given field, elevation angle, and radar site.
+    With bbox=west,south,east,north and zoom, only the visible gates are returned, aggregated for that zoom.
+    With contour=true, gates of the same colour band are merged into isoband polygons instead, simplified
+    within tolerance meters: larger tolerances give fewer, coarser polygons.
+    The derived fields (composite_reflectivity, echo_tops, vil) cover the whole volume and ignore the tilt.
+    """
+    scheduler.touch(radar_id)
+    try:
+        viewport = parse_viewport(bbox, zoom)
+        if contour and viewport:
+            raise ValueError("contour=true renders the whole sweep, it does not take bbox and zoom")
+        if contour and not 0 <= tolerance <= MAX_CONTOUR_TOLERANCE:
+            raise ValueError(f"tolerance must be between 0 and {MAX_CONTOUR_TOLERANCE:g} meters")
+    except ValueError as e:
+        return {"error": str(e)}
+    contour = tolerance if contour else None
+    #radar_polygons = extract_radar_data(radar_file, field, tilt) # Point Geometry: Operational
+    payload, partial, error = await flights.do(("geojson", radar_id, field, tilt, viewport, contour), load_product, radar_id, field, tilt, "geojson", viewport, contour) # Polygon Geometry: Experimental
+    if error:
+        return {"error": error}
+
+    # Streamed as is: the product is already serialized GeoJSON, so it must not be encoded as a JSON string again
+    headers = {"X-Radar-Volume": "partial"} if partial else None
+    try:
+        return await geojson_response(payload, request.headers.get("accept-encoding"), headers)
+    except FileNotFoundError:
+        return {"error": f"Failed to extract {field} data at {tilt}° from {radar_id}"}
+
+@app.get("/get-binary/{field}/{tilt}/{radar_id}")
+async def get_radar_binary(field: str, tilt: float, radar_id: str, bbox: str = None, zoom: float = None):
+    """
+    API endpoint to fetch a sweep as packed binary attribute buffers (see SWEEP_HEADER in RT_data_processing).
+    Accepts the same bbox and zoom parameters as /get-polygons.
+    """
+    scheduler.touch(radar_id)
+    try:
+        viewport = parse_viewport(bbox, zoom)
+    except ValueError as e:
+        return {"error": str(e)}
+    payload, partial, error = await flights.do(("binary", radar_id, field, tilt, viewport), load_product, radar_id, field, tilt, "binary", viewport)
+    if error:
+        return {"error": error}
+    if payload is None:
+        return {"error": f"Failed to extract {field} data at {tilt}° from {radar_id}"}
+
+    headers = {"X-Radar-Volume": "partial"} if partial else None
+    return Response(content=payload, media_type="application/octet-stream", headers=headers)
+
+async def load_mosaic(file_paths, field, tilt, method, grid):
+    """Returns the path of a cached mosaic, sampling every site in parallel on the process pool on a miss."""
+    path = await run_io(cached_mosaic_path, file_paths, field, tilt, method, grid)
+    if path is None:
+        site_grids = await asyncio.gather(*(run_cpu(site_mosaic_grid, file_path, field, tilt, grid) for file_path in file_paths))
+        path = await run_io(store_mosaic, file_paths, field, tilt, method, grid, site_grids)
+    return path
+
+@app.get("/get-mosaic/{field}")
+async def get_mosaic(field: str, request: Request, radars: str = None, bbox: str = None, tilt: float = None,
+                     method: str = None, resolution: float = MOSAIC_RESOLUTION):
+    """
+    API endpoint to fetch a multi-radar mosaic of a field on a common lat/lon grid, as GeoJSON cells.
+
+    Sites come from radars=KTLX,KINX or from the sites covering bbox=west,south,east,north. Without tilt the
+    mosaic is the composite (maximum over every elevation). Overlaps merge by method=max or method=nearest
+    (nearest radar), by default max for reflectivity-like fields. The latest ingested volume of every site is
+    used; sites without one are reported in X-Mosaic-Missing and queued for the ingest scheduler.
+    """
+    try:
+        bounds = parse_bbox(bbox) if bbox else None
+        radar_ids = [radar_id.strip().upper() for radar_id in radars.split(",") if radar_id.strip()] if radars else None
+        if not radar_ids and bounds is None:
+            raise ValueError("Pass radars=ID,ID,... or bbox=west,south,east,north")
+        radar_ids = resolve_mosaic_radars(radar_ids, bounds)
+    except (ValueError, OSError) as e:
+        return {"error": str(e)}
+    method = method or default_merge_method(field)
+    if method not in MERGE_METHODS:
+        return {"error": f"Unknown merge method '{method}', expected one of {list(MERGE_METHODS)}"}
+    if not radar_ids or resolution <= 0:
+        return {"error": "No radar covers the requested area"}
+
+    for radar_id in radar_ids:
+        scheduler.touch(radar_id)
+    latest = await asyncio.gather(*(run_io(scan_catalog.latest, radar_id) for radar_id in radar_ids))
+    available = {radar_id: file_path for radar_id, file_path in zip(radar_ids, latest) if file_path}
+    missing = [radar_id for radar_id in radar_ids if radar_id not in available]
+    if not available:
+        return {"error": f"No ingested volumes yet for {radar_ids}, they have been queued for ingest"}
+
+    # The grid covers every requested site, so it does not move as missing sites come in
+    grid = mosaic_grid(radar_ids, bounds, resolution)
+    file_paths = sorted(available.values())
+    try:
+        path = await flights.do(("mosaic", tuple(file_paths), field, tilt, method, json.dumps(grid, sort_keys=True)),
+                                load_mosaic, file_paths, field, tilt, method, grid)
+        headers = {"X-Mosaic-Radars": ",".join(available)}
+        if missing:
+            headers["X-Mosaic-Missing"] = ",".join(missing)
+        return await geojson_response(path, request.headers.get("accept-encoding"), headers)
+    except Exception as e:
+        print(f"Error building {field} mosaic of {radar_ids}: {e}")
+        return {"error": f"Failed to build the {field} mosaic of {radar_ids}"}
+
+async def load_loop(radar_files, field, tilt):
     """
-    radar_file = find_latest_radar_file(radar_id)
+    Builds a loop of the given volumes. Missing frames are decoded in parallel on the process pool, then the
+    missing deltas are encoded; everything else comes from the product cache.
+    """
+    frames = await asyncio.gather(*(run_io(cached_product_path, radar_file, field, tilt, "frame") for radar_file in radar_files))
+    await asyncio.gather(*(run_cpu(render_product, radar_file, field, tilt, "frame")
+                           for radar_file, frame in zip(radar_files, frames) if frame is None))
+
+    pairs = list(zip(radar_files, radar_files[1:]))
+    records = await asyncio.gather(*(run_io(cached_loop_delta, previous, radar_file, field, tilt) for previous, radar_file in pairs))
+    missing = [i for i, record in enumerate(records) if record is None]
+    rendered = await asyncio.gather(*(run_cpu(render_loop_delta, *pairs[i], field, tilt) for i in missing))
+    for i, record in zip(missing, rendered):
+        records[i] = record
+    return await run_io(assemble_loop, radar_files, field, tilt, records)
+
+@app.get("/get-loop/{field}/{tilt}/{radar_id}")
+async def get_radar_loop(field: str, tilt: float, radar_id: str, frames: int = 8):
+    """
+    API endpoint to fetch the last frames volumes of a radar as an animation loop: a keyframe followed by the
+    changed gates of every later scan (see LOOP_HEADER in RT_loop).
+    """
+    if not 1 <= frames <= MAX_LOOP_FRAMES:
+        return {"error": f"frames must be between 1 and {MAX_LOOP_FRAMES}"}
+    scheduler.touch(radar_id)
+    radar_files = await run_io(scan_catalog.recent, radar_id, frames)
+    if not radar_files:
+        return {"error": f"No radar file found for {radar_id}"}
+
+    try:
+        payload = await flights.do(("loop", tuple(radar_files), field, tilt), load_loop, radar_files, field, tilt)
+    except Exception as e:
+        print(f"Error building {field} loop of {radar_id}: {e}")
+        return {"error": f"Failed to build the {field} loop at {tilt}° from {radar_id}"}
+    return Response(content=payload, media_type="application/octet-stream", headers={"X-Loop-Frames": str(len(radar_files))})
+
+@app.get("/get-colortable/{field}")
+async def get_color_table(field: str):
+    """
+    API endpoint to fetch the quantization and colour lookup table of a field. Products only carry quantized
+    codes ("q" properties, binary sweep values), which this table turns into values and colours.
+    """
+    if field not in cmaps:
+        return {"error": f"No colour table for field '{field}'. Available fields: {list(cmaps)}"}
+    return color_table(field)
+
+async def load_tile(radar_file, field, tilt, z, x, y):
+    """Loads a vector tile of a volume, from the product cache when it was already rendered."""
+    payload = await run_io(get_cached_product, radar_file, field, tilt, "mvt", f"{z}/{x}/{y}")
+    if payload is None:
+        payload = await run_cpu(get_tile, radar_file, field, tilt, z, x, y)
+    return payload
+
+@app.get("/{radar_id}/{field}/{tilt}/{z}/{x}/{y}")
+async def get_radar_tile(radar_id: str, field: str, tilt: float, z: int, x: int, y: int):
+    """
+    API endpoint to fetch one slippy-map tile of a sweep of the latest volume as a Mapbox Vector Tile.
+    Tiles are cached per scan; the X-Radar-Scan header names the volume a tile was cut from, so clients can
+    drop their tiles once it changes.
+    """
+    radar_file = await resolve_radar_file(radar_id)
     if not radar_file:
         return {"error": f"No radar file found for {radar_id}"}
 
-    #radar_polygons = extract_radar_data(radar_file, field, tilt) # Point Geometry: Operational
-    radar_polygons = extract_radar_polygons(radar_file, field, tilt) # Polygon Geometry: Experimental
-    if not radar_polygons:
-        return {"error": f"Failed to extract {field} data at {tilt}° from {radar_id}"}
+    try:
+        payload = await flights.do(("tile", radar_file, field, tilt, z, x, y), load_tile, radar_file, field, tilt, z, x, y)
+    except Exception as e:
+        print(f"Error rendering tile {z}/{x}/{y} from radar file {radar_file}: {e}")
+        return {"error": f"Failed to render tile {z}/{x}/{y} of {field} at {tilt}° from {radar_id}"}
+
+    return Response(content=payload, media_type="application/vnd.mapbox-vector-tile",
+                    headers={"X-Radar-Scan": os.path.basename(radar_file)})
+
+########################################
+# Diagnostics
+########################################
+
+@app.get("/get-cache-stats")
+async def get_cache_stats():
+    """
+    API to return hit/miss counters and usage of the decoded volume and rendered product caches, and how many
+    requests shared an in-flight computation. The volume cache counters are those of the API process only.
+    """
+    return {"volume_cache": volume_cache.stats(), "product_cache": product_cache.stats(), "single_flight": flights.stats(),
+            "scan_catalog": await run_io(scan_catalog.stats)}
+
+def _cache_stats():
+    """
+    Counters of the caches summed over the API process and the run_cpu workers (see process_stats in RT_metrics).
+    Every process holds its own decoded volumes, while the products are one directory shared by all of them.
+    """
+    summed = {}
+    for cache in ("volume", "product"):
+        processes = process_stats(cache)
+        hits = sum(stats["hits"] for stats in processes)
+        misses = sum(stats["misses"] for stats in processes)
+        summed[cache] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+    summed["volume"]["bytes"] = sum(stats["bytes"] for stats in process_stats("volume"))
+    summed["product"]["bytes"] = product_cache.stats()["bytes"]
+    return summed
+
+# Counters kept elsewhere, read when /metrics is scraped
+Collected("radar_cache_hits_total", "Cache hits in the API process and the process pool workers", "counter",
+          lambda: [({"cache": cache}, stats["hits"]) for cache, stats in _cache_stats().items()])
+Collected("radar_cache_misses_total", "Cache misses in the API process and the process pool workers", "counter",
+          lambda: [({"cache": cache}, stats["misses"]) for cache, stats in _cache_stats().items()])
+Collected("radar_cache_hit_ratio", "Share of cache lookups that hit, in the API process and the process pool workers", "gauge",
+          lambda: [({"cache": cache}, stats["hit_rate"]) for cache, stats in _cache_stats().items()])
+Collected("radar_cache_bytes", "Bytes held by each cache, over every process", "gauge",
+          lambda: [({"cache": cache}, stats["bytes"]) for cache, stats in _cache_stats().items()])
+Collected("radar_coalesced_requests_total", "Requests that shared an in-flight computation", "counter",
+          lambda: [({}, flights.stats()["coalesced"])])
+Collected("radar_data_age_seconds", "Age of the newest volume of every radar the ingest scheduler follows", "gauge",
+          lambda: [({"radar": radar_id}, state["data_age_seconds"]) for radar_id, state in scheduler.status()["radars"].items()
+                   if state["data_age_seconds"] is not None])
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    API to return the request latency, stage latency, bytes served, feature count, cache and ingest lag metrics
+    in the Prometheus text format.
+    """
+    return Response(content=await run_io(render_metrics), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/get-scans/{radar_id}")
+async def get_scans(radar_id: str, start: datetime = None, end: datetime = None):
+    """API to list the ingested volumes of a radar, optionally between start and end (ISO 8601, UTC)."""
+    return {"radar_id": radar_id, "scans": await run_io(scan_catalog.between, radar_id, start, end)}
 
-    return radar_polygons
+@app.get("/get-ingest-status")
+async def get_ingest_status():
+    """API to return the queue depth, in-flight ingests and per-radar data age and lag of the background scheduler."""
+    return scheduler.status()
 
 #----------------------------------------------------------------------------------------------------------
 #
@@ -0,0 +1,107 @@
+# Benchmark of the vectorized polygon builder against the original per-gate loop of extract_radar_polygons,
+# both serialized into a whole FeatureCollection
+# Run from the data_exploration directory: python benchmark_polygons.py [--file ../data/KTLX_20250129-150000.bin]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from RT_data_processing import iter_polygon_features, feature_collection_chunks, dump_json, field_quantization
+
+def legacy_polygon_features(lat_grid, lon_grid, radar_data, field):
+    """
+    The original nested loop from extract_radar_polygons, kept as the reference implementation. Gates carry
+    their quantized code like the products do now (see field_quantization), instead of a value and a colour.
+    """
+    dtype, scale, vmin = field_quantization(field)
+    vmax = vmin + scale * np.iinfo(dtype).max
+    features = []
+    lat_shape, lon_shape = lat_grid.shape
+    for az_idx in range(lat_shape - 1):
+        for r_idx in range(lon_shape - 1):
+            value = radar_data[az_idx, r_idx]
+
+            if np.ma.is_masked(value) or np.isnan(value) or np.isinf(value) or value == -9999:
+                continue
+
+            lat1, lon1 = lat_grid[az_idx, r_idx], lon_grid[az_idx, r_idx]
+            lat2, lon2 = lat_grid[az_idx, r_idx + 1], lon_grid[az_idx, r_idx + 1]
+            lat3, lon3 = lat_grid[az_idx + 1, r_idx + 1], lon_grid[az_idx + 1, r_idx + 1]
+            lat4, lon4 = lat_grid[az_idx + 1, r_idx], lon_grid[az_idx + 1, r_idx]
+
+            # On a one element array, so the rounding is the same as on the whole sweep
+            code = np.rint((np.clip(np.asarray([value]), vmin, vmax) - vmin) / scale).astype(dtype)[0]
+
+            features.append({
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[float(lon), float(lat)] for lon, lat in
+                                     [(lon1, lat1), (lon2, lat2), (lon3, lat3), (lon4, lat4), (lon1, lat1)]]]
+                },
+                "properties": {"q": int(code)}
+            })
+    return features
+
+def synthetic_sweep(n_rays=720, n_gates=1832, site=(35.333, -97.278), seed=0):
+    """Builds a super-res sized sweep with a few storm cells, masked below 5 dBZ."""
+    rng = np.random.default_rng(seed)
+    azimuths = np.deg2rad((np.arange(n_rays) + 0.5) * 360.0 / n_rays)
+    ranges = 2125.0 + 250.0 * np.arange(n_gates)
+    x = np.outer(np.sin(azimuths), ranges)
+    y = np.outer(np.cos(azimuths), ranges)
+    lat = site[0] + y / 111_000.0
+    lon = site[1] + x / (111_000.0 * np.cos(np.deg2rad(site[0])))
+
+    values = rng.normal(0, 3, size=(n_rays, n_gates))
+    for _ in range(12):
+        cx, cy = rng.uniform(-200_000, 200_000, size=2)
+        values += rng.uniform(30, 70) * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * rng.uniform(5e3, 3e4) ** 2))
+    values = values.astype(np.float32)
+    return lat, lon, np.ma.masked_less(values, 5.0)
+
+def sweep_from_file(file_path, field, elevation):
+    """Loads one sweep of a real Level II file."""
+    from RT_volume_cache import read_radar
+    radar = read_radar(file_path)
+    sweep_index = np.argmin(np.abs(radar.fixed_angle["data"] - elevation))
+    lat, lon, _ = radar.get_gate_lat_lon_alt(sweep_index)
+    return lat, lon, radar.get_field(sweep_index, field)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized polygon builder")
+    parser.add_argument("--file", help="Level II file to benchmark instead of a synthetic sweep")
+    parser.add_argument("--field", default="reflectivity")
+    parser.add_argument("--elevation", type=float, default=0.5)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the vectorized builder")
+    args = parser.parse_args()
+
+    if args.file:
+        lat, lon, data = sweep_from_file(args.file, args.field, args.elevation)
+    else:
+        lat, lon, data = synthetic_sweep()
+    print(f"Sweep shape: {data.shape}, valid gates: {np.count_nonzero(~np.ma.getmaskarray(data))}")
+
+    start = time.perf_counter()
+    collection = b"".join(feature_collection_chunks(iter_polygon_features(lat, lon, data, args.field)))
+    vectorized_time = time.perf_counter() - start
+    print(f"Vectorized: {vectorized_time:.2f} s, {len(collection) / 1024**2:.1f} MB")
+
+    if args.skip_legacy:
+        return
+
+    start = time.perf_counter()
+    legacy = legacy_polygon_features(lat, lon, data, args.field)
+    legacy_collection = dump_json({"type": "FeatureCollection", "features": legacy})
+    legacy_time = time.perf_counter() - start
+    print(f"Legacy loop: {legacy_time:.2f} s, {len(legacy)} features")
+
+    identical = collection == legacy_collection
+    print(f"Identical FeatureCollection: {identical}")
+    print(f"Speedup: {legacy_time / vectorized_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# End-to-end benchmark of the pipeline, stage by stage, on a synthetic Level II volume (see synthetic_level2.py)
+# Lays the chunks of the volume out in a local stand-in for the chunk bucket and times every stage of getting it
+# on screen on its own: listing, download, assembly, decode, sweep selection, gridding, polygonizing and
+# serialization, then full HTTP round trips through the API with a test client. The results are written as JSON,
+# and --compare reports the stages that got slower than in a previous run (exit status 1 past --threshold)
+# Run from the data_exploration directory: python benchmark_suite.py --vcp 212 --output results.json --compare previous.json
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import RT_data_query  # noqa: E402
+import main as api  # noqa: E402
+from RT_data_query import ScanListingIndex, download_chunks, download_chunks_to_memory, assemble_chunks, write_volume  # noqa: E402
+from RT_level2 import index_volume, volume_to_chunks  # noqa: E402
+from RT_volume_cache import decode_volume, read_radar_sweep, volume_cache  # noqa: E402
+from RT_data_processing import select_sweep, iter_polygon_features, feature_collection_chunks  # noqa: E402
+from RT_geometry import canonical_sweep_geometry  # noqa: E402
+from RT_gridding import grid_radar_field  # noqa: E402
+from RT_contour import CONTOUR_TOLERANCE, contour_features  # noqa: E402
+from RT_catalog import scan_catalog  # noqa: E402
+from synthetic_level2 import VCPS, LocalBucket, generate_volume, volume_name, write_bucket  # noqa: E402
+
+RESULTS_VERSION = 1  # Bump when the layout of the results changes, so --compare does not match unrelated entries
+
+def timed(repeat, fn, *args, setup=None):
+    """
+    Runs fn(*args) repeat times, after setup() if given (not timed).
+
+    Returns:
+        tuple: ({"seconds": fastest run, "first": first run, "mean": mean run, "runs": repeat}, last result).
+        The first run is the one paying for cold caches.
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": min(seconds), "first": seconds[0], "mean": sum(seconds) / len(seconds), "runs": repeat}, result
+
+def assemble_in_memory(chunks, file_path):
+    """Joins the chunks and publishes the volume, like the ingest does with ASSEMBLE_IN_MEMORY."""
+    data = b"".join(chunks)
+    write_volume(data, file_path)
+    return data
+
+def site_tile(lat, lon, z):
+    """Slippy map tile (x, y) holding a point."""
+    n = 2 ** z
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return int((lon + 180.0) / 360.0 * n), int(y)
+
+def run_stages(args, bucket, workdir, scan_time):
+    """Times every pipeline stage in this process. Returns {stage: timing and size details}."""
+    stages = {}
+    radar_id, field, repeat = args.radar, args.field, args.repeat
+
+    stages["listing"], volumes = timed(repeat, lambda: ScanListingIndex(client=bucket).latest_volumes(radar_id))
+    files = volumes[0]["files"]
+    stages["listing"]["chunks"] = len(files)
+    index = ScanListingIndex(client=bucket, ttl=0)
+    index.latest_volumes(radar_id)
+    stages["listing_refresh"], _ = timed(repeat, index.latest_volumes, radar_id)
+
+    # The download helpers fetch through the module's client
+    RT_data_query.s3 = bucket
+    chunk_dir = os.path.join(workdir, "chunks")
+    stages["download_memory"], chunks = timed(repeat, download_chunks_to_memory, files)
+    stages["download_memory"]["bytes"] = sum(len(chunk) for chunk in chunks)
+    stages["download_disk"], _ = timed(repeat, download_chunks, files, chunk_dir)
+
+    file_path = os.path.join(workdir, "data", volume_name(radar_id, scan_time))
+    stages["assembly_memory"], data = timed(repeat, assemble_in_memory, chunks, file_path)
+    paths = [os.path.join(chunk_dir, os.path.basename(obj["Key"])) for obj in files]
+    stages["assembly_disk"], _ = timed(repeat, assemble_chunks, paths, file_path,
+                                       setup=lambda: download_chunks(files, chunk_dir))  # Assembling deletes the chunks
+
+    stages["decode"], radar = timed(repeat, decode_volume, data)
+    stages["decode"]["sweeps"] = radar.nsweeps
+    stages["index"], cut_index = timed(repeat, index_volume, data)
+    stages["sweep_selection"], sweep_index = timed(repeat, select_sweep, radar, args.tilt)
+    stages["sweep_read"], _ = timed(repeat, read_radar_sweep, file_path, field, sweep_index, cut_index,
+                                    setup=volume_cache.clear)
+
+    stages["gridding"], _ = timed(repeat, grid_radar_field, radar, field)
+
+    geometry = canonical_sweep_geometry(radar, field, sweep_index)
+    stages["polygonize"], batches = timed(repeat, lambda: list(iter_polygon_features(*geometry, field)))
+    stages["polygonize"]["features"] = sum(len(batch) for batch in batches)
+    stages["serialize"], payload = timed(repeat, lambda: b"".join(feature_collection_chunks(iter(batches))))
+    stages["serialize"]["bytes"] = len(payload)
+
+    stages["contour"], bands = timed(repeat, lambda: list(contour_features(radar, field, sweep_index, CONTOUR_TOLERANCE)))
+    stages["contour"]["features"] = sum(len(band) for band in bands)
+    stages["contour_serialize"], payload = timed(repeat, lambda: b"".join(feature_collection_chunks(iter(bands))))
+    stages["contour_serialize"]["bytes"] = len(payload)
+    return stages
+
+def run_http(args, bucket, site):
+    """
+    Times full HTTP round trips through the API. The first request of each endpoint renders (the ingest
+    request downloads and assembles the volume), the repeats are served from the caches.
+
+    Returns:
+        dict: {endpoint: timing, status and response size}.
+    """
+    radar_id, field, tilt = args.radar, args.field, args.tilt
+    RT_data_query.s3 = bucket
+    # Precomputing every product of the new volume would race the renders timed here; catalog it only
+    api.register_volume = scan_catalog.add
+    z = 7
+    x, y = site_tile(site[0], site[1], z)
+    endpoints = {
+        "ingest": f"/get-latest-scan/{radar_id}",
+        "elevations": f"/get-radar-elevations/{radar_id}",
+        "fields": f"/get-radar-fields/{radar_id}",
+        "polygons": f"/get-polygons/{field}/{tilt}/{radar_id}",
+        "contours": f"/get-polygons/{field}/{tilt}/{radar_id}?contour=true",
+        "binary": f"/get-binary/{field}/{tilt}/{radar_id}",
+        "tile": f"/{radar_id}/{field}/{tilt}/{z}/{x}/{y}",
+    }
+    results = {}
+    with TestClient(api.app) as client:
+        for name, url in endpoints.items():
+            results[name], response = timed(args.repeat, client.get, url)
+            results[name].update({"url": url, "status": response.status_code, "bytes": len(response.content)})
+    return results
+
+def compare(results, previous, threshold):
+    """
+    Prints the change of every stage and endpoint against a previous run.
+
+    Returns:
+        list: Names of the entries that got slower by more than the threshold ratio.
+    """
+    regressions = []
+    print(f"{'entry':<28} {'previous s':>11} {'current s':>10} {'ratio':>7}")
+    for section in ("stages", "http"):
+        for name, timing in results[section].items():
+            before = previous.get(section, {}).get(name)
+            if before is None:
+                continue
+            ratio = timing["seconds"] / before["seconds"] if before["seconds"] else math.inf
+            flag = " slower" if ratio > threshold else ""
+            print(f"{section + '/' + name:<28} {before['seconds']:>11.4f} {timing['seconds']:>10.4f} {ratio:>7.2f}{flag}")
+            if flag:
+                regressions.append(f"{section}/{name}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stage by stage on a synthetic volume")
+    parser.add_argument("--volume", help="Benchmark this assembled volume instead of a synthetic one")
+    parser.add_argument("--radar", default="KTLX")
+    parser.add_argument("--vcp", type=int, default=212, choices=sorted(VCPS))
+    parser.add_argument("--sweeps", type=int, help="Only the first cuts of the pattern")
+    parser.add_argument("--no-super-res", dest="super_res", action="store_false")
+    parser.add_argument("--no-dual-pol", dest="dual_pol", action="store_false")
+    parser.add_argument("--cells", type=int, default=12, help="Storm cells of the synthetic volume")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--field", default="reflectivity")
+    parser.add_argument("--tilt", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every bucket request")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is reported")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", help="Write the results here instead of stdout")
+    parser.add_argument("--compare", help="Results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    # The backend resolves ../data against its working directory, so give it a fresh backend/ and data/ pair
+    workdir = tempfile.mkdtemp(prefix="radar-bench-")
+    for directory in ("backend", "data", "bucket"):
+        os.makedirs(os.path.join(workdir, directory))
+    cwd = os.getcwd()
+    os.chdir(os.path.join(workdir, "backend"))
+    scan_time = datetime.now(timezone.utc).replace(microsecond=0)
+    site = (35.3333, -97.2778, 370.0)
+
+    try:
+        # The backend prints progress as it goes; keep stdout for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            start = time.perf_counter()
+            if args.volume:
+                with open(os.path.join(cwd, args.volume), "rb") as volume_file:
+                    data = volume_file.read()
+            else:
+                data = generate_volume(args.radar, site, args.vcp, args.sweeps, args.super_res, args.dual_pol,
+                                       args.cells, scan_time, args.seed)
+            chunks = volume_to_chunks(data)
+            generate_seconds = time.perf_counter() - start
+            bucket = LocalBucket(os.path.join(workdir, "bucket"), latency=args.latency)
+            write_bucket(bucket.root, args.radar, 1, scan_time, chunks)
+            if args.volume:
+                radar = decode_volume(data)
+                site = (float(radar.latitude["data"][0]), float(radar.longitude["data"][0]), float(radar.altitude["data"][0]))
+
+            results = {
+                "version": RESULTS_VERSION,
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                "cpus": os.cpu_count()},
+                "volume": {"source": args.volume or "synthetic", "radar": args.radar, "field": args.field,
+                           "tilt": args.tilt, "bytes": len(data), "chunks": len(chunks),
+                           "compressed_bytes": sum(len(chunk) for _, chunk in chunks),
+                           "generate_seconds": generate_seconds},
+                "stages": run_stages(args, bucket, workdir, scan_time),
+            }
+            if not args.volume:
+                results["volume"].update({"vcp": args.vcp, "sweeps": len(VCPS[args.vcp][:args.sweeps]),
+                                          "super_res": args.super_res, "dual_pol": args.dual_pol, "seed": args.seed})
+            if not args.skip_http:
+                # Start over from the bucket, like a fresh deployment would
+                os.remove(os.path.join(workdir, "data", volume_name(args.radar, scan_time)))
+                volume_cache.clear()
+                results["http"] = run_http(args, bucket, site)
+            results["volume"]["bucket_requests"] = bucket.requests
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        if previous.get("version") != RESULTS_VERSION:
+            sys.exit(f"{args.compare} has results version {previous.get('version')}, expected {RESULTS_VERSION}")
+        results.setdefault("http", {})
+        with contextlib.redirect_stdout(sys.stderr):
+            changed = [key for key in ("source", "vcp", "sweeps", "super_res", "dual_pol", "seed", "field", "tilt")
+                       if previous["volume"].get(key) != results["volume"].get(key)]
+            if changed:
+                print(f"Warning: {args.compare} benchmarked a different volume ({', '.join(changed)} differ)")
+            regressions = compare(results, previous, args.threshold)
+        if regressions:
+            sys.exit(f"Slower than {args.compare}: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
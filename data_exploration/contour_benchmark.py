@@ -0,0 +1,62 @@
+# Benchmark of the contoured polygon products against one polygon per gate
+# Renders one sweep as gate polygons and as isobands at several simplification tolerances, and reports the
+# feature count, vertex count (what the browser triangulates), payload size and render time of each
+# Run from the data_exploration directory: python contour_benchmark.py ../data/KTLX_20250129-150000.bin --tolerances 0 250 1000 4000
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from RT_volume_cache import read_radar  # noqa: E402
+from RT_data_processing import select_sweep, stream_sweep_polygons  # noqa: E402
+from RT_contour import stream_sweep_contours  # noqa: E402
+
+def add_storms(radar, field, sweep_index, seed=0):
+    """Replaces a sweep with a few noisy storm cells masked below 5, for volumes scanned in clear air."""
+    rng = np.random.default_rng(seed)
+    sweep = radar.get_slice(sweep_index)
+    azimuths = np.radians(radar.azimuth["data"][sweep])[:, None]
+    ranges = radar.range["data"][None, :]
+    x, y = ranges * np.sin(azimuths), ranges * np.cos(azimuths)
+    values = rng.normal(0, 2, x.shape)
+    for _ in range(12):
+        cx, cy = rng.uniform(-200000, 200000, size=2)
+        values += rng.uniform(30, 65) * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * rng.uniform(1e4, 6e4) ** 2))
+    radar.fields[field]["data"][sweep] = np.ma.masked_less(values, 5.0)
+
+def measure(chunks):
+    start = time.perf_counter()
+    payload = b"".join(chunks)
+    seconds = time.perf_counter() - start
+    features = json.loads(payload)["features"]
+    vertices = sum(len(ring) for feature in features for ring in feature["geometry"]["coordinates"])
+    return seconds, len(features), vertices, len(payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark contoured polygons against gate polygons")
+    parser.add_argument("file", help="Assembled Level II volume")
+    parser.add_argument("--field", default="reflectivity")
+    parser.add_argument("--elevation", type=float, default=0.5)
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[0, 250, 1000, 4000], help="Meters")
+    parser.add_argument("--synthetic", action="store_true", help="Replace the sweep with synthetic storm cells")
+    args = parser.parse_args()
+
+    radar = read_radar(args.file)
+    sweep_index = select_sweep(radar, args.elevation)
+    if args.synthetic:
+        add_storms(radar, args.field, sweep_index)
+
+    print(f"{'product':<18} {'features':>9} {'vertices':>10} {'MB':>8} {'seconds':>8}")
+    rows = [("gate polygons", stream_sweep_polygons(radar, args.field, sweep_index))]
+    rows += [(f"contour {tolerance:g} m", stream_sweep_contours(radar, args.field, sweep_index, tolerance)) for tolerance in args.tolerances]
+    for name, chunks in rows:
+        seconds, features, vertices, size = measure(chunks)
+        print(f"{name:<18} {features:>9} {vertices:>10} {size / 1024**2:>8.2f} {seconds:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Benchmark of Level II volume decoding against the number of decompression threads
+# Times Py-ART reading a compressed volume on its own (every bzip2 record decompressed one after the other) and
+# decode_volume() with the records spread over 1, 2, 4... threads, then checks both give the same fields.
+# Volumes stored uncompressed are recompressed into LDM records first, as they come from the chunk bucket
+# Run from the data_exploration directory: python decode_benchmark.py ../data/KTLX_20250129-150000.bin --repeat 3
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import pyart  # noqa: E402
+
+from RT_level2 import is_compressed, volume_to_chunks, decompress_volume  # noqa: E402
+from RT_volume_cache import decode_volume  # noqa: E402
+
+def best_of(repeat, fn, *args):
+    """Returns the fastest of repeat runs (seconds) and the last result."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+def same_fields(a, b):
+    return a.fields.keys() == b.fields.keys() and all(
+        np.ma.allequal(a.fields[field]["data"], b.fields[field]["data"])
+        and np.array_equal(np.ma.getmaskarray(a.fields[field]["data"]), np.ma.getmaskarray(b.fields[field]["data"]))
+        for field in a.fields
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel decompression of Level II volumes")
+    parser.add_argument("file", help="Assembled Level II volume")
+    cores = os.cpu_count() or 1
+    parser.add_argument("--workers", type=int, nargs="+", default=[n for n in (1, 2, 4, 8, 16) if n < cores] + [cores])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is reported")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    if not is_compressed(data):
+        data = b"".join(chunk for _, chunk in volume_to_chunks(data))
+    print(f"{args.file}: {len(data) / 1024**2:.1f} MB compressed, {os.cpu_count()} cores")
+
+    serial, reference = best_of(args.repeat, lambda: pyart.io.read_nexrad_archive(io.BytesIO(data)))
+    print(f"{'workers':>7} {'decompress s':>12} {'decode s':>9} {'speedup':>8}")
+    print(f"{'pyart':>7} {'':>12} {serial:>9.3f} {1.0:>8.2f}")
+    for workers in args.workers:
+        decompress, _ = best_of(args.repeat, decompress_volume, data, workers)
+        decode, radar = best_of(args.repeat, lambda: pyart.io.read_nexrad_archive(io.BytesIO(decompress_volume(data, workers))))
+        print(f"{workers:>7} {decompress:>12.3f} {decode:>9.3f} {serial / decode:>8.2f}")
+    if not same_fields(reference, radar) or not same_fields(reference, decode_volume(data)):
+        sys.exit("Parallel decode differs from Py-ART's own")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Benchmark of the derived volume products (composite reflectivity, echo tops, VIL)
+# Times the sampling of every elevation onto the common layout, which all the products share, then each product
+# computed from it, and reports the coverage and peak value of every product
+# Run from the data_exploration directory: python derived_benchmark.py ../data/KTLX_20250129-150000.bin --repeat 5
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from RT_volume_cache import read_radar  # noqa: E402
+from RT_derived import DERIVED_FIELDS, sample_levels  # noqa: E402
+
+def best_of(repeat, fn, *args):
+    """Returns the fastest of repeat runs (seconds) and the last result."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the derived volume products")
+    parser.add_argument("files", nargs="+", help="Assembled Level II volumes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is reported")
+    args = parser.parse_args()
+
+    print(f"{'volume':<28} {'product':<24} {'ms':>8} {'valid %':>8} {'max':>8}")
+    for file_path in args.files:
+        radar = read_radar(file_path)
+        name = os.path.basename(file_path)
+        seconds, (_, levels) = best_of(args.repeat, sample_levels, radar)
+        print(f"{name:<28} {f'sampling ({len(levels)} levels)':<24} {1000 * seconds:>8.1f}")
+        total = seconds
+        for field, settings in DERIVED_FIELDS.items():
+            seconds, values = best_of(args.repeat, settings["compute"], levels)
+            total += seconds
+            valid = ~np.isnan(values)
+            peak = f"{np.nanmax(values):>8.1f}" if valid.any() else f"{'-':>8}"
+            print(f"{name:<28} {field:<24} {1000 * seconds:>8.1f} {100 * valid.mean():>8.2f} {peak}")
+        print(f"{name:<28} {'total':<24} {1000 * total:>8.1f}")
+
+if __name__ == "__main__":
+    main()
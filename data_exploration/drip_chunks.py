@@ -0,0 +1,46 @@
+# Stand-in for the real-time chunk bucket: splits an assembled Level II volume into S/I/E chunks and drips them
+# into a local directory laid out like unidata-nexrad-level2-chunks, one chunk every few seconds
+# Point backend/RT_progressive_ingest.LocalChunkSource at the output directory to follow the volume as it "scans"
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from RT_level2 import volume_to_chunks
+
+def drip_chunks(file_path, root, radar_id, volume, timestamp, interval=1.0):
+    """
+    Writes the chunks of a volume to {root}/{radar_id}/{volume}/ one at a time.
+
+    Args:
+        file_path (str): Assembled Level II volume to split.
+        root (str): Root directory of the stand-in bucket.
+        radar_id (str): The radar station ID used in the keys.
+        volume (int): Volume number used in the keys.
+        timestamp (str): Scan time as YYYYMMDD-HHMMSS.
+        interval (float): Seconds to wait between chunks.
+    """
+    with open(file_path, "rb") as volume_file:
+        chunks = volume_to_chunks(volume_file.read())
+
+    volume_dir = os.path.join(root, radar_id, str(volume))
+    os.makedirs(volume_dir, exist_ok=True)
+    for seq, (chunk_type, data) in enumerate(chunks, start=1):
+        path = os.path.join(volume_dir, f"{timestamp}-{seq:03d}-{chunk_type}")
+        with open(f"{path}.tmp", "wb") as chunk_file:
+            chunk_file.write(data)
+        os.replace(f"{path}.tmp", path)  # Readers never see a half-written chunk
+        print(f"Dripped chunk {seq}/{len(chunks)} ({chunk_type}, {len(data)} bytes)")
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drip a Level II volume into a local chunk directory")
+    parser.add_argument("file", help="Assembled Level II volume")
+    parser.add_argument("root", help="Root directory of the stand-in bucket")
+    parser.add_argument("--radar", default="KTLX")
+    parser.add_argument("--volume", type=int, default=1)
+    parser.add_argument("--timestamp", default=time.strftime("%Y%m%d-%H%M%S", time.gmtime()))
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+    drip_chunks(args.file, args.root, args.radar, args.volume, args.timestamp, args.interval)
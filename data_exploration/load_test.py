@@ -0,0 +1,117 @@
+# Load test of the product endpoints, showing how render throughput scales with the size of the CPU process pool
+# Starts the API once per worker count against a copy of a local volume (no S3, no background scheduler) and
+# fires concurrent requests at it
+# Run from the data_exploration directory: python load_test.py ../data/KTLX_20250129-150000.bin --workers 1 2 4 8
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+def fetch(url):
+    """GETs a URL and returns (seconds, bytes)."""
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=600) as response:
+        size = len(response.read())
+    return time.perf_counter() - start, size
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=600) as response:
+        return json.loads(response.read())
+
+def fire(urls, concurrency):
+    """Requests every URL with the given concurrency. Returns (wall seconds, per-request seconds)."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    return time.perf_counter() - start, sorted(seconds for seconds, _ in results)
+
+def start_server(workdir, port, workers, backend_dir=BACKEND_DIR):
+    python_path = os.pathsep.join(filter(None, [os.path.abspath(backend_dir), os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, RADAR_CPU_WORKERS=str(workers), INGEST_SCHEDULER="0",
+               PRODUCT_CACHE_DIR=os.path.join(workdir, "data", "products"), PYTHONPATH=python_path)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.join(workdir, "backend"), env=env, stdout=subprocess.DEVNULL,
+    )
+    for _ in range(600):
+        try:
+            fetch_json(f"http://127.0.0.1:{port}/get-cache-stats")
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("API did not start")
+
+def run(file_path, radar_id, workers, concurrency, port, coalesce_requests):
+    # The API resolves ../data relative to its working directory, so lay out a fresh backend/ and data/ pair
+    workdir = tempfile.mkdtemp(prefix="radar-load-")
+    os.makedirs(os.path.join(workdir, "backend"))
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(file_path, os.path.join(workdir, "data", f"{radar_id}_20000101-000000.bin"))
+    base = f"http://127.0.0.1:{port}"
+
+    server = start_server(workdir, port, workers)
+    try:
+        dropdowns = fetch_json(f"{base}/get-dropdowns/{radar_id}")
+        fields = dropdowns["radar_fields"]
+        tilts = sorted(dropdowns["elevation_angles"])
+
+        # Warm every worker's decoded volume cache with the (cheap) binary products, so the timed phase measures rendering
+        fire([f"{base}/get-binary/{field}/{tilt}/{radar_id}" for field in fields for tilt in tilts], concurrency)
+
+        # Distinct, uncached products: every request is a real render
+        urls = [f"{base}/get-polygons/{field}/{tilt}/{radar_id}" for field in fields for tilt in tilts]
+        wall, latencies = fire(urls, concurrency)
+
+        # Identical concurrent requests: should collapse onto one render
+        before = fetch_json(f"{base}/get-cache-stats")["single_flight"]
+        fire([f"{base}/get/{fields[0]}/{tilts[-1]}/{radar_id}"] * coalesce_requests, coalesce_requests)
+        after = fetch_json(f"{base}/get-cache-stats")["single_flight"]
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "workers": workers,
+        "requests": len(urls),
+        "seconds": wall,
+        "requests_per_second": len(urls) / wall,
+        "p50_seconds": latencies[len(latencies) // 2],
+        "p95_seconds": latencies[int(len(latencies) * 0.95)],
+        "identical_requests": coalesce_requests,
+        "computations": after["leaders"] - before["leaders"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the product endpoints at several CPU pool sizes")
+    parser.add_argument("file", help="Assembled Level II volume to serve")
+    parser.add_argument("--radar", default="KTLX", help="Radar ID to serve the volume as")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 4])
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--coalesce", type=int, default=16, help="Identical concurrent requests in the coalescing check")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = []
+    for workers in sorted(set(args.workers)):
+        result = run(args.file, args.radar, workers, args.concurrency, args.port, args.coalesce)
+        results.append(result)
+        print(f"{workers:>3} workers: {result['requests_per_second']:6.2f} req/s "
+              f"(p50 {result['p50_seconds']:.2f}s, p95 {result['p95_seconds']:.2f}s), "
+              f"{result['identical_requests']} identical requests -> {result['computations']} computation(s)")
+
+    baseline = results[0]["requests_per_second"]
+    for result in results:
+        print(f"{result['workers']:>3} workers: {result['requests_per_second'] / baseline:.2f}x the throughput of {results[0]['workers']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Benchmark of the GeoJSON product responses: time to first byte, total time, bytes on the wire and peak memory
+# of the API process and its render workers, for a freshly rendered and for a cached product, with and
+# without compression
+# Run from the data_exploration directory: python response_benchmark.py ../data/KTLX_20250129-150000.bin
+# Add --baseline to serve the same requests from the backend before streamed responses, which decoded the
+# product into a string and returned it JSON-encoded
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import urllib.request
+
+from load_test import BACKEND_DIR, start_server, fetch
+
+BASELINE_REVISION = "586821a^"  # Last commit before GeoJSON products were streamed as application/geo+json
+
+def timed_get(url, encoding=None):
+    """GETs a URL and returns (seconds to first body byte, total seconds, bytes on the wire)."""
+    request = urllib.request.Request(url, headers={"Accept-Encoding": encoding} if encoding else {})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        size = len(response.read(1))
+        first_byte = time.perf_counter() - start
+        while True:
+            chunk = response.read(1 << 20)
+            if not chunk:
+                break
+            size += len(chunk)
+    return first_byte, time.perf_counter() - start, size
+
+def vm_hwm(pid):
+    """Peak resident set size (MB) of a process."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            return next(int(line.split()[1]) / 1024 for line in status if line.startswith("VmHWM"))
+    except (OSError, StopIteration):
+        return 0.0
+
+def descendants(pid):
+    """Every process below pid (render workers are started by the forkserver, itself a child of the API)."""
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as child_list:
+                children += child_list.read().split()
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in descendants(child)]
+
+def peak_rss(pid):
+    """Peak resident set size (MB) of a process and the largest one among its descendants."""
+    return vm_hwm(pid), max((vm_hwm(child) for child in descendants(pid)), default=0.0)
+
+def export_backend(revision, workdir):
+    """Extracts the backend directory of a git revision under workdir. Returns its path."""
+    archive = subprocess.run(["git", "-C", BACKEND_DIR, "archive", revision, "--", "."],
+                             check=True, capture_output=True).stdout
+    backend_dir = os.path.join(workdir, "baseline")
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(backend_dir)
+    return backend_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GeoJSON product responses")
+    parser.add_argument("file", help="Assembled Level II volume to serve")
+    parser.add_argument("--radar", default="KTLX", help="Radar ID to serve the volume as")
+    parser.add_argument("--field", default="reflectivity")
+    parser.add_argument("--tilt", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_REVISION, metavar="REVISION",
+                        help=f"Serve from the backend of a git revision instead (default {BASELINE_REVISION})")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="radar-response-")
+    os.makedirs(os.path.join(workdir, "backend"))
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(args.file, os.path.join(workdir, "data", f"{args.radar}_20000101-000000.bin"))
+    base = f"http://127.0.0.1:{args.port}"
+    url = f"{base}/get-polygons/{args.field}/{args.tilt}/{args.radar}"
+
+    backend_dir = export_backend(args.baseline, workdir) if args.baseline else BACKEND_DIR
+    server = start_server(workdir, args.port, 1, backend_dir)
+    try:
+        # Decode the volume in the worker first, so the render timing does not include it
+        fetch(f"{base}/get-binary/{args.field}/{args.tilt}/{args.radar}")
+        rows = [("rendered", *timed_get(url))]
+        for encoding in (None, "gzip", "br"):
+            rows.append((f"cached, {encoding or 'identity'}", *timed_get(url, encoding)))
+        api_rss, worker_rss = peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'response':<18} {'TTFB s':>8} {'total s':>8} {'MB':>9}")
+    for name, first_byte, total, size in rows:
+        print(f"{name:<18} {first_byte:>8.2f} {total:>8.2f} {size / 1024**2:>9.1f}")
+    print(f"Peak RSS: API process {api_rss:.0f} MB, render worker {worker_rss:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+# Synthetic NEXRAD Level II volumes and a local stand-in for the chunk bucket, for benchmarks that need neither
+# network access nor a volume with weather in it
+# generate_volume() builds an uncompressed volume message by message (metadata record with the VCP in message 5,
+# then one message 31 per radial with REF/VEL/SW and optionally the dual-pol moments) from a few storm cells in a
+# steady wind; volume_to_chunks in RT_level2 compresses it into the S/I/E chunks the bucket serves, and LocalBucket
+# answers the S3 calls the backend makes (list_objects_v2, get_object, download_file) from a directory of them
+# Run from the data_exploration directory: python synthetic_level2.py ../data --vcp 212 --bucket /tmp/bucket
+import argparse
+import io
+import math
+import os
+import shutil
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from RT_level2 import (  # noqa: E402
+    CTM_HEADER_SIZE, MESSAGE_HEADER, RECORD_SIZE, MSG31_HEADER, MSG31_BLOCKS, MSG5_HEADER, MSG5_CUT_SIZE,
+    START_OF_ELEVATION, INTERMEDIATE_RADIAL, END_OF_ELEVATION, START_OF_VOLUME, END_OF_VOLUME,
+    START_OF_LAST_ELEVATION, volume_to_chunks,
+)
+
+VOLUME_HEADER = struct.Struct(">9s3sII4s")  # Tape name, extension, modified Julian date, ms past midnight, ICAO
+VOLUME_BLOCK = struct.Struct(">c3sHBBffhHfffffH2x")  # Site location, calibration and VCP of every radial
+ELEVATION_BLOCK = struct.Struct(">c3sHhf")
+RADIAL_BLOCK = struct.Struct(">c3sHhffh2x")  # Unambiguous range (0.1 km), noise levels, Nyquist velocity (0.01 m/s)
+MOMENT_BLOCK = struct.Struct(">c3sIHhhhhBBff")  # Gate count, first gate, spacing, thresholds, word size, scale, offset
+MSG5_CUT = struct.Struct(">HBBBBHHhhhhhh24x")  # Elevation angle (360 / 65536 degree units), waveform, super resolution...
+assert MSG5_CUT.size == MSG5_CUT_SIZE
+
+EFFECTIVE_RADIUS = 6371000.0 * 4.0 / 3.0
+FIRST_GATE = 2125  # m, like the WSR-88D
+GATE_SPACING = 250
+SURVEILLANCE_GATES = 1832  # 460 km of reflectivity in the surveillance and batch cuts
+DOPPLER_GATES = 1192  # 300 km of the Doppler and dual-pol moments
+MAX_BEAM_HEIGHT = 21000.0  # m, gates are not recorded above this (70 kft)
+SUPER_RES_MAX_ELEVATION = 1.5  # Cuts at or below this elevation have 0.5 degree radials in super resolution mode
+SWEEP_SECONDS = 20.0  # Scan time of one cut
+
+# Moment encodings as in the ICD: raw = value * scale + offset, raw 0 is below threshold and 1 range folded
+MOMENTS = {
+    "REF": {"word_size": 8, "scale": 2.0, "offset": 66.0},
+    "VEL": {"word_size": 8, "scale": 2.0, "offset": 129.0},
+    "SW": {"word_size": 8, "scale": 2.0, "offset": 129.0},
+    "ZDR": {"word_size": 8, "scale": 16.0, "offset": 128.0},
+    "PHI": {"word_size": 16, "scale": 2.8361, "offset": 2.0},
+    "RHO": {"word_size": 8, "scale": 300.0, "offset": -60.5},
+}
+DUAL_POL_MOMENTS = ("ZDR", "PHI", "RHO")
+
+# Waveforms of the cuts (message 5 codes): contiguous surveillance and Doppler halves of a split cut, batch and
+# contiguous Doppler without range ambiguity resolution, with the moments each one records and its Nyquist (m/s)
+WAVEFORMS = {
+    "CS": {"code": 1, "moments": ("REF",) + DUAL_POL_MOMENTS, "nyquist": 8.5, "unambiguous_range": 466.0},
+    "CD": {"code": 2, "moments": ("REF", "VEL", "SW"), "nyquist": 28.0, "unambiguous_range": 117.0},
+    "B": {"code": 4, "moments": ("REF", "VEL", "SW") + DUAL_POL_MOMENTS, "nyquist": 26.0, "unambiguous_range": 150.0},
+    "CDX": {"code": 3, "moments": ("REF", "VEL", "SW") + DUAL_POL_MOMENTS, "nyquist": 32.0, "unambiguous_range": 117.0},
+}
+
+# Volume coverage patterns: (elevation, waveform) of every cut, in scan order
+_SPLIT_CUTS = [(0.5, "CS"), (0.5, "CD"), (0.9, "CS"), (0.9, "CD"), (1.3, "CS"), (1.3, "CD")]
+VCPS = {
+    212: _SPLIT_CUTS + [(e, "B") for e in (1.8, 2.4, 3.1, 4.0, 5.1, 6.4)] + [(e, "CDX") for e in (8.0, 10.0, 12.5, 15.6, 19.5)],
+    215: _SPLIT_CUTS + [(e, "B") for e in (1.8, 2.4, 3.1, 4.0, 5.1, 6.4)] + [(e, "CDX") for e in (8.0, 10.0, 12.0, 14.0, 16.7, 19.5)],
+    35: _SPLIT_CUTS + [(e, "B") for e in (1.8, 2.4, 3.1, 4.0, 5.1, 6.4)],
+    31: [(0.5, "CS"), (0.5, "CD"), (1.5, "CS"), (1.5, "CD"), (2.5, "CS"), (2.5, "CD"), (3.5, "B"), (4.5, "B")],
+}
+
+# Metadata record of a real volume: clutter filter maps (15, 13), adaptation data (18), performance (3), VCP (5)
+# and RDA status (2), every one a 2432 byte message. Only message 5 carries anything here
+METADATA_MESSAGES = [15] * 77 + [13] * 49 + [18] * 4 + [3, 5, 2]
+
+def beam_height(ranges, elevation):
+    """Height (m) of the beam above the radar at slant ranges (m), 4/3 earth model."""
+    angle = math.radians(elevation)
+    return np.sqrt(ranges ** 2 + EFFECTIVE_RADIUS ** 2 + 2 * ranges * EFFECTIVE_RADIUS * math.sin(angle)) - EFFECTIVE_RADIUS
+
+def cut_gates(elevation, waveform):
+    """Gate count of each moment of a cut: the full range of the moment, cut off where the beam tops out."""
+    ranges = FIRST_GATE + GATE_SPACING * np.arange(SURVEILLANCE_GATES, dtype=np.float64)
+    below = int(np.count_nonzero(beam_height(ranges, elevation) <= MAX_BEAM_HEIGHT))
+    return {moment: min(below, SURVEILLANCE_GATES if moment == "REF" and waveform in ("CS", "B") else DOPPLER_GATES)
+            for moment in WAVEFORMS[waveform]["moments"]}
+
+def storm_cells(count, seed=0):
+    """Random storm cells within 250 km of the radar: (x, y, radius, peak dBZ, top) in meters and dBZ."""
+    rng = np.random.default_rng(seed)
+    distance = rng.uniform(20000, 250000, count)
+    bearing = rng.uniform(0, 2 * np.pi, count)
+    return np.column_stack([distance * np.sin(bearing), distance * np.cos(bearing), rng.uniform(5000, 40000, count),
+                            rng.uniform(35, 70, count), rng.uniform(6000, 16000, count)])
+
+def weather(cells, x, y, z, rng):
+    """
+    Reflectivity (dBZ, NaN where there is no echo) at points x, y (m from the radar) and height z (m): each
+    cell is a gaussian in the horizontal that weakens towards its top, over a stratiform layer and noise.
+    """
+    dbz = np.where(z < 4000.0, 12.0 - np.hypot(x, y) / 5000.0, -np.inf)  # Light stratiform rain near the radar
+    for cx, cy, radius, peak, top in cells:
+        horizontal = np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * radius ** 2))
+        vertical = np.clip(1.0 - (z / top) ** 2, 0.0, None)
+        dbz = np.fmax(dbz, np.where(vertical > 0, peak * horizontal * vertical, -np.inf))
+    dbz = dbz + rng.normal(0.0, 2.0, dbz.shape)
+    return np.where(dbz >= 0.0, dbz, np.nan)
+
+def encode(values, moment):
+    """Encodes moment values (NaN for no data) into raw gate values."""
+    settings = MOMENTS[moment]
+    top = 65535 if settings["word_size"] == 16 else 255
+    raw = np.clip(np.rint(np.nan_to_num(values) * settings["scale"] + settings["offset"]), 2, top)
+    raw = np.where(np.isnan(values), 0, raw)
+    return raw.astype(">u2" if settings["word_size"] == 16 else "u1")
+
+def sweep_moments(cells, elevation, waveform, azimuths, wind, rng, dual_pol=True):
+    """
+    Every moment of one cut, on its rays.
+
+    Returns:
+        dict: {moment: raw gate values [rays, gates]} in the encoding of MOMENTS.
+    """
+    gates = {moment: ngates for moment, ngates in cut_gates(elevation, waveform).items()
+             if dual_pol or moment not in DUAL_POL_MOMENTS}
+    ranges = FIRST_GATE + GATE_SPACING * np.arange(max(gates.values()), dtype=np.float64)
+    angle = math.radians(elevation)
+    ground = EFFECTIVE_RADIUS * np.arcsin(ranges * math.cos(angle) / (EFFECTIVE_RADIUS + beam_height(ranges, elevation)))
+    bearing = np.radians(azimuths)[:, None]
+    x, y = ground * np.sin(bearing), ground * np.cos(bearing)
+    z = np.broadcast_to(beam_height(ranges, elevation), x.shape)
+
+    ref = weather(cells, x, y, z, rng)
+    echo = ~np.isnan(ref)
+    nyquist = WAVEFORMS[waveform]["nyquist"]
+    u, v = wind
+    radial = (u * np.sin(bearing) + v * np.cos(bearing)) * math.cos(angle) + rng.normal(0.0, 1.0, ref.shape)
+    values = {
+        "REF": ref,
+        "VEL": np.where(echo, (radial + nyquist) % (2 * nyquist) - nyquist, np.nan),  # Aliased like the real thing
+        "SW": np.where(echo, np.abs(rng.normal(2.0, 1.5, ref.shape)), np.nan),
+        "ZDR": np.where(echo, 0.04 * np.nan_to_num(ref) + rng.normal(0.0, 0.3, ref.shape), np.nan),
+        "PHI": np.where(echo, 40.0 + np.cumsum(np.nan_to_num(ref) > 35.0, axis=1) * 0.05, np.nan),
+        "RHO": np.where(echo, np.clip(rng.normal(0.98, 0.01, ref.shape), 0.2, 1.05), np.nan),
+    }
+    return {moment: encode(values[moment][:, :ngates], moment) for moment, ngates in gates.items()}
+
+def message(msg_type, body, sequence, date, ms):
+    """Frames a message: CTM bytes and message header in front of its body, sized in halfwords."""
+    if len(body) % 2:
+        body += b"\0"
+    header = MESSAGE_HEADER.pack((MESSAGE_HEADER.size + len(body)) // 2, 8, msg_type, sequence % 65536, date, ms, 1, 1)
+    framed = bytes(CTM_HEADER_SIZE) + header + body
+    if msg_type != 31:
+        framed = framed.ljust(RECORD_SIZE, b"\0")
+    return framed
+
+def vcp_message(vcp, cuts, super_res):
+    """Message 5 body: the pattern and every cut's elevation, waveform and super resolution flags."""
+    body = MSG5_HEADER.pack((MSG5_HEADER.size + MSG5_CUT.size * len(cuts)) // 2, 2, vcp, len(cuts), 1, 2, 2)
+    for elevation, waveform in cuts:
+        half_degree = super_res and elevation <= SUPER_RES_MAX_ELEVATION and waveform in ("CS", "CD")
+        body += MSG5_CUT.pack(round(elevation * 65536 / 360), 0, WAVEFORMS[waveform]["code"], 3 if half_degree else 2,
+                              1, 0, 0, 0, 0, 0, 0, 0, 0)
+    return body
+
+def radial_message(radar_id, site, vcp, elevation_number, elevation, waveform, azimuth, azimuth_number,
+                   status, half_degree, moments, ray, date, ms):
+    """Message 31 body of one radial: header, volume, elevation and radial constants, then the moment blocks."""
+    lat, lon, height = site
+    settings = WAVEFORMS[waveform]
+    blocks = [
+        VOLUME_BLOCK.pack(b"R", b"VOL", VOLUME_BLOCK.size, 1, 0, lat, lon, int(height), 20, -44.0, 0.0, 0.0, 0.0, 60.0, vcp),
+        ELEVATION_BLOCK.pack(b"R", b"ELV", ELEVATION_BLOCK.size, -12, -44.0),
+        RADIAL_BLOCK.pack(b"R", b"RAD", RADIAL_BLOCK.size, round(settings["unambiguous_range"] * 10), -80.0, -80.0,
+                          round(settings["nyquist"] * 100)),
+    ]
+    for moment, data in moments.items():
+        settings = MOMENTS[moment]
+        block = MOMENT_BLOCK.pack(b"D", moment.ljust(3).encode("ascii"), 0, data.shape[1], FIRST_GATE, GATE_SPACING,
+                                  0, 0, 0, settings["word_size"], settings["scale"], settings["offset"])
+        block += data[ray].tobytes()
+        blocks.append(block + b"\0" * (len(block) % 2))
+
+    pointers, offset = [], MSG31_HEADER.size + MSG31_BLOCKS.size
+    for block in blocks:
+        pointers.append(offset)
+        offset += len(block)
+    header = MSG31_HEADER.pack(radar_id.encode("ascii"), ms, date, azimuth_number, azimuth, 0, 0, offset,
+                               1 if half_degree else 2, status, elevation_number, 1, elevation)
+    return header + MSG31_BLOCKS.pack(len(blocks), *(pointers + [0] * (10 - len(pointers)))) + b"".join(blocks)
+
+def generate_volume(radar_id="KTLX", site=(35.3333, -97.2778, 370.0), vcp=212, sweeps=None, super_res=True,
+                    dual_pol=True, cells=12, scan_time=None, seed=0):
+    """
+    Builds a synthetic Level II volume.
+
+    Args:
+        radar_id (str): ICAO of the radar, written into the volume header and every radial.
+        site (tuple): (latitude, longitude, height above sea level in m) of the radar.
+        vcp (int): Volume coverage pattern, a key of VCPS.
+        sweeps (int): Only scan the first sweeps cuts of the pattern, None for all of them.
+        super_res (bool): 0.5 degree radials in the split cuts at the lowest elevations, 1 degree otherwise.
+        dual_pol (bool): Record ZDR, PHI and RHO.
+        cells (int): Number of storm cells.
+        scan_time (datetime): Volume start time (UTC), now by default.
+        seed (int): Seed of the storm cells and noise.
+
+    Returns:
+        bytes: The uncompressed volume, volume header followed by the message stream. volume_to_chunks (in
+        RT_level2) splits and compresses it into the chunks of the bucket.
+    """
+    cuts = VCPS[vcp][:sweeps]
+    scan_time = scan_time or datetime.now(timezone.utc).replace(microsecond=0)
+    epoch = datetime(1970, 1, 1, tzinfo=scan_time.tzinfo)
+    date = (scan_time - epoch).days + 1
+    start_ms = int((scan_time - scan_time.replace(hour=0, minute=0, second=0)).total_seconds() * 1000)
+    rng = np.random.default_rng(seed)
+    storms = storm_cells(cells, seed)
+    wind = (15.0, 10.0)
+
+    out = io.BytesIO()
+    out.write(VOLUME_HEADER.pack(b"AR2V0006.", b"001", date, start_ms, radar_id.encode("ascii")))
+    sequence = 0
+    for msg_type in METADATA_MESSAGES:
+        body = vcp_message(vcp, cuts, super_res) if msg_type == 5 else b""
+        out.write(message(msg_type, body, sequence, date, start_ms))
+        sequence += 1
+
+    for number, (elevation, waveform) in enumerate(cuts, start=1):
+        half_degree = super_res and elevation <= SUPER_RES_MAX_ELEVATION and waveform in ("CS", "CD")
+        nrays = 720 if half_degree else 360
+        # Every cut starts wherever the antenna happens to be pointing
+        azimuths = (rng.uniform(0, 360) + (np.arange(nrays) + 0.5) * 360.0 / nrays) % 360.0
+        moments = sweep_moments(storms, elevation, waveform, azimuths, wind, rng, dual_pol)
+
+        cut_ms = start_ms + int((number - 1) * SWEEP_SECONDS * 1000)
+        for ray in range(nrays):
+            if ray == 0:
+                status = START_OF_VOLUME if number == 1 else START_OF_LAST_ELEVATION if number == len(cuts) else START_OF_ELEVATION
+            elif ray == nrays - 1:
+                status = END_OF_VOLUME if number == len(cuts) else END_OF_ELEVATION
+            else:
+                status = INTERMEDIATE_RADIAL
+            ms = (cut_ms + int(ray * SWEEP_SECONDS * 1000 / nrays)) % 86400000
+            body = radial_message(radar_id, site, vcp, number, elevation, waveform, float(azimuths[ray]), ray + 1,
+                                  status, half_degree, moments, ray, date, ms)
+            out.write(message(31, body, sequence, date, ms))
+            sequence += 1
+    return out.getvalue()
+
+def volume_name(radar_id, scan_time):
+    """File name of an assembled volume, like the ingest writes it (KTLX_20250129-150000.bin)."""
+    return f"{radar_id}_{scan_time:%Y%m%d-%H%M%S}.bin"
+
+def write_bucket(root, radar_id, volume, scan_time, chunks):
+    """
+    Lays out the chunks of a volume like the chunk bucket: {root}/{radar_id}/{volume}/{YYYYMMDD-HHMMSS}-{seq}-{type}.
+
+    Returns:
+        list: Keys of the chunks, in sequence order.
+    """
+    volume_dir = os.path.join(root, radar_id, str(volume))
+    os.makedirs(volume_dir, exist_ok=True)
+    keys = []
+    for seq, (chunk_type, data) in enumerate(chunks, start=1):
+        name = f"{scan_time:%Y%m%d-%H%M%S}-{seq:03d}-{chunk_type}"
+        with open(os.path.join(volume_dir, name), "wb") as chunk_file:
+            chunk_file.write(data)
+        keys.append(f"{radar_id}/{volume}/{name}")
+    return keys
+
+class LocalBucket:
+    """
+    Stand-in for the boto3 S3 client of RT_data_query over a directory laid out like the chunk bucket (see
+    write_bucket()), answering the calls the backend makes. Every call sleeps latency seconds first, to stand
+    in for the round trip to S3; the bucket name is ignored.
+    """
+
+    def __init__(self, root, latency=0.0, page_size=1000):
+        self.root = root
+        self.latency = latency
+        self.page_size = page_size
+        self.requests = 0
+
+    def _call(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def _keys(self, prefix):
+        top = os.path.join(self.root, *prefix.split("/")[:-1])
+        keys = []
+        for directory, _, names in os.walk(top):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            keys += [name if relative == "." else f"{relative}/{name}" for name in names]
+        return sorted(key for key in keys if key.startswith(prefix))
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter="", ContinuationToken=None, MaxKeys=None):
+        self._call()
+        after = ContinuationToken or StartAfter
+        keys = [key for key in self._keys(Prefix) if key > after]
+        page = keys[:MaxKeys or self.page_size]
+        response = {
+            "KeyCount": len(page),
+            "Contents": [{"Key": key, "Size": os.path.getsize(self._path(key))} for key in page],
+            "IsTruncated": len(page) < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        if not page:
+            del response["Contents"]  # Like S3, which leaves Contents out of an empty page
+        return response
+
+    def get_object(self, Bucket, Key):
+        self._call()
+        with open(self._path(Key), "rb") as chunk_file:
+            data = chunk_file.read()
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def download_file(self, Bucket, Key, Filename):
+        self._call()
+        shutil.copyfile(self._path(Key), Filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic NEXRAD Level II volume")
+    parser.add_argument("output_dir", help="Directory the assembled (compressed) volume is written to")
+    parser.add_argument("--radar", default="KTLX")
+    parser.add_argument("--vcp", type=int, default=212, choices=sorted(VCPS))
+    parser.add_argument("--sweeps", type=int, help="Only the first cuts of the pattern")
+    parser.add_argument("--no-super-res", dest="super_res", action="store_false")
+    parser.add_argument("--no-dual-pol", dest="dual_pol", action="store_false")
+    parser.add_argument("--cells", type=int, default=12, help="Storm cells")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bucket", help="Also lay the chunks out in this stand-in bucket directory")
+    parser.add_argument("--volume", type=int, default=1, help="Volume number of the chunk keys")
+    args = parser.parse_args()
+
+    scan_time = datetime.now(timezone.utc).replace(microsecond=0)
+    start = time.perf_counter()
+    data = generate_volume(args.radar, vcp=args.vcp, sweeps=args.sweeps, super_res=args.super_res,
+                           dual_pol=args.dual_pol, cells=args.cells, scan_time=scan_time, seed=args.seed)
+    chunks = volume_to_chunks(data)
+    assembled = b"".join(chunk for _, chunk in chunks)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, volume_name(args.radar, scan_time))
+    with open(path, "wb") as volume_file:
+        volume_file.write(assembled)
+    print(f"{path}: {len(data) / 1024**2:.1f} MB of messages, {len(assembled) / 1024**2:.1f} MB in {len(chunks)} "
+          f"chunks ({time.perf_counter() - start:.1f}s)")
+    if args.bucket:
+        keys = write_bucket(args.bucket, args.radar, args.volume, scan_time, chunks)
+        print(f"Wrote {len(keys)} chunks under {os.path.join(args.bucket, args.radar, str(args.volume))}")
+
+if __name__ == "__main__":
+    main()
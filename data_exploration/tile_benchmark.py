@@ -0,0 +1,63 @@
+# Benchmark of vector tile generation per zoom level
+# Renders every tile covering a radar's coverage at each zoom (or a sample of them around the site at high
+# zooms) straight from a decoded volume, bypassing the tile cache, and reports render time and tile size
+# Run from the data_exploration directory: python tile_benchmark.py ../data/KTLX_20250129-150000.bin --zooms 4 6 8 10
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from RT_volume_cache import read_radar  # noqa: E402
+from RT_data_processing import select_sweep  # noqa: E402
+from RT_tiles import render_sweep_tile  # noqa: E402
+
+def tile_of(lat, lon, z):
+    """Returns the (x, y) of the web mercator tile containing a point."""
+    n = 2 ** z
+    lat = math.radians(lat)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def coverage_tiles(radar, z, max_tiles):
+    """Tiles covering the radar's maximum range at zoom z, nearest to the site first, at most max_tiles."""
+    lat = float(radar.latitude["data"][0])
+    lon = float(radar.longitude["data"][0])
+    reach = float(radar.range["data"][-1]) / 111000.0
+    reach_lon = reach / max(math.cos(math.radians(lat)), 0.01)
+    x0, y0 = tile_of(lat + reach, lon - reach_lon, z)
+    x1, y1 = tile_of(lat - reach, lon + reach_lon, z)
+    xc, yc = tile_of(lat, lon, z)
+    tiles = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    tiles.sort(key=lambda tile: (tile[0] - xc) ** 2 + (tile[1] - yc) ** 2)
+    return tiles[:max_tiles]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector tile generation per zoom level")
+    parser.add_argument("file", help="Assembled Level II volume")
+    parser.add_argument("--field", default="reflectivity")
+    parser.add_argument("--elevation", type=float, default=0.5)
+    parser.add_argument("--zooms", type=int, nargs="+", default=[4, 5, 6, 7, 8, 9, 10, 11, 12])
+    parser.add_argument("--max-tiles", type=int, default=64, help="Tiles rendered per zoom level")
+    args = parser.parse_args()
+
+    radar = read_radar(args.file)
+    sweep_index = select_sweep(radar, args.elevation)
+    print(f"{'zoom':>4} {'tiles':>6} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} {'mean KB':>8} {'total MB':>9}")
+    for z in args.zooms:
+        seconds, sizes = [], []
+        for x, y in coverage_tiles(radar, z, args.max_tiles):
+            start = time.perf_counter()
+            tile = render_sweep_tile(radar, args.field, sweep_index, z, x, y)
+            seconds.append(time.perf_counter() - start)
+            sizes.append(len(tile))
+        seconds.sort()
+        print(f"{z:>4} {len(seconds):>6} {1000 * sum(seconds) / len(seconds):>8.1f} "
+              f"{1000 * seconds[int(len(seconds) * 0.95)]:>8.1f} {1000 * seconds[-1]:>8.1f} "
+              f"{sum(sizes) / len(sizes) / 1024:>8.1f} {sum(sizes) / 1024**2:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import { Dropdown, DropdownButton, Button , Form} from "react-bootstrap";
 import "bootstrap/dist/css/bootstrap.min.css";
 import "./App.css";
 import MapComponent from "./MapComponent"; // Import the reusable map component
+import { fetchColorTable } from "./colorTable";
 
 const App = () => {
   const [radarSites, setRadarSites] = useState({});
@@ -20,6 +21,8 @@ const App = () => {
   // State for radar data
   const [radarOverlayData, setRadarData] = useState(null);
   const [radarPolygons, setRadarPolygons] = useState([]); // Store radar polygon data
+  const [mapView, setMapView] = useState(null); // Visible bounds and zoom, so the backend only sends what is on screen
+  const [colorTable, setColorTable] = useState(null); // Turns the quantized "q" codes of the polygons into values and colours
 
   // Toggling radar center and zoom
   //const [mapCenter, setMapCenter] = useState([35.33, -97.28]); // Default to KTLX
@@ -75,10 +78,23 @@ const App = () => {
     }
   }, [selectedRadar, radarSites]);*/
 
+  // Fetch the colour table of the selected field (once per field, see colorTable.js)
+  useEffect(() => {
+    if (selectedField) {
+      fetchColorTable(selectedField)
+        .then(setColorTable)
+        .catch((error) => console.error("Error fetching colour table:", error));
+    }
+  }, [selectedField]);
+
   // Fetch radar polygons from new API endpoint
   useEffect(() => {
     if (selectedRadar && selectedField && selectedElevation) {
-      fetch(`/get-polygons/${selectedField}/${selectedElevation}/${selectedRadar}`)
+      // Rounded so small pans reuse the same request
+      const query = mapView
+        ? `?bbox=${mapView.bounds.map((v) => v.toFixed(2)).join(",")}&zoom=${Math.round(mapView.zoom)}`
+        : "";
+      fetch(`/get-polygons/${selectedField}/${selectedElevation}/${selectedRadar}${query}`)
         .then((response) => response.json())
         .then((data) => {
           //console.log("Received Radar Polygons:", data); //Getting rid of this print statement for now
@@ -94,12 +110,11 @@ const App = () => {
   
           // ✅ Fix: check for valid FeatureCollection
           if (data.type === "FeatureCollection" && Array.isArray(data.features)) {
-            // Filter out NaN values in JS just to be safe
+            // Filter out features without a quantized code in JS just to be safe
             const cleanedFeatures = data.features.filter(
-              (feature) => 
+              (feature) =>
                 feature.properties &&
-                typeof feature.properties.value === "number" &&
-                !isNaN(feature.properties.value)
+                Number.isInteger(feature.properties.q)
             );
             setRadarPolygons(cleanedFeatures);
           } else {
@@ -108,7 +123,7 @@ const App = () => {
         })
         .catch((error) => console.error("Error fetching radar polygons:", error));
     }
-  }, [selectedRadar, selectedField, selectedElevation]);
+  }, [selectedRadar, selectedField, selectedElevation, mapView]);
   
 
   // Handle dropdown selections
@@ -218,6 +233,8 @@ const App = () => {
           zoom={selectedRadar.startsWith("T") ? 8 : 6}
           //zoom={zoom}
           opacity={opacity}
+          colorTable={colorTable}
+          onViewChange={setMapView}
           radarGeoJson={{
             type: "FeatureCollection",
             features: radarPolygons  // Now wrapped properly
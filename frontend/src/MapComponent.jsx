@@ -1,6 +1,8 @@
 import React, { useEffect, useRef, useState } from "react";
 import MapGL from "react-map-gl/maplibre";
 import DeckGL from "@deck.gl/react";
+import { WebMercatorViewport } from "@deck.gl/core";
+import { codeColor, codeValue } from "./colorTable";
 import { GeoJsonLayer } from "@deck.gl/layers";
 
 const MAP_STYLE = "https://basemaps.cartocdn.com/gl/positron-gl-style/style.json";
@@ -11,8 +13,9 @@ const INITIAL_VIEW_STATE = {
   pitch: 0,
   bearing: 0,
 };
+const VIEW_CHANGE_DEBOUNCE_MS = 300; // Wait for panning/zooming to settle before reporting the viewport
 
-export default function MapComponent({ radarGeoJson, opacity, center, zoom }) {
+export default function MapComponent({ radarGeoJson, colorTable, opacity, center, zoom, onViewChange }) {
   const [viewport, setViewport] = useState({
     ...INITIAL_VIEW_STATE,
     longitude: center[1],
@@ -32,6 +35,18 @@ export default function MapComponent({ radarGeoJson, opacity, center, zoom }) {
   }, [center, zoom]);
 
   const deckRef = useRef();
+  const viewTimer = useRef();
+
+  // Reports the visible bounds ([west, south, east, north]) and zoom once the view stops changing
+  const handleViewStateChange = ({ viewState }) => {
+    if (!onViewChange) return;
+    clearTimeout(viewTimer.current);
+    viewTimer.current = setTimeout(() => {
+      const bounds = new WebMercatorViewport(viewState).getBounds();
+      onViewChange({ bounds, zoom: viewState.zoom });
+    }, VIEW_CHANGE_DEBOUNCE_MS);
+  };
+  useEffect(() => () => clearTimeout(viewTimer.current), []);
 
   const radarLayer = new GeoJsonLayer({
     id: "radar-layer",
@@ -41,23 +56,19 @@ export default function MapComponent({ radarGeoJson, opacity, center, zoom }) {
     filled: true,
     extruded: false,
     getFillColor: (feature) => {
-      const hex = feature.properties?.color || "#FF00FF";
-      const bigint = parseInt(hex.slice(1), 16);
-      const r = (bigint >> 16) & 255;
-      const g = (bigint >> 8) & 255;
-      const b = bigint & 255;
-      return [r, g, b, opacity * 255];
+      if (!colorTable) return [255, 0, 255, opacity * 255];
+      return codeColor(colorTable, feature.properties.q, opacity * 255);
     },
     getLineColor: [0, 0, 0, 0],
     updateTriggers: {
-      getFillColor: [radarGeoJson, opacity]
+      getFillColor: [radarGeoJson, colorTable, opacity]
     },
     onHover: ({ object, x, y }) => {
       const tooltip = document.getElementById("tooltip");
-      if (object && object.properties?.value !== undefined) {
+      if (object && colorTable && object.properties?.q !== undefined) {
         tooltip.style.left = `${x}px`;
         tooltip.style.top = `${y}px`;
-        tooltip.innerHTML = `Value: ${object.properties.value.toFixed(2)}`;
+        tooltip.innerHTML = `Value: ${codeValue(colorTable, object.properties.q).toFixed(2)}`;
         tooltip.style.display = "block";
       } else {
         tooltip.style.display = "none";
@@ -71,6 +82,7 @@ export default function MapComponent({ radarGeoJson, opacity, center, zoom }) {
         ref={deckRef}
         initialViewState={viewport}
         controller={true}
+        onViewStateChange={handleViewStateChange}
         layers={[radarLayer]}
       >
         <MapGL mapStyle={MAP_STYLE} />
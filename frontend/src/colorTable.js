@@ -0,0 +1,44 @@
+// Colour lookup tables served by /get-colortable/{field}
+// Products only carry quantized codes ("q"); a table turns a code into its value and RGBA colour
+
+const tables = {};
+
+// Expands the run-length table into one RGBA entry per code
+function expandRuns(levels, runs) {
+  const rgba = new Uint8Array(levels * 4);
+  runs.forEach(([start, r, g, b, a], i) => {
+    const end = i + 1 < runs.length ? runs[i + 1][0] : levels;
+    for (let code = start; code < end; code++) {
+      rgba.set([r, g, b, a], code * 4);
+    }
+  });
+  return rgba;
+}
+
+// Fetches a field's table once; later calls share the same promise
+export function fetchColorTable(field) {
+  if (!tables[field]) {
+    tables[field] = fetch(`/get-colortable/${field}`)
+      .then((response) => response.json())
+      .then((table) => {
+        if (table.error) {
+          throw new Error(table.error);
+        }
+        return { ...table, rgba: expandRuns(table.levels, table.runs) };
+      })
+      .catch((error) => {
+        delete tables[field];
+        throw error;
+      });
+  }
+  return tables[field];
+}
+
+export function codeColor(table, code, alpha = 255) {
+  const i = code * 4;
+  return [table.rgba[i], table.rgba[i + 1], table.rgba[i + 2], (table.rgba[i + 3] * alpha) / 255];
+}
+
+export function codeValue(table, code) {
+  return table.offset + table.scale * code;
+}
@@ -0,0 +1,56 @@
+// Decoder for the animation loops served by /get-loop/{field}/{tilt}/{radar_id}
+// The layout mirrors LOOP_HEADER in backend/RT_loop.py: a keyframe sweep, then the changed gates of every later scan
+
+import { decodeSweep } from "./radarSweep";
+
+const LOOP_MAGIC = "RLOP";
+const HEADER_BYTES = 8;
+const FRAME_HEADER_BYTES = 16;
+const KEYFRAME = 0;
+
+// Applies a changed-gate list to a copy of the previous frame
+function applyDelta(previous, buffer, offset) {
+  const view = new DataView(buffer);
+  const count = view.getUint32(offset, true);
+  const indices = new Uint32Array(buffer, offset + 4, count);
+  const ValueArray = previous.codes.constructor;
+  const codes = new ValueArray(buffer, offset + 4 + count * 4, count);
+  const bits = new Uint8Array(buffer, offset + 4 + count * 4 + count * ValueArray.BYTES_PER_ELEMENT, Math.ceil(count / 8));
+
+  const frame = { ...previous, codes: previous.codes.slice(), mask: previous.mask.slice() };
+  for (let i = 0; i < count; i++) {
+    const index = indices[i];
+    const bit = 0x80 >> (index & 7);
+    frame.codes[index] = codes[i];
+    if ((bits[i >> 3] >> (7 - (i & 7))) & 1) {
+      frame.mask[index >> 3] |= bit;
+    } else {
+      frame.mask[index >> 3] &= ~bit;
+    }
+  }
+  return frame;
+}
+
+// Returns every frame of a loop as a decoded sweep (see decodeSweep) plus its scan time
+export function decodeLoop(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== LOOP_MAGIC) {
+    throw new Error(`Not a radar loop payload (magic ${magic})`);
+  }
+
+  const count = view.getUint16(6, true);
+  const frames = [];
+  let offset = HEADER_BYTES;
+  for (let i = 0; i < count; i++) {
+    const kind = view.getUint8(offset);
+    const time = new Date(view.getFloat64(offset + 4, true) * 1000);
+    const length = view.getUint32(offset + 12, true);
+    offset += FRAME_HEADER_BYTES;
+    const sweep =
+      kind === KEYFRAME ? decodeSweep(buffer.slice(offset, offset + length)) : applyDelta(frames[i - 1], buffer, offset);
+    frames.push({ ...sweep, time });
+    offset += length + ((4 - (length % 4)) % 4);
+  }
+  return frames;
+}
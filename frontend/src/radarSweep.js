@@ -0,0 +1,113 @@
+// Decoder for the packed sweeps served by /get-binary/{field}/{tilt}/{radar_id}
+// The layout mirrors SWEEP_HEADER in backend/RT_data_processing.py
+
+const SWEEP_MAGIC = "RSWP";
+const HEADER_BYTES = 56;
+const EARTH_RADIUS = 6370997.0; // Same sphere as Py-ART's azimuthal equidistant projection
+const EFFECTIVE_RADIUS = EARTH_RADIUS * (4.0 / 3.0); // 4/3 earth beam propagation model
+
+export function decodeSweep(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== SWEEP_MAGIC) {
+    throw new Error(`Not a radar sweep payload (magic ${magic})`);
+  }
+
+  const dtypeCode = view.getUint8(6);
+  const rays = view.getUint32(8, true);
+  const gates = view.getUint32(12, true);
+  const header = {
+    version: view.getUint16(4, true),
+    rays,
+    gates,
+    siteLat: view.getFloat64(16, true),
+    siteLon: view.getFloat64(24, true),
+    fixedAngle: view.getFloat32(32, true),
+    rangeStart: view.getFloat32(36, true),
+    rangeSpacing: view.getFloat32(40, true),
+    scale: view.getFloat32(44, true),
+    offset: view.getFloat32(48, true),
+    siteAlt: view.getFloat32(52, true),
+  };
+
+  let offset = HEADER_BYTES;
+  const azimuths = new Float32Array(buffer, offset, rays);
+  offset += rays * 4;
+  const ValueArray = dtypeCode === 1 ? Uint8Array : Uint16Array;
+  const codes = new ValueArray(buffer, offset, rays * gates);
+  offset += rays * gates * ValueArray.BYTES_PER_ELEMENT;
+  const mask = new Uint8Array(buffer, offset, Math.ceil((rays * gates) / 8));
+
+  return { ...header, azimuths, codes, mask };
+}
+
+export function isValidGate(sweep, index) {
+  return (sweep.mask[index >> 3] >> (7 - (index & 7))) & 1;
+}
+
+// Beam height correction and azimuthal equidistant inverse, as done by Py-ART for gate coordinates
+function gateLonLat(sweep, azimuthDeg, range) {
+  const elev = (sweep.fixedAngle * Math.PI) / 180;
+  const z = Math.sqrt(range ** 2 + EFFECTIVE_RADIUS ** 2 + 2 * range * EFFECTIVE_RADIUS * Math.sin(elev)) - EFFECTIVE_RADIUS;
+  const s = EFFECTIVE_RADIUS * Math.asin((range * Math.cos(elev)) / (EFFECTIVE_RADIUS + z));
+  const az = (azimuthDeg * Math.PI) / 180;
+  const x = s * Math.sin(az);
+  const y = s * Math.cos(az);
+
+  const lat0 = (sweep.siteLat * Math.PI) / 180;
+  const rho = Math.hypot(x, y);
+  if (rho === 0) {
+    return [sweep.siteLon, sweep.siteLat];
+  }
+  const c = rho / EARTH_RADIUS;
+  const lat = Math.asin(Math.cos(c) * Math.sin(lat0) + (y * Math.sin(c) * Math.cos(lat0)) / rho);
+  const lon = Math.atan2(x * Math.sin(c), rho * Math.cos(lat0) * Math.cos(c) - y * Math.sin(lat0) * Math.sin(c));
+  return [sweep.siteLon + (lon * 180) / Math.PI, (lat * 180) / Math.PI];
+}
+
+// Builds binary SolidPolygonLayer data: one closed quad per valid gate plus its decoded value
+export function sweepToPolygons(sweep) {
+  const { rays, gates, azimuths, codes, rangeStart, rangeSpacing } = sweep;
+  const halfBeam = 180 / rays;
+  let count = 0;
+  for (let i = 0; i < rays * gates; i++) {
+    count += isValidGate(sweep, i);
+  }
+
+  const positions = new Float32Array(count * 5 * 2);
+  const startIndices = new Uint32Array(count + 1);
+  const values = new Float32Array(count);
+  let feature = 0;
+  for (let ray = 0; ray < rays; ray++) {
+    const az0 = azimuths[ray] - halfBeam;
+    const az1 = azimuths[ray] + halfBeam;
+    for (let gate = 0; gate < gates; gate++) {
+      const index = ray * gates + gate;
+      if (!isValidGate(sweep, index)) continue;
+      const r0 = rangeStart + (gate - 0.5) * rangeSpacing;
+      const r1 = r0 + rangeSpacing;
+      const ring = [
+        gateLonLat(sweep, az0, r0),
+        gateLonLat(sweep, az0, r1),
+        gateLonLat(sweep, az1, r1),
+        gateLonLat(sweep, az1, r0),
+      ];
+      ring.push(ring[0]);
+      ring.forEach(([lon, lat], corner) => {
+        positions[(feature * 5 + corner) * 2] = lon;
+        positions[(feature * 5 + corner) * 2 + 1] = lat;
+      });
+      values[feature] = sweep.offset + sweep.scale * codes[index];
+      startIndices[feature] = feature * 5;
+      feature++;
+    }
+  }
+  startIndices[count] = count * 5;
+
+  return {
+    length: count,
+    startIndices,
+    attributes: { getPolygon: { value: positions, size: 2 } },
+    values,
+  };
+}